@@ -0,0 +1,49 @@
+   10 REM > Decomp
+   20 REM ArmGPT dict-mode reply decompressor for RISC OS
+   30 REM Generated by wire_compression.py --emit-basic; regenerate rather
+   40 REM than editing the DATA. Sends *WIRE dict, then shows each reply.
+   50 DIM dict$(31)
+   60 RESTORE
+   70 FOR i%=0 TO 31:READ dict$(i%):NEXT
+   80 PROCsend("*WIRE dict")
+   90 IF FNreadline<>"WIRE dict" THEN PRINT "Host does not support dict mode":END
+  100 REPEAT
+  110   INPUT LINE "> " q$
+  120   PROCsend(q$)
+  130   PROCshowreply
+  140 UNTIL FALSE
+  150 END
+  160 REM Print one reply line, expanding codes &80-&9F as they arrive
+  170 REM (expanded replies can be longer than a BASIC string)
+  180 DEF PROCshowreply
+  190 LOCAL r0%,c%,f%
+  200 REPEAT
+  210   SYS "OS_SerialOp",4 TO r0%,c%;f%
+  220   IF (f% AND 2)=0 THEN
+  230     IF c%>=&80 AND c%<=&9F THEN PRINT dict$(c%-&80); ELSE IF c%>=32 THEN VDU c%
+  240   ENDIF
+  250 UNTIL (f% AND 2)=0 AND c%=10
+  260 PRINT
+  270 ENDPROC
+  280 DEF PROCsend(a$)
+  290 LOCAL i%,c%,f%
+  300 FOR i%=1 TO LEN(a$)+1
+  310   IF i%>LEN(a$) THEN c%=10 ELSE c%=ASC(MID$(a$,i%,1))
+  320   REPEAT:SYS "OS_SerialOp",3,c% TO ;f%:UNTIL (f% AND 2)=0
+  330 NEXT
+  340 ENDPROC
+  350 DEF FNreadline
+  360 LOCAL l$,r0%,c%,f%
+  370 REPEAT
+  380   SYS "OS_SerialOp",4 TO r0%,c%;f%
+  390   IF (f% AND 2)=0 AND c%>=32 AND LEN(l$)<255 THEN l$+=CHR$c%
+  400 UNTIL (f% AND 2)=0 AND c%=10
+  410 =l$
+  420 DATA " the ","ing "," and ","tion"
+  430 DATA " of "," to "," you"," is "
+  440 DATA " in ","ed "," that"," for"
+  450 DATA " with","er "," was "," it "
+  460 DATA " are "," can "," be ","Acorn"
+  470 DATA "ARM","Archimedes","RISC OS","ArmGPT"
+  480 DATA "computer","processor","Sophie Wilson","Steve Furber"
+  490 DATA "'s ",". ",", ","The "
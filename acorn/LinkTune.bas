@@ -0,0 +1,124 @@
+   10 REM > LinkTune
+   20 REM ArmGPT serial link tuning for RISC OS
+   30 REM Steps up through 19200/38400/57600/115200 baud with the host
+   40 REM (link_tune.py or any ArmGPT front-end) and keeps the fastest rate
+   50 REM that passes the ping echo and bulk checksum tests.
+   60 good%=9600
+   70 timeout%=200:REM centiseconds to wait for each line
+   80 ON ERROR PRINT REPORT$;" at line ";ERL:PROCsetbaud(good%):END
+   90 PROCsetbaud(good%)
+  100 PRINT "Asking host to tune the link..."
+  110 PROCsend("*LINKTUNE")
+  120 l$=FNreadline(timeout%)
+  130 IF LEFT$(l$,9)<>"LINKTUNE " THEN PRINT "No reply from host":END
+  140 pings%=VAL(MID$(l$,10))
+  150 done%=FALSE
+  160 REPEAT
+  170   l$=FNreadline(4*timeout%)
+  180   IF LEFT$(l$,5)="RATE " THEN
+  190     rate%=VAL(MID$(l$,6))
+  200     IF FNcode(rate%)=0 THEN
+  210       PROCsend("NAK "+STR$rate%)
+  220     ELSE
+  230       PROCsend("ACK "+STR$rate%)
+  240       PROCwait(5):REM let the ACK leave before switching
+  250       PROCsetbaud(rate%)
+  260       PRINT "Trying ";rate%;" baud... ";
+  270       IF FNtest(rate%) THEN
+  280         good%=rate%:PRINT "ok"
+  290       ELSE
+  300         PROCsetbaud(good%):PRINT "failed"
+  310       ENDIF
+  320     ENDIF
+  330   ENDIF
+  340   IF LEFT$(l$,5)="LINK " THEN
+  350     PROCsetbaud(VAL(MID$(l$,6)))
+  360     PROCsend(l$)
+  370     good%=VAL(MID$(l$,6))
+  380     done%=TRUE
+  390   ENDIF
+  400   IF l$="" THEN done%=TRUE
+  410 UNTIL done%
+  420 PRINT "Link settled at ";good%;" baud"
+  430 END
+  440 DEF FNtest(rate%)
+  450 LOCAL l$,seq%,p$,s%,n%,len%,sum%,i%,d$
+  460 PROCwait(5):REM give the host time to switch too
+  470 FOR seq%=1 TO pings%
+  480   p$=FNpattern(seq%,32)
+  490   s%=FNchecksum(p$)
+  500   PROCsend("PING "+STR$seq%+" "+p$+" "+STR$s%)
+  510   IF FNreadline(timeout%)<>"PONG "+STR$seq%+" "+p$+" "+STR$s% THEN =FALSE
+  520 NEXT
+  530 l$=FNreadline(timeout%)
+  540 IF LEFT$(l$,5)<>"BULK " THEN =FALSE
+  550 l$=MID$(l$,6):n%=VAL(l$)
+  560 l$=MID$(l$,INSTR(l$," ")+1):len%=VAL(l$)
+  570 s%=VAL(MID$(l$,INSTR(l$," ")+1))
+  580 sum%=0
+  590 FOR i%=1 TO n%
+  600   d$=FNreadline(timeout%)
+  610   IF LEN(d$)<>len% THEN PROCsend("BULKBAD"):=FALSE
+  620   sum%=(sum%+FNchecksum(d$)) AND &FFFF
+  630 NEXT
+  640 IF sum%<>s% THEN PROCsend("BULKBAD"):=FALSE
+  650 PROCsend("BULKOK "+STR$sum%)
+  660 =TRUE
+  670 REM Same pattern as make_pattern() in link_tune.py
+  680 DEF FNpattern(seq%,len%)
+  690 LOCAL i%,p$
+  700 FOR i%=0 TO len%-1
+  710   p$+=CHR$(33+(seq%*7+i%*13) MOD 94)
+  720 NEXT
+  730 =p$
+  740 DEF FNchecksum(a$)
+  750 LOCAL i%,s%
+  760 FOR i%=1 TO LEN(a$)
+  770   s%+=ASC(MID$(a$,i%,1))
+  780 NEXT
+  790 =s% AND &FFFF
+  800 REM OS_SerialOp baud rate codes; 0 if the rate is not supported
+  810 DEF FNcode(rate%)
+  820 CASE rate% OF
+  830   WHEN 9600:=7
+  840   WHEN 19200:=8
+  850   WHEN 38400:=16
+  860   WHEN 57600:=17
+  870   WHEN 115200:=18
+  880 ENDCASE
+  890 =0
+  900 DEF PROCsetbaud(rate%)
+  910 SYS "OS_SerialOp",5,FNcode(rate%)
+  920 SYS "OS_SerialOp",6,FNcode(rate%)
+  930 ENDPROC
+  940 DEF PROCsend(a$)
+  950 LOCAL i%
+  960 FOR i%=1 TO LEN(a$)
+  970   PROCputbyte(ASC(MID$(a$,i%,1)))
+  980 NEXT
+  990 PROCputbyte(10)
+ 1000 ENDPROC
+ 1010 DEF PROCputbyte(c%)
+ 1020 LOCAL f%
+ 1030 REPEAT
+ 1040   SYS "OS_SerialOp",3,c% TO ;f%
+ 1050 UNTIL (f% AND 2)=0:REM carry set means the output buffer was full
+ 1060 ENDPROC
+ 1070 REM Read a line, dropping CR; returns "" after t% centiseconds of silence
+ 1080 DEF FNreadline(t%)
+ 1090 LOCAL l$,r0%,c%,f%,end%
+ 1100 end%=TIME+t%
+ 1110 REPEAT
+ 1120   SYS "OS_SerialOp",4 TO r0%,c%;f%
+ 1130   IF (f% AND 2)=0 THEN
+ 1140     IF c%=10 THEN =l$
+ 1150     IF c%<>13 AND LEN(l$)<255 THEN l$+=CHR$c%
+ 1160     end%=TIME+t%
+ 1170   ENDIF
+ 1180 UNTIL TIME>end%
+ 1190 =""
+ 1200 DEF PROCwait(t%)
+ 1210 LOCAL end%
+ 1220 end%=TIME+t%
+ 1230 REPEAT UNTIL TIME>end%
+ 1240 ENDPROC
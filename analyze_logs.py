@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Aggregate the structured request logs written by request_log.py.
+
+Reads logs/*.requests.jsonl (rotated files included) across sessions
+and reports latency percentiles per stage, a breakdown by backend or
+intent, cache outcomes, token counts and decode rate, wire savings and
+throughput per hour.
+
+    python analyze_logs.py                          # every request log in logs/
+    python analyze_logs.py --by intent --since 2026-10-01
+    python analyze_logs.py logs/serial_llm_20261019_*.requests.jsonl --json
+"""
+
+import argparse
+import glob
+import json
+import math
+import sys
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+DEFAULT_PATTERN = "logs/*.requests.jsonl*"
+STAGES = ["started", "embedded", "retrieved", "first_chunk", "generated", "sent"]
+PERCENTILES = (50, 90, 99)
+
+
+def read_records(paths: Iterable[str], since: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Request records from JSONL files, skipping malformed lines and those before `since`."""
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if not isinstance(record, dict) or "received_at" not in record:
+                        continue
+                    if since and str(record.get("ts", "")) < since:
+                        continue
+                    yield record
+        except OSError as e:
+            print(f"Could not read {path}: {e}", file=sys.stderr)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of values, which must be sorted."""
+    if not values:
+        return math.nan
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def distribution(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    summary = {f"p{pct}": percentile(values, pct) for pct in PERCENTILES}
+    summary["max"] = values[-1] if values else math.nan
+    summary["count"] = len(values)
+    return summary
+
+
+def stage_values(records: List[Dict[str, Any]], stage: str) -> List[float]:
+    return [record["stages"][stage] for record in records if stage in record.get("stages", {})]
+
+
+def decode_rate(record: Dict[str, Any]) -> Optional[float]:
+    """Completion tokens per second between the first chunk and the end of generation."""
+    stages = record.get("stages", {})
+    tokens = record.get("completion_tokens")
+    if not tokens or "first_chunk" not in stages or "generated" not in stages:
+        return None
+    seconds = (stages["generated"] - stages["first_chunk"]) / 1000
+    return tokens / seconds if seconds > 0 else None
+
+
+def mean(values: List[float]) -> float:
+    return sum(values) / len(values) if values else math.nan
+
+
+def analyze(records: List[Dict[str, Any]], by: str) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "requests": len(records),
+        "first": min(record["ts"] for record in records),
+        "last": max(record["ts"] for record in records),
+        "outcomes": dict(Counter(record.get("outcome", "unknown") for record in records).most_common()),
+        "stages_ms": {stage: distribution(stage_values(records, stage))
+                      for stage in STAGES if stage_values(records, stage)},
+    }
+
+    groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        groups[str(record.get(by, "-"))].append(record)
+    report["by_" + by] = {
+        name: {
+            "requests": len(group),
+            "first_chunk_ms": distribution(stage_values(group, "first_chunk")),
+            "sent_ms": distribution(stage_values(group, "sent")),
+        }
+        for name, group in sorted(groups.items(), key=lambda item: -len(item[1]))
+    }
+
+    caches = Counter(record["cache"] for record in records if record.get("cache"))
+    looked_up = caches["hit"] + caches["miss"]
+    report["cache"] = dict(caches.most_common())
+    report["cache_hit_rate"] = caches["hit"] / looked_up if looked_up else None
+
+    rates = [rate for rate in map(decode_rate, records) if rate]
+    report["tokens"] = {
+        "prompt_mean": mean([record["prompt_tokens"] for record in records if record.get("prompt_tokens")]),
+        "completion_mean": mean([record["completion_tokens"] for record in records
+                                 if record.get("completion_tokens")]),
+        "decode_tokens_per_s": distribution(rates),
+    }
+    retrieved = [len(record["retrieved"]) for record in records if "retrieved" in record]
+    report["retrieval"] = {"requests": len(retrieved), "chunks_mean": mean(retrieved)}
+
+    text_bytes = sum(record.get("text_bytes", 0) for record in records)
+    wire_bytes = sum(record.get("wire_bytes", 0) for record in records)
+    report["wire"] = {"text_bytes": text_bytes, "wire_bytes": wire_bytes,
+                      "ratio": wire_bytes / text_bytes if text_bytes else None}
+
+    hours: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for record in records:
+        hours[record["ts"][:13] + ":00"].append(record)
+    report["per_hour"] = {
+        hour: {
+            "requests": len(group),
+            "ok": sum(1 for record in group if record.get("outcome") == "ok"),
+            "sent_p50_ms": percentile(sorted(stage_values(group, "sent")), 50),
+        }
+        for hour, group in sorted(hours.items())
+    }
+    return report
+
+
+def finite(value: Any) -> Any:
+    """The report with NaN replaced by None, for JSON output."""
+    if isinstance(value, dict):
+        return {key: finite(item) for key, item in value.items()}
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def ms(value: float) -> str:
+    return "-" if value is None or math.isnan(value) else f"{value:.0f}"
+
+
+def print_report(report: Dict[str, Any], by: str) -> None:
+    print(f"{report['requests']} requests from {report['first']} to {report['last']}")
+    print("Outcomes: " + ", ".join(f"{name} {count}" for name, count in report["outcomes"].items()))
+
+    print("\nLatency after receipt (ms)")
+    print(f"  {'stage':<12} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for stage, dist in report["stages_ms"].items():
+        print(f"  {stage:<12} {dist['count']:>6} {ms(dist['p50']):>8} {ms(dist['p90']):>8} "
+              f"{ms(dist['p99']):>8} {ms(dist['max']):>8}")
+
+    print(f"\nBy {by}")
+    print(f"  {by:<16} {'requests':>8} {'first p50':>10} {'first p90':>10} {'sent p50':>10} {'sent p90':>10}")
+    for name, group in report["by_" + by].items():
+        first, sent = group["first_chunk_ms"], group["sent_ms"]
+        print(f"  {name[:16]:<16} {group['requests']:>8} {ms(first['p50']):>10} {ms(first['p90']):>10} "
+              f"{ms(sent['p50']):>10} {ms(sent['p90']):>10}")
+
+    if report["cache"]:
+        rate = report["cache_hit_rate"]
+        print("\nCache: " + ", ".join(f"{name} {count}" for name, count in report["cache"].items())
+              + (f" (hit rate {100 * rate:.0f}%)" if rate is not None else ""))
+
+    tokens = report["tokens"]
+    decode = tokens["decode_tokens_per_s"]
+    print(f"\nTokens: prompt mean {ms(tokens['prompt_mean'])}, completion mean {ms(tokens['completion_mean'])}"
+          + (f", decode p50 {decode['p50']:.1f} tok/s" if decode["count"] else ""))
+    retrieval = report["retrieval"]
+    if retrieval["requests"]:
+        print(f"Retrieval: {retrieval['requests']} requests, {retrieval['chunks_mean']:.1f} chunks on average")
+    wire = report["wire"]
+    if wire["ratio"] is not None:
+        print(f"Wire: {wire['text_bytes']} bytes of text sent as {wire['wire_bytes']} ({100 * wire['ratio']:.0f}%)")
+
+    print("\nThroughput per hour")
+    print(f"  {'hour':<17} {'requests':>8} {'ok':>6} {'sent p50':>10}")
+    for hour, row in report["per_hour"].items():
+        print(f"  {hour:<17} {row['requests']:>8} {row['ok']:>6} {ms(row['sent_p50_ms']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate ArmGPT request logs into latency and throughput figures")
+    parser.add_argument("paths", nargs="*", help=f"Request log files (default: {DEFAULT_PATTERN})")
+    parser.add_argument("--by", default="backend", choices=["backend", "intent", "session", "mode", "cache"],
+                        help="Field to break latency down by (default: backend)")
+    parser.add_argument("--since", help="Only requests at or after this ISO date/time, e.g. 2026-10-01")
+    parser.add_argument("--json", action="store_true", help="Print the aggregates as JSON")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(DEFAULT_PATTERN))
+    records = list(read_records(paths, args.since))
+    if not records:
+        print(f"No request records in {', '.join(paths) or DEFAULT_PATTERN}")
+        sys.exit(1)
+
+    report = analyze(records, args.by)
+    if args.json:
+        print(json.dumps(finite(report), indent=2))
+    else:
+        print_report(report, args.by)
+
+
+if __name__ == "__main__":
+    main()
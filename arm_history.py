@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Documentation context for the legacy local-model backends.
+
+Messages are looked up in the index built by build_index.py, which
+holds data/arm_docs and the `##` sections of ARM_HISTORY.md, with the
+same hybrid retriever as the Ollama server. BM25 needs nothing but the
+index, so it works on an offline Pi; given an Ollama URL, the query
+embedding is fused in as well. Without a prebuilt index, ARM_HISTORY.md
+is chunked and indexed in memory instead.
+
+Loading runs as a backend startup task, alongside the model load, so
+relevant() returns "" until it has finished.
+"""
+
+import argparse
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+import request_log
+from hybrid_retriever import HybridRetriever, LexicalIndex, pack_chunks, retrieved_ids
+from keyword_matcher import is_conversational
+from text_chunker import chunk_document
+
+logger = logging.getLogger(__name__)
+
+
+class ArmHistory:
+    """Retrieval of the documentation most relevant to a message, within a token budget."""
+
+    def __init__(self, index_path: str = 'data/arm_index.jsonl', history_file: str = 'ARM_HISTORY.md',
+                 max_tokens: int = 400, top_k: int = 4, ollama_url: Optional[str] = None,
+                 embed_model: str = 'nomic-embed-text'):
+        """
+        Args:
+            index_path: Index from build_index.py
+            history_file: Markdown history document, indexed in memory if there is no index
+            max_tokens: Token budget for the retrieved context
+            top_k: Chunks considered before packing them into the budget
+            ollama_url: Ollama API base URL for query embeddings (None = BM25 only)
+            embed_model: Ollama embedding model the index was built with
+        """
+        self.index_path = index_path
+        self.history_file = history_file
+        self.max_tokens = max_tokens
+        self.top_k = top_k
+        self.ollama_url = ollama_url
+        self.embed_model = embed_model
+        self.retriever: Optional[HybridRetriever] = None
+
+    def load(self) -> bool:
+        """Load the index; a backend startup task, so it runs while the serial port opens."""
+        self.retriever = self.open_retriever()
+        return True
+
+    def open_retriever(self) -> Optional[HybridRetriever]:
+        if os.path.exists(self.index_path):
+            retriever = HybridRetriever.load(self.index_path)
+            if retriever:
+                return retriever
+        logger.warning(f"No index at {self.index_path}; indexing {self.history_file} in memory "
+                       f"(run build_index.py to search all the documentation)")
+        chunks = self.history_chunks()
+        if not chunks:
+            return None
+        return HybridRetriever(chunks, LexicalIndex.build(chunks))
+
+    def history_chunks(self) -> List[Dict[str, Any]]:
+        try:
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except OSError as e:
+            logger.warning(f"Could not read {self.history_file}: {e}")
+            return []
+        source = os.path.basename(self.history_file)
+        return [{"source": source, "chunk_id": number, "section": chunk.section,
+                 "text": chunk.text, "n_tokens": chunk.n_tokens}
+                for number, chunk in enumerate(chunk_document(content))]
+
+    def describe(self) -> str:
+        if not self.retriever:
+            return "none"
+        mode = "BM25 + dense" if self.ollama_url and self.retriever.dense else "BM25"
+        return f"{len(self.retriever)} chunks, {mode}"
+
+    def relevant(self, message: str) -> str:
+        """The documentation chunks most relevant to the message, or "" for small talk"""
+        if not self.retriever or is_conversational(message):
+            return ""
+        embedding = None
+        if self.ollama_url:
+            # Imported here so the legacy entry points don't load requests at startup
+            from ollama_backend import embed_query
+            embedding = embed_query(message, self.ollama_url, self.embed_model)
+        results = pack_chunks(self.retriever.search(message, embedding, top_k=self.top_k), self.max_tokens)
+        timings = self.retriever.last_timings
+        logger.info(f"Retrieved {len(results)} chunks "
+                    f"(BM25 {timings['bm25_ms']:.1f} ms, dense {timings['dense_ms']:.1f} ms)")
+        request_log.mark("retrieved")
+        request_log.note(retrieved=retrieved_ids(results))
+        return "\n\n".join(str(chunk.get("text", "")) for chunk, _ in results)
+
+
+def add_context_arguments(parser: argparse.ArgumentParser, context_tokens: int) -> None:
+    """Add the documentation retrieval options shared by the legacy entry points."""
+    parser.add_argument('--index', default='data/arm_index.jsonl',
+                        help='Documentation index from build_index.py (default: data/arm_index.jsonl)')
+    parser.add_argument('--ollama-url', default=None,
+                        help='Ollama API base URL for query embeddings; without it retrieval is BM25 only')
+    parser.add_argument('--context-tokens', type=int, default=context_tokens,
+                        help=f'Token budget for retrieved documentation per message (default: {context_tokens})')
+
+
+def format_user_turn(message: str, relevant_history: str) -> str:
+    """Put any relevant ARM history ahead of the message in the user turn.
+
+    Keeping reference context out of the system prompt leaves earlier turns
+    untouched, so the model's cached state for them stays valid.
+    """
+    if relevant_history:
+        return (f"Relevant ARM History Information:\n{relevant_history}\n\n"
+                f"Use this information to provide accurate, detailed responses about ARM's history "
+                f"and ArmGPT's connection to it.\n\n{message}")
+    return message
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Failover and hedged requests across inference backends.
+
+RoutedBackend sends each message to the primary backend. If no reply text
+has arrived after `hedge_after` seconds (or the primary fails outright),
+the same message is sent to the next backend, and whichever produces text
+first answers the Acorn. Each backend sits behind a circuit breaker so a
+backend that keeps failing is skipped until its cooldown has passed.
+"""
+
+import argparse
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import request_log
+from llm_backends import BACKENDS, Backend, BackendError, CancelToken, create_backend
+
+logger = logging.getLogger(__name__)
+
+NO_BACKEND_REPLY = "Sorry, ArmGPT has no working backend right now. Please try again later."
+FAILED_REPLY = "Sorry, I couldn't generate a response right now. Please try again!"
+
+# Keyword argument each backend takes its model from, for --fallback-model
+MODEL_ARGUMENT = {
+    "ollama": "chat_model",
+    "llamacpp": "model_path",
+    "llamacpp-pool": "model_path",
+    "transformers": "model_name",
+    "codex": "codex_model",
+}
+
+
+class CircuitBreaker:
+    """Closed until `failure_threshold` consecutive failures, then open for `cooldown` seconds.
+
+    After the cooldown one trial request is let through (half-open); its
+    outcome closes the breaker again or re-opens it for another cooldown.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            state = self.state()
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                logger.info("Circuit %s half-open, sending a trial request", self.name)
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info("Circuit %s closed", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                logger.warning("Circuit %s open for %.0f seconds after %d failures",
+                               self.name, self.cooldown, self.failures)
+            self.trial_running = False
+
+    def release(self) -> None:
+        """Give up a trial request whose outcome will never be known."""
+        with self.lock:
+            self.trial_running = False
+
+    def trip(self) -> None:
+        """Open the breaker straight away, e.g. when the backend failed to start."""
+        with self.lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self.opened_at = time.time()
+            self.trial_running = False
+
+
+class Route:
+    """A backend and its circuit breaker."""
+
+    def __init__(self, backend: Backend, failure_threshold: int, cooldown: float):
+        self.backend = backend
+        self.breaker = CircuitBreaker(backend.name, failure_threshold, cooldown)
+
+    def stream(self, message: str, session_id: str, events: "queue.Queue",
+               stop: CancelToken, record: Optional[request_log.RequestRecord] = None) -> None:
+        """Run one request, posting (route, kind, payload) events until done or stopped."""
+        with request_log.active(record):
+            self.run(message, session_id, events, stop)
+
+    def run(self, message: str, session_id: str, events: "queue.Queue", stop: CancelToken) -> None:
+        # The stop token also cancels the backend, so a losing hedge stops generating
+        chunks = self.backend.generate(message, session_id=session_id, cancel=stop)
+        try:
+            for chunk in chunks:
+                if stop.cancelled():
+                    return
+                events.put((self, "chunk", chunk))
+            events.put((self, "done", None))
+        except BackendError as e:
+            events.put((self, "error", e))
+        except Exception as e:
+            logger.error("Backend %s failed: %s", self.backend.name, e, exc_info=True)
+            events.put((self, "error", BackendError(FAILED_REPLY)))
+        finally:
+            chunks.close()
+
+
+class RoutedBackend(Backend):
+    """Primary backend with hedged requests and failover to the backends after it."""
+
+    name = "routed"
+
+    def __init__(self, backends: List[Backend], hedge_after: float = 8.0,
+                 failure_threshold: int = 3, cooldown: float = 60.0):
+        """
+        Args:
+            backends: Backends in order of preference; the first is the primary
+            hedge_after: Seconds without reply text before the next backend is also asked
+            failure_threshold: Consecutive failures that open a backend's circuit
+            cooldown: Seconds an open circuit waits before a trial request
+        """
+        self.routes = [Route(backend, failure_threshold, cooldown) for backend in backends]
+        self.hedge_after = hedge_after
+        self.name = "+".join(backend.name for backend in backends)
+
+    def startup_tasks(self) -> List[Tuple[str, Callable[[], bool]]]:
+        tasks = []
+        for position, route in enumerate(self.routes):
+            for task_name, task in route.backend.startup_tasks():
+                name = f"{route.backend.name}-{task_name}"
+                if position == 0:
+                    tasks.append((name, task))
+                else:
+                    # A fallback that fails to start must not keep the primary from serving
+                    tasks.append((name, self.fallback_task(route, task)))
+        return tasks
+
+    def fallback_task(self, route: Route, task: Callable[[], bool]) -> Callable[[], bool]:
+        def run() -> bool:
+            try:
+                ok = task()
+            except Exception as e:
+                logger.error("Fallback %s failed to start: %s", route.backend.name, e)
+                ok = False
+            if not ok:
+                logger.warning("Fallback %s unavailable until its circuit cools down", route.backend.name)
+                route.breaker.trip()
+            return True
+        return run
+
+    def describe(self) -> List[Tuple[str, str]]:
+        details = []
+        for position, route in enumerate(self.routes):
+            role = "Primary" if position == 0 else "Fallback"
+            details.append((role, route.backend.name))
+            details.extend((f"  {label}", value) for label, value in route.backend.describe())
+        details.append(("Hedge after", f"{self.hedge_after:.1f} seconds"))
+        return details
+
+    def generate(self, message: str, session_id: str = "default",
+                 cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        candidates = [route for route in self.routes if route.breaker.allow()]
+        if not candidates:
+            logger.error("All backend circuits are open")
+            raise BackendError(NO_BACKEND_REPLY)
+
+        events: "queue.Queue" = queue.Queue()
+        stops = {}
+        # Each route notes into its own record; the winner's is kept
+        request = request_log.current()
+        records = {}
+        settled: List[Route] = []
+        failed: List[Route] = []
+        winner: Optional[Route] = None
+        start_time = time.time()
+
+        def launch(route: Route) -> None:
+            stops[route] = CancelToken()
+            records[route] = request_log.RequestRecord(received_at=request.received_at) if request else None
+            threading.Thread(target=route.stream,
+                             args=(message, session_id, events, stops[route], records[route]),
+                             name=f"route-{route.backend.name}", daemon=True).start()
+
+        def cancel_routes() -> None:
+            for stop in list(stops.values()):
+                stop.cancel()
+            events.put((None, "cancelled", None))
+
+        launch(candidates[0])
+        if cancel:
+            cancel.on_cancel(cancel_routes)
+        hedge_at = start_time + self.hedge_after
+        try:
+            while True:
+                if cancel and cancel.cancelled():
+                    logger.info("Request cancelled after %.2f seconds", time.time() - start_time)
+                    return
+                timeout = None
+                if winner is None and len(stops) < len(candidates):
+                    timeout = max(0.0, hedge_at - time.time())
+                try:
+                    route, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    route = candidates[len(stops)]
+                    logger.info("No reply after %.1f seconds, hedging with %s",
+                                time.time() - start_time, route.backend.name)
+                    launch(route)
+                    hedge_at = time.time() + self.hedge_after
+                    continue
+
+                if kind == "cancelled" or (winner is not None and route is not winner):
+                    continue
+
+                if kind == "error":
+                    route.breaker.record_failure()
+                    settled.append(route)
+                    if winner is route:
+                        raise payload
+                    failed.append(route)
+                    logger.warning("Backend %s failed: %s", route.backend.name, payload)
+                    if len(stops) < len(candidates):
+                        # Fail over immediately rather than waiting for the hedge delay
+                        launch(candidates[len(stops)])
+                        hedge_at = time.time() + self.hedge_after
+                    elif len(failed) == len(stops):
+                        raise payload
+                    continue
+
+                if winner is None:
+                    winner = route
+                    logger.info("Backend %s answered first after %.2f seconds",
+                                route.backend.name, time.time() - start_time)
+                    for other, stop in stops.items():
+                        if other is winner:
+                            break
+                        if other not in settled:
+                            # Started earlier and still silent: a stall counts against it
+                            logger.warning("Backend %s stalled; %s answered first",
+                                           other.backend.name, winner.backend.name)
+                            other.breaker.record_failure()
+                            settled.append(other)
+                    for other, stop in stops.items():
+                        if other is not winner:
+                            stop.cancel()
+
+                if kind == "chunk":
+                    yield payload
+                else:
+                    route.breaker.record_success()
+                    settled.append(route)
+                    return
+        finally:
+            if request and winner is not None:
+                request.merge(records[winner])
+                request.note(backend=winner.backend.name, hedged=len(stops) > 1)
+            if cancel:
+                cancel.remove(cancel_routes)
+            for stop in stops.values():
+                stop.cancel()
+            for route in candidates:
+                if route not in settled:
+                    route.breaker.release()
+
+    def close(self) -> None:
+        for route in self.routes:
+            route.backend.close()
+
+
+def add_router_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the fallback and hedging options shared by the entry points."""
+    group = parser.add_argument_group("failover")
+    group.add_argument("--fallback-backend", choices=sorted(BACKENDS),
+                       help="Backend to hedge and fail over to (default: none)")
+    group.add_argument("--fallback-model",
+                       help="Model for the fallback backend (GGUF path, Ollama or Hugging Face model name)")
+    group.add_argument("--hedge-after", type=float, default=8.0,
+                       help="Seconds without reply text before the fallback is also asked (default: 8)")
+    group.add_argument("--breaker-failures", type=int, default=3,
+                       help="Consecutive failures before a backend is taken out of rotation (default: 3)")
+    group.add_argument("--breaker-cooldown", type=float, default=60.0,
+                       help="Seconds before a failed backend is tried again (default: 60)")
+
+
+def with_fallback(primary: Backend, args: argparse.Namespace) -> Backend:
+    """Wrap the primary backend in a RoutedBackend when --fallback-backend is given."""
+    if not args.fallback_backend:
+        return primary
+
+    kwargs = {}
+    if args.fallback_model:
+        kwargs[MODEL_ARGUMENT[args.fallback_backend]] = args.fallback_model
+    fallback = create_backend(args.fallback_backend, **kwargs)
+    return RoutedBackend(
+        [primary, fallback],
+        hedge_after=args.hedge_after,
+        failure_threshold=args.breaker_failures,
+        cooldown=args.breaker_cooldown,
+    )
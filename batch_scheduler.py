@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Continuous batching for the Transformers backend.
+
+Without batching, requests from several serial sessions are generated one
+after another and a small model leaves most of the CPU or GPU idle in
+each decode step. BatchScheduler runs one decode loop for every active
+request. A new request is prefilled on its own and joins the running
+batch at the next token boundary; a finished or cancelled one leaves
+straight away and gives its KV cache back to its conversation.
+
+The batch KV cache is left-padded: each row holds one sequence, with
+zeros in front of shorter ones and an attention mask that hides them.
+Rows are only re-padded when a sequence joins or leaves, not every step.
+
+    python batch_scheduler.py --model TinyLlama/TinyLlama-1.1B-Chat-v1.0 --concurrency 1 2 4 8
+"""
+
+import argparse
+import logging
+import queue
+import threading
+import time
+from typing import Any, Iterator, List, Optional
+
+from llm_backends import CancelToken
+
+# torch is imported inside the methods that need it, as in transformers_backend
+
+logger = logging.getLogger(__name__)
+
+# Seconds stop() waits for the decode loop to finish its current step
+STOP_TIMEOUT = 5.0
+
+
+def to_cache(past: Any) -> Any:
+    """Legacy (key, value) tuples to the cache object the model expects."""
+    if past is None:
+        return None
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return past
+    return DynamicCache.from_legacy_cache(past)
+
+
+def from_cache(cache: Any) -> Any:
+    """The model's cache object back to legacy per-layer (key, value) tuples."""
+    return cache.to_legacy_cache() if hasattr(cache, "to_legacy_cache") else cache
+
+
+def past_length(past: Any) -> int:
+    return past[0][0].shape[2] if past else 0
+
+
+def pad_left(past: Any, padding: int) -> Any:
+    """Prepend `padding` zero positions to every layer's keys and values."""
+    import torch
+
+    padded = []
+    for key, value in past:
+        zeros = key.new_zeros(key.shape[0], key.shape[1], padding, key.shape[3])
+        padded.append((torch.cat([zeros, key], dim=2), torch.cat([zeros, value], dim=2)))
+    return tuple(padded)
+
+
+class Sequence:
+    """One request in the scheduler: its prompt, generated tokens and output stream."""
+
+    def __init__(self, input_ids: List[int], past: Any, max_new_tokens: int,
+                 cancel: Optional[CancelToken], ignore_eos: bool = False):
+        self.input_ids = list(input_ids)
+        self.past = past  # KV cache covering a prefix of input_ids, or None
+        self.max_new_tokens = max_new_tokens
+        self.cancel = cancel
+        self.ignore_eos = ignore_eos
+        self.generated: List[int] = []
+        self.text = ""
+        self.next_token: Optional[int] = None
+        self.final_past: Any = None  # KV cache for input_ids + generated[:-1] once finished
+        self.error: Optional[Exception] = None
+        self.output: queue.Queue = queue.Queue()
+        self.stop_event = threading.Event()
+
+    def stopped(self) -> bool:
+        return self.stop_event.is_set() or (self.cancel is not None and self.cancel.cancelled())
+
+    def abandon(self) -> None:
+        """The reader has gone; drop the sequence at the next token boundary."""
+        self.stop_event.set()
+
+
+class BatchScheduler:
+    """Decode loop that batches every active request on one shared model."""
+
+    def __init__(self, model: Any, tokenizer: Any, max_batch: int = 4,
+                 temperature: float = 0.7, top_p: float = 0.95):
+        """
+        Args:
+            model: Loaded Hugging Face causal LM
+            tokenizer: Its tokenizer
+            max_batch: Most sequences decoded together; later requests wait to join
+            temperature: Sampling temperature; 0 decodes greedily
+            top_p: Nucleus sampling threshold
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch = max(1, max_batch)
+        self.temperature = temperature
+        self.top_p = top_p
+        self.pending: queue.Queue = queue.Queue()
+        self.rows: List[Sequence] = []
+        self.past: Any = None  # Per layer (key, value) of shape [rows, heads, length, head_dim]
+        self.mask: Any = None  # [rows, length]: 1 for real positions, 0 for left padding
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.loop, name="batch-scheduler", daemon=True)
+
+        self.steps = 0
+        self.tokens = 0
+        self.batch_rows = 0
+        self.peak_batch = 0
+
+    def start(self) -> None:
+        self.thread.start()
+        logger.info("Continuous batching with up to %d sequences per step", self.max_batch)
+
+    def stop(self) -> None:
+        """Stop the decode loop and end every unfinished stream with an error."""
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(STOP_TIMEOUT)
+            if self.thread.is_alive():
+                # The rows are still in use; the loop ends them itself once the step is done
+                logger.warning("Batch decode step still running after %.0f s; its streams end when it finishes",
+                               STOP_TIMEOUT)
+                return
+        self.end_unfinished()
+
+    def end_unfinished(self) -> None:
+        """End the streams of every running and waiting sequence; only once the loop has left."""
+        with self.lock:
+            unfinished = list(self.rows)
+            self.rows, self.past, self.mask = [], None, None
+            while True:
+                try:
+                    unfinished.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+        for sequence in unfinished:
+            self.end_stopped(sequence)
+
+    def end_stopped(self, sequence: Sequence) -> None:
+        sequence.error = RuntimeError("Batch scheduler stopped")
+        sequence.output.put(None)
+
+    def submit(self, input_ids: List[int], past: Any = None, max_new_tokens: int = 256,
+               cancel: Optional[CancelToken] = None, ignore_eos: bool = False) -> Sequence:
+        """Queue a request; its text arrives through stream()."""
+        sequence = Sequence(input_ids, past, max_new_tokens, cancel, ignore_eos)
+        # Under the lock, so a request cannot slip into pending after the final drain
+        with self.lock:
+            stopped = self.stop_event.is_set()
+            if not stopped:
+                self.pending.put(sequence)
+        if stopped:
+            self.end_stopped(sequence)
+        return sequence
+
+    def stream(self, sequence: Sequence) -> Iterator[str]:
+        """Yield a submitted sequence's text as it is decoded; re-raises a decode failure."""
+        try:
+            while True:
+                text = sequence.output.get()
+                if text is None:
+                    break
+                yield text
+        finally:
+            sequence.abandon()
+        if sequence.error is not None:
+            raise sequence.error
+
+    # ─── Decode loop ─────────────────────────────────────────────────
+
+    def loop(self) -> None:
+        import torch
+
+        with torch.inference_mode():
+            while not self.stop_event.is_set():
+                try:
+                    self.admit(block=not self.rows)
+                    self.drop_stopped()
+                    if self.rows:
+                        self.step()
+                except Exception as e:
+                    logger.error("Batch decode failed: %s", e, exc_info=True)
+                    for sequence in self.rows:
+                        sequence.error = e
+                        sequence.output.put(None)
+                    self.rows, self.past, self.mask = [], None, None
+        self.end_unfinished()
+
+    def admit(self, block: bool) -> None:
+        """Prefill waiting requests until the batch is full; blocks only when idle."""
+        while len(self.rows) < self.max_batch:
+            try:
+                sequence = self.pending.get(timeout=0.5) if block else self.pending.get_nowait()
+            except queue.Empty:
+                return
+            block = False
+            if sequence.stopped():
+                sequence.output.put(None)
+                continue
+            try:
+                self.prefill(sequence)
+            except Exception as e:
+                logger.error("Prefill failed: %s", e, exc_info=True)
+                sequence.error = e
+                sequence.output.put(None)
+
+    def prefill(self, sequence: Sequence) -> None:
+        import torch
+
+        device = self.model.device
+        cached = past_length(sequence.past)
+        if cached >= len(sequence.input_ids):
+            # At least one token has to be evaluated to get the next token's logits
+            sequence.past, cached = None, 0
+        start = time.time()
+        outputs = self.model(
+            input_ids=torch.tensor([sequence.input_ids[cached:]], device=device),
+            attention_mask=torch.ones(1, len(sequence.input_ids), dtype=torch.long, device=device),
+            past_key_values=to_cache(sequence.past),
+            use_cache=True,
+        )
+        sequence.past = None
+        past = from_cache(outputs.past_key_values)
+        token = self.sample(outputs.logits[:, -1, :])[0]
+        logger.info("Prefilled %d tokens (%d cached) in %.2f seconds; %d in batch",
+                    len(sequence.input_ids) - cached, cached, time.time() - start, len(self.rows) + 1)
+
+        if self.emit(sequence, token):
+            sequence.final_past = past
+            sequence.output.put(None)
+        else:
+            self.join(sequence, past)
+
+    def join(self, sequence: Sequence, past: Any) -> None:
+        """Add a prefilled sequence to the batch, left-padding whichever side is shorter."""
+        import torch
+
+        mask = torch.ones(1, past_length(past), dtype=torch.long, device=self.model.device)
+        if self.past is None:
+            self.past, self.mask, self.rows = past, mask, [sequence]
+            return
+
+        length, new_length = self.mask.shape[1], mask.shape[1]
+        if new_length < length:
+            past = pad_left(past, length - new_length)
+            mask = torch.cat([mask.new_zeros(1, length - new_length), mask], dim=1)
+        elif new_length > length:
+            self.past = pad_left(self.past, new_length - length)
+            self.mask = torch.cat([self.mask.new_zeros(self.mask.shape[0], new_length - length), self.mask], dim=1)
+
+        self.past = tuple((torch.cat([key, new_key]), torch.cat([value, new_value]))
+                          for (key, value), (new_key, new_value) in zip(self.past, past))
+        self.mask = torch.cat([self.mask, mask])
+        self.rows.append(sequence)
+
+    def leave(self, finished: List[int]) -> None:
+        """Remove finished rows, handing each its own unpadded KV cache."""
+        import torch
+
+        for index in finished:
+            sequence = self.rows[index]
+            real = int(self.mask[index].sum())
+            # Real positions are contiguous at the right, after the padding
+            sequence.final_past = tuple((key[index:index + 1, :, -real:, :].clone(),
+                                         value[index:index + 1, :, -real:, :].clone())
+                                        for key, value in self.past)
+            sequence.output.put(None)
+
+        keep = [index for index in range(len(self.rows)) if index not in finished]
+        self.rows = [self.rows[index] for index in keep]
+        if not self.rows:
+            self.past, self.mask = None, None
+            return
+
+        rows = torch.tensor(keep, device=self.mask.device)
+        self.mask = self.mask.index_select(0, rows)
+        # Columns that are padding in every remaining row can go
+        first = int(self.mask.any(dim=0).nonzero()[0])
+        self.mask = self.mask[:, first:]
+        self.past = tuple((key.index_select(0, rows)[:, :, first:, :], value.index_select(0, rows)[:, :, first:, :])
+                          for key, value in self.past)
+
+    def drop_stopped(self) -> None:
+        stopped = [index for index, sequence in enumerate(self.rows) if sequence.stopped()]
+        if stopped:
+            logger.info("%d sequences cancelled", len(stopped))
+            self.leave(stopped)
+
+    def step(self) -> None:
+        """Decode one token for every row in the batch."""
+        import torch
+
+        device = self.model.device
+        tokens = torch.tensor([[sequence.next_token] for sequence in self.rows], device=device)
+        # Each row's new token sits at its own position, after its real tokens only
+        positions = self.mask.sum(dim=1, keepdim=True)
+        mask = torch.cat([self.mask, self.mask.new_ones(self.mask.shape[0], 1)], dim=1)
+        outputs = self.model(
+            input_ids=tokens,
+            attention_mask=mask,
+            position_ids=positions,
+            past_key_values=to_cache(self.past),
+            use_cache=True,
+        )
+        self.past = from_cache(outputs.past_key_values)
+        self.mask = mask
+
+        self.steps += 1
+        self.batch_rows += len(self.rows)
+        self.peak_batch = max(self.peak_batch, len(self.rows))
+
+        finished = []
+        for index, token in enumerate(self.sample(outputs.logits[:, -1, :])):
+            if self.emit(self.rows[index], token):
+                finished.append(index)
+        if finished:
+            self.leave(finished)
+
+    def sample(self, logits: Any) -> List[int]:
+        """Next token for each row: nucleus sampling, or greedy at temperature 0."""
+        import torch
+
+        if self.temperature <= 0:
+            return logits.argmax(dim=-1).tolist()
+        probs = torch.softmax(logits.float() / self.temperature, dim=-1)
+        sorted_probs, indices = probs.sort(dim=-1, descending=True)
+        # Keep the smallest set of tokens whose probability reaches top_p
+        sorted_probs[sorted_probs.cumsum(dim=-1) - sorted_probs > self.top_p] = 0
+        choice = torch.multinomial(sorted_probs, 1)
+        return indices.gather(-1, choice).squeeze(-1).tolist()
+
+    def emit(self, sequence: Sequence, token: int) -> bool:
+        """Record a sampled token and stream any newly complete text; True when finished."""
+        sequence.generated.append(token)
+        sequence.next_token = token
+        self.tokens += 1
+        if token == self.tokenizer.eos_token_id and not sequence.ignore_eos:
+            return True
+
+        text = self.tokenizer.decode(sequence.generated, skip_special_tokens=True)
+        # A multi-byte character split across tokens decodes to U+FFFD until complete
+        if not text.endswith("\ufffd") and len(text) > len(sequence.text):
+            sequence.output.put(text[len(sequence.text):])
+            sequence.text = text
+        return len(sequence.generated) >= sequence.max_new_tokens or sequence.stopped()
+
+    def summary(self) -> str:
+        if not self.steps:
+            return "no batched decoding yet"
+        return "%d tokens in %d decode steps, %.1f sequences per step on average, peak %d" % (
+            self.tokens, self.steps, self.batch_rows / self.steps, self.peak_batch)
+
+
+# ─── Benchmark ───────────────────────────────────────────────────
+
+def benchmark(backend: Any, concurrency: int, tokens: int) -> float:
+    """Run `concurrency` requests at once through a scheduler; returns aggregate tokens/s."""
+    from transformers_backend import BENCHMARK_PROMPT
+
+    scheduler = BatchScheduler(backend.model, backend.tokenizer, max_batch=concurrency)
+    scheduler.start()
+    input_ids = backend.tokenizer(BENCHMARK_PROMPT)['input_ids']
+
+    # Warm-up so one-off allocation costs are not timed
+    for _ in scheduler.stream(scheduler.submit(input_ids, max_new_tokens=2, ignore_eos=True)):
+        pass
+
+    start = time.time()
+    sequences = [scheduler.submit(input_ids, max_new_tokens=tokens, ignore_eos=True) for _ in range(concurrency)]
+    threads = [threading.Thread(target=lambda s=sequence: [None for _ in scheduler.stream(s)])
+               for sequence in sequences]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    scheduler.stop()
+
+    generated = sum(len(sequence.generated) for sequence in sequences)
+    logger.info("Concurrency %d: %s", concurrency, scheduler.summary())
+    return generated / elapsed if elapsed else 0.0
+
+
+def main():
+    from transformers_backend import INFERENCE_PROFILES, TransformersBackend
+
+    parser = argparse.ArgumentParser(description="Benchmark continuous batching on a Transformers model")
+    parser.add_argument("--model", default="TinyLlama/TinyLlama-1.1B-Chat-v1.0", help="Hugging Face model to use")
+    parser.add_argument("--profile", choices=INFERENCE_PROFILES, default="auto", help="Inference profile (default: auto)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="Concurrent request counts to compare (default: 1 2 4 8)")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens generated per request (default: 64)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    backend = TransformersBackend(model_name=args.model, profile=args.profile)
+    if not backend.init_llm():
+        raise SystemExit("Model failed to load")
+
+    print(f"\n{args.model} ({backend.resolve_profile()}), {args.tokens} tokens per request")
+    baseline = None
+    for concurrency in args.concurrency:
+        rate = benchmark(backend, concurrency, args.tokens)
+        baseline = baseline or rate
+        print(f"    {concurrency:2d} concurrent: {rate:7.2f} tokens/sec  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+bench_startup.py — Track cold-start cost of the ArmGPT entry points.
+
+Runs each entry point's import under `python -X importtime` and times
+`<script> --help`, so heavy backends creeping back into module import
+show up as a regression. Results can be saved as a JSON baseline and
+later runs compared against it.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+ENTRY_POINTS = [
+    "arm_gpt_server",
+    "serial_codex_interface",
+    "serial_llm_interface_lite",
+    "serial_llm_interface",
+]
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# "import time: self [us] | cumulative | imported package"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure_import(module: str, python: str) -> Dict[str, Any]:
+    """Import a module under -X importtime and return its cumulative and heaviest imports."""
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+    )
+
+    entries: List[Tuple[int, int, str]] = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append((int(match.group(2)), len(match.group(3)), match.group(4)))
+
+    # importtime lists children before their parent, each level indented two more spaces
+    total_us = 0
+    top_level: List[Tuple[int, str]] = []
+    for position, (cumulative, indent, name) in enumerate(entries):
+        if name != module:
+            continue
+        total_us = cumulative
+        for child_cumulative, child_indent, child_name in reversed(entries[:position]):
+            if child_indent <= indent:
+                break
+            if child_indent == indent + 2:
+                top_level.append((child_cumulative, child_name))
+        break
+
+    top_level.sort(reverse=True)
+    error = ""
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed"
+
+    return {
+        "import_ms": total_us / 1000.0,
+        "heaviest": [{"module": name, "ms": us / 1000.0} for us, name in top_level[:5]],
+        "error": error,
+    }
+
+
+def measure_help(module: str, python: str, runs: int) -> float:
+    """Best-of-N wall time for `<script> --help`, in milliseconds."""
+    script = os.path.join(REPO_DIR, module + ".py")
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([python, script, "--help"], cwd=REPO_DIR, capture_output=True)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000.0
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float) -> List[str]:
+    """Return a message for every entry point slower than baseline by more than tolerance."""
+    regressions = []
+    for module, result in results.items():
+        base = baseline.get(module)
+        if not base:
+            continue
+        for key in ("import_ms", "help_ms"):
+            if base.get(key) and result[key] > base[key] * (1.0 + tolerance):
+                regressions.append(
+                    f"{module} {key}: {result[key]:.1f} ms vs baseline {base[key]:.1f} ms"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import cost of the ArmGPT entry points")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS,
+                        help="Entry point modules to measure (default: all)")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Runs of --help per entry point; the best is reported (default: 3)")
+    parser.add_argument("--python", default=sys.executable,
+                        help="Python interpreter to measure (default: this one)")
+    parser.add_argument("--save", help="Write results to this JSON file, e.g. as a new baseline")
+    parser.add_argument("--baseline", help="Compare against a JSON file written by --save")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline before failing (default: 0.25)")
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for module in args.modules:
+        result = measure_import(module, args.python)
+        result["help_ms"] = measure_help(module, args.python, args.runs)
+        results[module] = result
+
+        print(f"{module}")
+        if result["error"]:
+            print(f"    import failed: {result['error']}")
+        print(f"    import: {result['import_ms']:8.1f} ms    --help: {result['help_ms']:8.1f} ms")
+        for heavy in result["heaviest"]:
+            print(f"      {heavy['ms']:8.1f} ms  {heavy['module']}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[OK] Wrote results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("[FAIL] Startup regressions:")
+            for regression in regressions:
+                print(f"    {regression}")
+            sys.exit(1)
+        print(f"[OK] No entry point slower than baseline by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,46 +2,47 @@
 """
 build_index.py — Build a JSONL vector index from ARM documentation.
 
-Reads .txt files from a docs directory, chunks them, embeds each chunk
-via Ollama's /api/embed endpoint, and writes the result as JSONL.
+Reads .txt files from a docs directory (plus ARM_HISTORY.md), chunks them at sentence and
+heading boundaries (text_chunker.py), embeds each chunk via Ollama's
+/api/embed endpoint, and writes the result as JSONL with each chunk's
+token count. The BM25 postings for hybrid retrieval are written
+alongside it.
+
+The build streams: a process pool reads, cleans and chunks documents
+(a bounded window of them at a time, returned in order), chunks are
+embedded in batches and appended to the output as they arrive, with an
+fsync checkpoint every few batches. An interrupted build continues
+from its last checkpoint with --resume.
+
+Near-duplicate chunks (the same passage quoted in several documents)
+are collapsed with MinHash/LSH before embedding. The kept chunk lists
+where else its passage appears in a "duplicates" field.
+
+Memory stays flat as the corpus grows: the LSH state and the duplicate
+list live in an SQLite scratch file next to the output, and the BM25
+postings are spilled to sorted runs and merged (see hybrid_retriever.py).
+What does grow is a 4-byte length per chunk for BM25.
 """
 
 import os
+import re
 import json
 import glob
+import hashlib
+import time
 import argparse
-from typing import List, Dict, Any
+import itertools
+import resource
+from collections import Counter, deque
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Dict, Any, Deque, Iterable, Iterator, Optional, Set, Tuple
 
 import requests
 
-# Chunking config (simple word-based chunking)
-MAX_WORDS_PER_CHUNK = 220
-OVERLAP_WORDS = 40
-
-
-def read_txt_file(path: str) -> str:
-    with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        return f.read()
-
-
-def chunk_text(text: str,
-               max_words: int = MAX_WORDS_PER_CHUNK,
-               overlap: int = OVERLAP_WORDS) -> List[str]:
-    """Simple word-based chunking with overlap."""
-    words = text.split()
-    if not words:
-        return []
-
-    chunks = []
-    step = max_words - overlap if max_words > overlap else max_words
-
-    for i in range(0, len(words), step):
-        chunk_words = words[i:i + max_words]
-        chunk = " ".join(chunk_words).strip()
-        if chunk:
-            chunks.append(chunk)
-
-    return chunks
+from hybrid_retriever import lexical_index_path, write_lexical_index
+from near_duplicates import DEFAULT_THRESHOLD, LSHIndex, minhash
+from text_chunker import TARGET_TOKENS, Chunk, chunk_document
 
 
 def get_embedding(text: str, ollama_url: str, embed_model: str) -> List[float]:
@@ -88,60 +89,454 @@ def get_embedding(text: str, ollama_url: str, embed_model: str) -> List[float]:
     return emb
 
 
-def build_index(docs_dir: str, output: str, ollama_url: str, embed_model: str) -> None:
-    print(f"Scanning documents in {docs_dir} ...")
-    txt_paths = sorted(glob.glob(os.path.join(docs_dir, "*.txt")))
+def get_embeddings(texts: List[str], ollama_url: str, embed_model: str) -> List[List[float]]:
+    """Embed a batch of texts with one /api/embed call."""
+    url = f"{ollama_url}/api/embed"
+    payload = {
+        "model": embed_model,
+        "input": texts,
+    }
 
-    if not txt_paths:
-        print("[WARN] No .txt files found in", docs_dir)
+    try:
+        resp = requests.post(url, json=payload, timeout=60 + 10 * len(texts))
+        resp.raise_for_status()
+        data = resp.json()
+    except Exception as e:
+        print(f"[ERROR] Batch request to {url} failed: {e}")
+        raise
+
+    embs = data.get("embeddings") if isinstance(data, dict) else None
+    if embs is None and isinstance(data, dict) and "embedding" in data:
+        # Older servers embed one input per request
+        return [get_embedding(text, ollama_url, embed_model) for text in texts]
+    if not isinstance(embs, list) or len(embs) != len(texts) or not all(embs):
+        print("[ERROR] Unexpected batch embedding response structure from Ollama:")
+        print(json.dumps(data, indent=2)[:1000])
+        raise RuntimeError(f"Expected {len(texts)} embeddings from Ollama /api/embed")
+
+    return embs
+
+
+# ─── Document preparation ────────────────────────────────────────
+#
+# Reading, cleaning, chunking and MinHashing are CPU-bound (large OCR'd archives
+# spend most of their time here), so each document is prepared in a
+# worker process. The main process only keeps a bounded window of
+# documents in flight and takes them back in order.
+
+# Running headers and footers are short lines repeated across pages
+HEADER_MAX_CHARS = 40
+HEADER_MIN_REPEATS = 5
+
+# "Page 12" or "Page 12 of 40" is always a page number; a bare number only in context
+PAGE_LABEL_LINE = re.compile(r"^page\s+\d{1,4}(\s+of\s+\d{1,4})?$", re.IGNORECASE)
+# One number, or two for a spread ("40 41")
+BARE_NUMBER_LINE = re.compile(r"^\d{1,4}(\s+\d{1,4})?$")
+# Neighbouring page numbers differ by a few at most (spreads come out of order)
+PAGE_STEP = 3
+# and are separated by a page of text, unlike the rows of a number table
+PAGE_MIN_LINES = 3
+PAGE_LOOKBACK = 4
+# A word split over a line break by OCR or typesetting: "pro-\ncessor"
+HYPHENATED_BREAK = re.compile(r"([a-z])-[ \t]*\n[ \t]*([a-z])")
+CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b-\x1f\x7f\u00ad\ufffd]")
+
+
+def page_number_lines(lines: List[str], page_edges: Set[int]) -> Set[int]:
+    """
+    Indexes of the lines that are page numbers.
+
+    A bare number counts when it is the first or last line of a page
+    (next to a form feed), or when it runs in sequence with other bare
+    numbers a page or so apart, and the document has at least
+    HEADER_MIN_REPEATS of those. A year or a table row on its own line
+    is kept.
+    """
+    found = {i for i in page_edges if BARE_NUMBER_LINE.match(lines[i])}
+    found.update(i for i, line in enumerate(lines) if PAGE_LABEL_LINE.match(line))
+
+    numbers = [(i, [int(value) for value in line.split()]) for i, line in enumerate(lines)
+               if BARE_NUMBER_LINE.match(line)]
+    sequenced = set()
+    for position, (j, values) in enumerate(numbers):
+        # Look back a few numbers, past chapter numbers and the like in between
+        for i, earlier in numbers[max(0, position - PAGE_LOOKBACK):position]:
+            steps = [b - a for a in earlier for b in values]
+            if j - i >= PAGE_MIN_LINES and any(step != 0 and abs(step) <= PAGE_STEP for step in steps):
+                sequenced.update((i, j))
+    if len(sequenced) >= HEADER_MIN_REPEATS:
+        found |= sequenced
+    return found
+
+
+def clean_text(text: str) -> str:
+    """De-hyphenate line breaks, drop running headers, footers and page numbers, and normalise whitespace.
+
+    Paragraphs stay separated by one blank line, which the chunker uses
+    to end a paragraph; longer runs of blank lines are collapsed.
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = HYPHENATED_BREAK.sub(r"\1\2", text)
+
+    lines: List[str] = []
+    page_edges: Set[int] = set()
+    pages = text.split("\f")
+    for page in pages:
+        page_lines = [" ".join(CONTROL_CHARS.sub("", line).split()) for line in page.split("\n")]
+        filled = [len(lines) + i for i, line in enumerate(page_lines) if line]
+        if len(pages) > 1 and filled:
+            page_edges.update((filled[0], filled[-1]))
+        lines.extend(page_lines)
+        lines.append("")
+
+    repeats = Counter(line for line in lines if line and len(line) <= HEADER_MAX_CHARS)
+    page_numbers = page_number_lines(lines, page_edges)
+    kept: List[str] = []
+    for i, line in enumerate(lines):
+        if i in page_numbers or repeats.get(line, 0) >= HEADER_MIN_REPEATS:
+            continue
+        if line or (kept and kept[-1]):
+            kept.append(line)
+    return "\n".join(kept).strip("\n")
+
+
+PreparedDocument = Tuple[str, int, List[Chunk], Optional[List[Optional[array]]]]
+
+
+def prepare_document(path: str, signatures: bool = True,
+                     target_tokens: int = TARGET_TOKENS) -> PreparedDocument:
+    """Read, clean, chunk and MinHash one document; runs in a worker process."""
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        raw_text = f.read()
+    chunks = chunk_document(clean_text(raw_text), target_tokens)
+    return (os.path.basename(path), len(raw_text), chunks,
+            [minhash(chunk.text) for chunk in chunks] if signatures else None)
+
+
+class PrepareStats:
+    """Document preparation throughput."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.docs = 0
+        self.chars = 0
+        self.chunks = 0
+        self.duplicates = 0
+        self.start = time.time()
+        self.elapsed = 0.0
+
+    def add(self, chars: int, chunks: int) -> None:
+        self.docs += 1
+        self.chars += chars
+        self.chunks += chunks
+        self.elapsed = time.time() - self.start
+
+    def summary(self) -> str:
+        rate = self.docs / self.elapsed if self.elapsed else 0.0
+        return (f"Prepared {self.docs} docs ({self.chars / 1e6:.1f}M chars, {self.chunks} chunks) "
+                f"in {self.elapsed:.2f}s with {self.workers} worker(s): {rate:.1f} docs/sec")
+
+    def dedup_summary(self) -> str:
+        ratio = self.duplicates / self.chunks if self.chunks else 0.0
+        return (f"Collapsed {self.duplicates} near-duplicate chunks of {self.chunks} "
+                f"(dedup ratio {ratio:.1%}); {self.chunks - self.duplicates} unique chunks to embed")
+
+
+def iter_prepared(txt_paths: List[str], workers: int, signatures: bool = True,
+                  target_tokens: int = TARGET_TOKENS) -> Iterator[PreparedDocument]:
+    """Prepared documents in input order, fanned out over a process pool."""
+    if workers <= 1:
+        for path in txt_paths:
+            yield prepare_document(path, signatures, target_tokens)
         return
 
-    all_chunks: List[Dict[str, Any]] = []
+    paths = iter(txt_paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # A bounded queue: at most two documents per worker are in flight or waiting
+        pending: Deque[Future] = deque(pool.submit(prepare_document, path, signatures, target_tokens)
+                                       for path in itertools.islice(paths, 2 * workers))
+        while pending:
+            result = pending.popleft().result()
+            for path in itertools.islice(paths, 1):
+                pending.append(pool.submit(prepare_document, path, signatures, target_tokens))
+            yield result
+
+
+def iter_chunks(txt_paths: List[str], workers: int, stats: PrepareStats,
+                lsh: Optional[LSHIndex] = None,
+                target_tokens: int = TARGET_TOKENS) -> Iterator[Dict[str, Any]]:
+    """
+    Unique chunk records for every document, with ids in document order.
+
+    A chunk whose MinHash similarity to an earlier chunk reaches the LSH
+    index's threshold is not yielded; it is recorded in the index as a
+    duplicate of the earlier chunk instead. No index disables dedup.
+    """
     global_chunk_id = 0
-
-    for path in txt_paths:
-        fname = os.path.basename(path)
-        print(f"  - Reading {fname}")
-        raw_text = read_txt_file(path)
+    for fname, chars, chunks, signatures in iter_prepared(txt_paths, workers, lsh is not None, target_tokens):
+        stats.add(chars, len(chunks))
+        print(f"  - Prepared {fname} ({len(chunks)} chunks)")
         doc_id = os.path.splitext(fname)[0]
-
-        chunks = chunk_text(raw_text)
-        for i, chunk_text_str in enumerate(chunks):
-            all_chunks.append({
+        for i, chunk in enumerate(chunks):
+            # Chunks too short for a signature are always kept
+            if lsh is not None and signatures[i] is not None:
+                original = lsh.find(signatures[i])
+                if original is not None:
+                    stats.duplicates += 1
+                    lsh.add_duplicate(original, fname, i)
+                    continue
+                lsh.add(global_chunk_id, signatures[i])
+            yield {
                 "id": global_chunk_id,
                 "doc_id": doc_id,
                 "chunk_id": i,
                 "source": fname,
-                "text": chunk_text_str,
+                "section": chunk.section,
+                "text": chunk.text,
+                "n_tokens": chunk.n_tokens,
                 "embedding": None,
-            })
+            }
             global_chunk_id += 1
 
-    print(f"Total chunks to embed: {len(all_chunks)}")
-    if not all_chunks:
-        print("[WARN] No chunks to embed; exiting.")
-        return
 
-    for idx, chunk in enumerate(all_chunks, start=1):
-        txt = chunk["text"]
-        print(f"[{idx}/{len(all_chunks)}] Embedding chunk id={chunk['id']} from {chunk['source']}")
-        emb = get_embedding(txt, ollama_url, embed_model)
-        chunk["embedding"] = emb
+# ─── Embedding and writing ───────────────────────────────────────
+
+def iter_batches(chunks: Iterable[Dict[str, Any]], batch_size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_embedded(batches: Iterable[List[Dict[str, Any]]], ollama_url: str,
+                  embed_model: str) -> Iterator[Dict[str, Any]]:
+    """Batched embedder: one /api/embed request per batch."""
+    for batch in batches:
+        print(f"[{batch[0]['id'] + 1}-{batch[-1]['id'] + 1}] Embedding {len(batch)} chunks from {batch[0]['source']}")
+        embeddings = get_embeddings([chunk["text"] for chunk in batch], ollama_url, embed_model)
+        for chunk, emb in zip(batch, embeddings):
+            chunk["embedding"] = emb
+            yield chunk
 
-    num_missing = sum(1 for c in all_chunks if not c["embedding"])
-    if num_missing > 0:
-        print(f"[WARN] {num_missing} chunks ended up without embeddings.")
 
+def build_fingerprint(txt_paths: List[str], **options: Any) -> Dict[str, Any]:
+    """The options that decide the chunks and a hash of every input file, for checkpoints."""
+    digest = hashlib.sha256()
+    for path in txt_paths:
+        digest.update(os.path.basename(path).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(b"\0")
+    return {"options": options, "inputs": digest.hexdigest()}
+
+
+class CheckpointWriter:
+    """
+    Append-only JSONL writer with periodic fsync checkpoints.
+
+    Chunks go to <output>.partial. Every `checkpoint_every` chunks the
+    file is flushed and fsynced, then <output>.checkpoint records how
+    many chunks and bytes are safely on disk. A resumed build truncates
+    the partial file back to that point and skips that many chunks;
+    chunking is deterministic, so skipping costs no embed calls.
+
+    That only holds for the same inputs and options, so the checkpoint
+    also stores the build's fingerprint (see build_fingerprint()); a
+    checkpoint from a different build is not resumed.
+    """
+
+    def __init__(self, output: str, checkpoint_every: int = 64, fingerprint: Optional[Dict[str, Any]] = None):
+        self.output = output
+        self.fingerprint = fingerprint or {}
+        self.partial_path = output + ".partial"
+        self.checkpoint_path = output + ".checkpoint"
+        self.checkpoint_every = checkpoint_every
+        self.written = 0
+        self.f = None
+
+    def resume(self) -> int:
+        """Reopen after the last checkpoint; returns the chunks already written."""
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            print(f"[WARN] No usable checkpoint at {self.checkpoint_path}; starting from scratch")
+            return self.start()
+        if checkpoint.get("build") != self.fingerprint:
+            print(f"[WARN] {self.checkpoint_path} is from a build with different documents or options; "
+                  f"starting from scratch")
+            return self.start()
+        if not os.path.exists(self.partial_path) or os.path.getsize(self.partial_path) < checkpoint["bytes"]:
+            print(f"[WARN] {self.partial_path} is shorter than its checkpoint; starting from scratch")
+            return self.start()
+        self.f = open(self.partial_path, "r+b")
+        self.f.truncate(checkpoint["bytes"])
+        self.f.seek(checkpoint["bytes"])
+        self.written = checkpoint["chunks"]
+        print(f"[OK] Resuming after {self.written} checkpointed chunks")
+        return self.written
+
+    def start(self) -> int:
+        os.makedirs(os.path.dirname(self.output) or ".", exist_ok=True)
+        self.f = open(self.partial_path, "wb")
+        self.written = 0
+        return 0
+
+    def write(self, chunk: Dict[str, Any]) -> None:
+        if chunk["embedding"] is None:
+            chunk["embedding"] = []
+        self.f.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.written += 1
+        if self.written % self.checkpoint_every == 0:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"chunks": self.written, "bytes": self.f.tell(), "build": self.fingerprint}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def finish(self, duplicates: Iterable[Tuple[int, List[Dict[str, Any]]]] = ()) -> None:
+        """
+        Move the finished index into place and drop the checkpoint.
+
+        duplicates yields (chunk id, other places its passage appears) in
+        id order, and those chunks get a "duplicates" field. Ids are line
+        numbers, so this is one streaming pass, merged with the
+        duplicates as they come, that only parses the lines it changes.
+        """
+        self.checkpoint()
+        self.f.close()
+        groups = iter(duplicates)
+        group = next(groups, None)
+        if group is not None:
+            tmp_path = self.output + ".tmp"
+            with open(self.partial_path, "r", encoding="utf-8") as src, \
+                    open(tmp_path, "w", encoding="utf-8") as dst:
+                for chunk_id, line in enumerate(src):
+                    if group is not None and group[0] == chunk_id:
+                        chunk = json.loads(line)
+                        chunk["duplicates"] = group[1]
+                        line = json.dumps(chunk, ensure_ascii=False) + "\n"
+                        group = next(groups, None)
+                    dst.write(line)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, self.partial_path)
+        os.replace(self.partial_path, self.output)
+        os.remove(self.checkpoint_path)
+
+    def abort(self) -> None:
+        """Keep the partial file and checkpoint for --resume."""
+        if self.f and not self.f.closed:
+            self.checkpoint()
+            self.f.close()
+
+
+def open_lsh(output: str, dedup_threshold: Optional[float]) -> Optional[LSHIndex]:
+    """The dedup index for a build, kept on disk next to its output; None when dedup is off."""
+    if dedup_threshold is None:
+        return None
     os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
-    with open(output, "w", encoding="utf-8") as f:
-        for chunk in all_chunks:
-            if chunk["embedding"] is None:
-                chunk["embedding"] = []
-            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+    return LSHIndex(dedup_threshold, path=output + ".lsh")
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
 
-    print(f"[OK] Wrote {len(all_chunks)} chunks to {output}")
-    embedded_count = sum(1 for c in all_chunks if c["embedding"])
-    print(f"[OK] Chunks with non-empty embeddings: {embedded_count}")
+
+def build_index(docs_dir: str, output: str, ollama_url: str, embed_model: str,
+                batch_size: int = 16, checkpoint_every: int = 64, resume: bool = False,
+                workers: int = 1, prepare_only: bool = False,
+                dedup_threshold: Optional[float] = DEFAULT_THRESHOLD,
+                target_tokens: int = TARGET_TOKENS, extra_docs: Optional[List[str]] = None,
+                embed: bool = True) -> None:
+    print(f"Scanning documents in {docs_dir} ...")
+    txt_paths = sorted(glob.glob(os.path.join(docs_dir, "*.txt")))
+    for path in extra_docs or []:
+        if os.path.exists(path):
+            txt_paths.append(path)
+        else:
+            print(f"[WARN] Extra document {path} not found; skipping")
+
+    if not txt_paths:
+        print("[WARN] No .txt files found in", docs_dir)
+        return
+
+    stats = PrepareStats(workers)
+    if prepare_only:
+        # Benchmark the read/clean/chunk stage alone
+        lsh = open_lsh(output, dedup_threshold)
+        try:
+            for _ in iter_chunks(txt_paths, workers, stats, lsh, target_tokens=target_tokens):
+                pass
+        finally:
+            if lsh is not None:
+                lsh.close()
+        print(f"[OK] {stats.summary()}")
+        if dedup_threshold is not None:
+            print(f"[OK] {stats.dedup_summary()}")
+        return
+
+    fingerprint = build_fingerprint(txt_paths, target_tokens=target_tokens, dedup_threshold=dedup_threshold,
+                                    embed_model=embed_model if embed else None)
+    writer = CheckpointWriter(output, checkpoint_every, fingerprint)
+    skip = writer.resume() if resume else writer.start()
+
+    start = time.time()
+    # Dedup runs before the resume skip, so a resumed build rebuilds the same LSH state and ids
+    lsh = open_lsh(output, dedup_threshold)
+    chunks = itertools.islice(iter_chunks(txt_paths, workers, stats, lsh, target_tokens), skip, None)
+    if embed:
+        chunks = iter_embedded(iter_batches(chunks, batch_size), ollama_url, embed_model)
+    else:
+        print("Skipping embeddings: the index will support BM25 retrieval only")
+    embedded = 0
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+            embedded += 1
+    except BaseException:
+        writer.abort()
+        if lsh is not None:
+            lsh.close()
+        print(f"[WARN] Build stopped after {writer.written} chunks; "
+              f"rerun with --resume to continue from the last checkpoint")
+        raise
+
+    if not writer.written:
+        writer.abort()
+        if lsh is not None:
+            lsh.close()
+        os.remove(writer.partial_path)
+        os.remove(writer.checkpoint_path)
+        print("[WARN] No chunks to embed; exiting.")
+        return
+    if lsh is not None:
+        writer.finish(lsh.duplicates())
+        lsh.close()
+    else:
+        writer.finish()
+
+    elapsed = time.time() - start
+    print(f"[OK] {stats.summary()}")
+    if dedup_threshold is not None:
+        print(f"[OK] {stats.dedup_summary()}")
+    print(f"[OK] Wrote {writer.written} chunks to {output} "
+          f"({embedded} {'embedded' if embed else 'written'} this run in {elapsed:.1f}s)")
+    num_docs = write_lexical_index(output)
+    print(f"[OK] Wrote BM25 index for {num_docs} chunks to {lexical_index_path(output)}")
+    print(f"[OK] Peak RSS: {peak_rss_mb():.1f} MB")
 
 
 def main():
@@ -156,6 +551,28 @@ def main():
                         help="Ollama embedding model name (default: nomic-embed-text)")
     parser.add_argument("--ollama-url", default="http://localhost:11434",
                         help="Ollama API base URL (default: http://localhost:11434)")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="Chunks per /api/embed request (default: 16)")
+    parser.add_argument("--checkpoint-every", type=int, default=64,
+                        help="Chunks between fsync checkpoints (default: 64)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted build from its last checkpoint")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processes for reading, cleaning and chunking documents (default: CPU count)")
+    parser.add_argument("--prepare-only", action="store_true",
+                        help="Only read, clean and chunk the documents, and report docs/sec")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"MinHash similarity at which chunks are collapsed as near-duplicates "
+                             f"(default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Embed every chunk, even near-duplicates")
+    parser.add_argument("--extra-doc", action="append", default=None,
+                        help="Another document to index, such as a markdown file; repeat for several "
+                             "(default: ARM_HISTORY.md)")
+    parser.add_argument("--no-embed", action="store_true",
+                        help="Build without embeddings, for BM25-only retrieval without Ollama")
+    parser.add_argument("--chunk-tokens", type=int, default=TARGET_TOKENS,
+                        help=f"Target tokens per chunk (default: {TARGET_TOKENS})")
     args = parser.parse_args()
 
     build_index(
@@ -163,6 +580,15 @@ def main():
         output=args.output,
         ollama_url=args.ollama_url,
         embed_model=args.embed_model,
+        batch_size=max(1, args.batch_size),
+        checkpoint_every=max(1, args.checkpoint_every),
+        resume=args.resume,
+        workers=max(1, args.workers),
+        prepare_only=args.prepare_only,
+        dedup_threshold=None if args.no_dedup else args.dedup_threshold,
+        target_tokens=max(32, args.chunk_tokens),
+        extra_docs=args.extra_doc if args.extra_doc is not None else ["ARM_HISTORY.md"],
+        embed=not args.no_embed,
     )
 
 
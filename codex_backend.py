@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Codex backend: answers each message with `codex exec`.
+
+The prompt is grounded with the best-matching chunks of the index built
+by build_index.py, ranked by BM25 (and by embeddings too when an Ollama
+server is given; see hybrid_retriever.py). Without an index it falls
+back to keyword overlap over data/arm_docs. Codex's final message is
+sent back as a single plain-text reply.
+"""
+
+import glob
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import request_log
+from hybrid_retriever import HybridRetriever, retrieved_ids
+from keyword_matcher import Hits, KeywordMatcher, scan_message
+from llm_backends import Backend, BackendError, CancelToken
+from ollama_backend import embed_query
+from text_chunker import chunk_document
+
+logger = logging.getLogger(__name__)
+
+CODEX_FAILED_REPLY = "Sorry, Codex could not answer that just now."
+CODEX_TIMEOUT_REPLY = "Sorry, Codex took too long to reply."
+
+# Chunk size for the keyword fallback, about 180 words
+FALLBACK_CHUNK_TOKENS = 240
+
+# Score added to a fallback chunk for each phrase it contains
+PHRASE_BOOSTS = {
+    "sophie wilson": 4,
+    "steve furber": 4,
+    "acorn archimedes": 3,
+    "risc based home computer": 3,
+    "risc-based home computer": 3,
+    "arm1": 2,
+    "arm2": 2,
+    "a310": 3,
+}
+PHRASE_MATCHER = KeywordMatcher({"boost": PHRASE_BOOSTS})
+
+
+BASE_SYSTEM_PROMPT = """You are ArmGPT, a friendly and knowledgeable AI assistant connected to an Acorn computer via serial port.
+
+Reply as ArmGPT, not as a coding assistant. Keep replies short because the user is reading them on a serial terminal. Aim for one or two concise sentences. Be warm, gentle, and interested in Acorn and retro computing. Use plain text only - no markdown, links, headings, tables, or emoji, since the terminal cannot render them.
+
+Do not edit files, run shell commands, or inspect the repository. Just answer the user's message conversationally.
+
+You may be given documentation context about ARM, Acorn, Archimedes, RISC OS, and ArmGPT history. When it is relevant, prefer it and ground your answer in it. When it is not relevant or does not contain the answer, just answer from your own general knowledge.
+
+Either way, answer the question naturally and directly. Never mention the documentation, the context, or whether it covered the question, and never say things like "the docs don't cover this" or "the provided history doesn't mention that" - the user cannot see any of that and does not need to know it exists. Just give the answer.
+"""
+
+STOPWORDS = {
+    "a",
+    "an",
+    "and",
+    "are",
+    "as",
+    "at",
+    "be",
+    "by",
+    "for",
+    "from",
+    "how",
+    "i",
+    "in",
+    "is",
+    "it",
+    "me",
+    "of",
+    "on",
+    "or",
+    "that",
+    "the",
+    "this",
+    "to",
+    "was",
+    "were",
+    "what",
+    "when",
+    "where",
+    "which",
+    "who",
+    "why",
+    "with",
+    "you",
+}
+
+
+class CodexBackend(Backend):
+    name = "codex"
+
+    def __init__(
+        self,
+        codex_command: str = "codex",
+        codex_model: Optional[str] = None,
+        codex_cwd: str = ".",
+        docs_dir: str = "data/arm_docs",
+        index_path: str = "data/arm_index.jsonl",
+        ollama_url: Optional[str] = None,
+        embed_model: str = "nomic-embed-text",
+        max_context_chars: int = 3600,
+        top_k: int = 4,
+        timeout: int = 180,
+        extra_args: Optional[List[str]] = None,
+    ):
+        self.codex_command = codex_command
+        self.codex_model = codex_model
+        self.codex_cwd = codex_cwd
+        self.docs_dir = docs_dir
+        self.index_path = index_path
+        self.ollama_url = ollama_url
+        self.embed_model = embed_model
+        self.max_context_chars = max_context_chars
+        self.top_k = top_k
+        self.timeout = timeout
+        self.extra_args = extra_args or []
+        self.doc_chunks: List[Dict[str, object]] = []
+        self.retriever: Optional[HybridRetriever] = None
+
+    def resolve_path(self, path: str) -> str:
+        if os.path.isabs(path):
+            return path
+        return os.path.join(self.codex_cwd, path)
+
+    def tokenize(self, text: str) -> List[str]:
+        return [
+            token
+            for token in re.findall(r"[a-z0-9][a-z0-9']+", text.lower())
+            if token not in STOPWORDS and len(token) > 1
+        ]
+
+    def expand_query_tokens(self, hits: Hits, tokens: List[str]) -> List[str]:
+        expanded = list(tokens)
+
+        if hits.has("arm") and hits.has("creation"):
+            expanded.extend(["sophie", "wilson", "steve", "furber"])
+
+        if hits.has("arm") and hits.has("origin"):
+            expanded.extend(["acorn", "sophie", "wilson", "steve", "furber"])
+
+        if hits.has("archimedes"):
+            expanded.extend(["archimedes", "a310", "risc", "home", "computer"])
+
+        return expanded
+
+    def load_doc_chunks(self) -> List[Dict[str, object]]:
+        docs_path = self.resolve_path(self.docs_dir)
+        paths = sorted(glob.glob(os.path.join(docs_path, "*.txt")))
+        chunks: List[Dict[str, object]] = []
+
+        if not paths:
+            logger.warning("No documentation files found in %s", docs_path)
+            return chunks
+
+        for path in paths:
+            try:
+                with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                    text = f.read()
+            except OSError as e:
+                logger.warning("Could not read documentation file %s: %s", path, e)
+                continue
+
+            source = os.path.basename(path)
+            for index, chunk in enumerate(chunk_document(text, FALLBACK_CHUNK_TOKENS)):
+                searchable = source.replace("_", " ") + " " + chunk.text
+                tokens = set(self.tokenize(searchable))
+                chunks.append({
+                    "order": len(chunks),
+                    "source": source,
+                    "chunk_id": index,
+                    "text": chunk.text,
+                    "n_tokens": chunk.n_tokens,
+                    "tokens": tokens,
+                    "boost": sum(PHRASE_BOOSTS[phrase] for phrase in PHRASE_MATCHER.scan(searchable).phrases),
+                })
+
+        logger.info("Loaded %d documentation chunks from %s", len(chunks), docs_path)
+        return chunks
+
+    def load_docs(self) -> bool:
+        index_path = self.resolve_path(self.index_path)
+        if os.path.exists(index_path):
+            self.retriever = HybridRetriever.load(index_path)
+        if not self.retriever:
+            logger.warning("No index at %s; falling back to keyword matching over %s", index_path, self.docs_dir)
+            self.doc_chunks = self.load_doc_chunks()
+        return True
+
+    def score_doc_chunk(self, query_tokens: List[str], hits: Hits, chunk: Dict[str, object]) -> int:
+        token_set = chunk.get("tokens", set())
+        if not isinstance(token_set, set):
+            return 0
+
+        score = len(set(query_tokens) & token_set)
+
+        for token in query_tokens:
+            if token in token_set:
+                score += query_tokens.count(token) - 1
+
+        # Phrase matches were found once, when the chunk was loaded
+        score += int(chunk.get("boost", 0))
+
+        if hits.has("who") and hits.has("creation"):
+            if "sophie" in token_set or "furber" in token_set:
+                score += 6
+
+        if hits.has("archimedes") and ("archimedes" in token_set or "a310" in token_set):
+            score += 5
+
+        return score
+
+    def search_index(self, message: str, query_tokens: List[str]) -> List[Tuple[float, Dict[str, object]]]:
+        query_embedding = None
+        if self.ollama_url:
+            query_embedding = embed_query(message, self.ollama_url, self.embed_model)
+        # The expanded tokens carry the names the keyword rules know belong to the question
+        results = self.retriever.search(" ".join(query_tokens), query_embedding, top_k=self.top_k)
+        timings = self.retriever.last_timings
+        logger.info("Retrieved %d chunks (BM25 %.1f ms, dense %.1f ms)",
+                    len(results), timings["bm25_ms"], timings["dense_ms"])
+        return [(score, chunk) for chunk, score in results]
+
+    def scan_doc_chunks(self, hits: Hits, query_tokens: List[str]) -> List[Tuple[float, Dict[str, object]]]:
+        scored: List[Tuple[int, int, Dict[str, object]]] = []
+        for chunk in self.doc_chunks:
+            score = self.score_doc_chunk(query_tokens, hits, chunk)
+            if score:
+                order = int(chunk.get("order", 0))
+                scored.append((score, order, chunk))
+
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(score, chunk) for score, _, chunk in scored[:self.top_k]]
+
+    def retrieve_doc_context(self, message: str) -> str:
+        if not self.retriever and not self.doc_chunks:
+            return ""
+
+        # One keyword pass over the message serves both expansion and scoring
+        hits = scan_message(message)
+        query_tokens = self.expand_query_tokens(hits, self.tokenize(message))
+        if not query_tokens:
+            return ""
+
+        if self.retriever:
+            selected = self.search_index(message, query_tokens)
+        else:
+            selected = self.scan_doc_chunks(hits, query_tokens)
+        request_log.mark("retrieved")
+        request_log.note(retrieved=retrieved_ids([(chunk, score) for score, chunk in selected]))
+        if not selected:
+            return ""
+
+        parts = []
+        total_chars = 0
+        for score, chunk in selected:
+            source = str(chunk.get("source", "unknown"))
+            chunk_id = chunk.get("chunk_id", "?")
+            text = str(chunk.get("text", "")).strip()
+            entry = f"[{source} chunk {chunk_id}, score {round(score, 4):g}]\n{text}"
+
+            remaining = self.max_context_chars - total_chars
+            if remaining <= 0:
+                break
+            if len(entry) > remaining:
+                entry = entry[:remaining].rsplit(" ", 1)[0].strip()
+
+            parts.append(entry)
+            total_chars += len(entry)
+
+        return "\n\n".join(parts)
+
+    def init_codex(self) -> bool:
+        resolved = shutil.which(self.codex_command)
+        if not resolved:
+            logger.error("Codex command not found: %s", self.codex_command)
+            return False
+
+        logger.info("Using Codex command: %s", resolved)
+        return True
+
+    def format_prompt(self, message: str) -> str:
+        context = self.retrieve_doc_context(message)
+        prompt_parts = [BASE_SYSTEM_PROMPT]
+        if context:
+            prompt_parts.append("Relevant repository documentation context from data/arm_docs:\n" + context)
+        prompt_parts.append("User message from the Acorn serial terminal:\n" + message)
+        return "\n\n".join(prompt_parts)
+
+    def build_codex_command(self, output_path: str) -> List[str]:
+        cmd = [
+            self.codex_command,
+            "exec",
+            "--sandbox",
+            "read-only",
+            "--skip-git-repo-check",
+            "--cd",
+            self.codex_cwd,
+            "--output-last-message",
+            output_path,
+            "--color",
+            "never",
+        ]
+        if self.codex_model:
+            cmd.extend(["--model", self.codex_model])
+        cmd.extend(self.extra_args)
+        cmd.append("-")
+        return cmd
+
+    def startup_tasks(self) -> List[Tuple[str, Callable[[], bool]]]:
+        # Check Codex and load the docs while the serial port is being opened
+        return [("codex", self.init_codex), ("docs", self.load_docs)]
+
+    def describe(self) -> List[Tuple[str, str]]:
+        details = [("Codex command", self.codex_command), ("Codex cwd", self.codex_cwd)]
+        if self.retriever:
+            mode = "BM25 + dense" if self.ollama_url and self.retriever.dense else "BM25"
+            details.append(("Index", f"{self.index_path} ({len(self.retriever)} chunks, {mode})"))
+        return details
+
+    def generate(self, message: str, session_id: str = "default",
+                 cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        # Codex only reports its final message, so the reply arrives as one chunk
+        response = self.run_codex(message, cancel)
+        if response is not None:
+            yield response
+
+    def run_codex(self, message: str, cancel: Optional[CancelToken] = None) -> Optional[str]:
+        """Run Codex for one message; returns None if cancelled before it finished."""
+        prompt = self.format_prompt(message)
+        start_time = time.time()
+
+        with tempfile.NamedTemporaryFile(prefix="armgpt_codex_", suffix=".txt", delete=False) as tmp:
+            output_path = tmp.name
+
+        try:
+            cmd = self.build_codex_command(output_path)
+            logger.info("Running Codex command: %s", " ".join(cmd[:-1]) + " -")
+
+            # Popen rather than run(), so a cancel from the Acorn can kill Codex mid-run
+            process = subprocess.Popen(
+                cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                cwd=self.codex_cwd,
+            )
+            if cancel:
+                cancel.on_cancel(process.kill)
+            try:
+                stdout, stderr = process.communicate(input=prompt, timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.communicate()
+                raise
+            finally:
+                if cancel:
+                    cancel.remove(process.kill)
+            completed = subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+            generation_time = time.time() - start_time
+            if cancel and cancel.cancelled():
+                logger.info("Codex cancelled after %.2f seconds", generation_time)
+                return None
+            logger.info("Codex completed in %.2f seconds with code %d", generation_time, completed.returncode)
+            if completed.stderr:
+                logger.info("Codex stderr: %s", completed.stderr.strip())
+
+            response = ""
+            if os.path.exists(output_path):
+                with open(output_path, "r", encoding="utf-8", errors="replace") as f:
+                    response = f.read().strip()
+
+            if not response:
+                response = completed.stdout.strip()
+
+            if completed.returncode != 0:
+                logger.error("Codex failed: %s", completed.stderr.strip())
+                raise BackendError(CODEX_FAILED_REPLY)
+
+            return self.clean_response(response)
+        except subprocess.TimeoutExpired:
+            logger.error("Codex timed out after %d seconds", self.timeout)
+            raise BackendError(CODEX_TIMEOUT_REPLY)
+        except BackendError:
+            raise
+        except Exception as e:
+            logger.error("Error running Codex: %s", e)
+            raise BackendError(CODEX_FAILED_REPLY)
+        finally:
+            try:
+                os.unlink(output_path)
+            except OSError:
+                pass
+
+    def clean_response(self, response: str) -> str:
+        response = response.strip()
+        if not response:
+            return "Sorry, I could not generate a response just now."
+
+        lines = [line.strip() for line in response.splitlines() if line.strip()]
+        response = " ".join(lines)
+        return response[:900]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Per-session conversation state for the local-model backends.
+
+Each serial session keeps its chat turns together with the model state
+the backend caches between turns (llama-cpp state or Hugging Face
+past_key_values), so a follow-up only evaluates the new user turn.
+When the context budget is reached the oldest turns are dropped and
+folded into a one-line summary.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Maximum characters kept in the running summary of dropped turns
+MAX_SUMMARY_CHARS = 240
+
+
+def format_turn(role: str, text: str) -> str:
+    """Render one turn in the TinyLlama / Zephyr chat format."""
+    return f"<|{role}|>\n{text}</s>\n"
+
+
+class Conversation:
+    """Chat history for one serial session plus the backend's cached model state."""
+
+    def __init__(self, system_prompt: str, count_tokens: Callable[[str], int], max_tokens: int):
+        self.system_prompt = system_prompt
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.turns: List[Tuple[str, str]] = []
+        self.turn_tokens: List[int] = []
+        self.summary = ""
+        self.system_tokens = count_tokens(format_turn("system", self.system_text()))
+        # Backend-owned cache that matches render() exactly; None means "re-evaluate"
+        self.model_state: Any = None
+
+    def system_text(self) -> str:
+        if not self.summary:
+            return self.system_prompt
+        return self.system_prompt + "\n\nEarlier in this conversation the user asked about: " + self.summary
+
+    def history_tokens(self) -> int:
+        return self.system_tokens + sum(self.turn_tokens)
+
+    def render(self) -> str:
+        """Render the system prompt and all completed turns."""
+        parts = [format_turn("system", self.system_text())]
+        for user_text, assistant_text in self.turns:
+            parts.append(format_turn("user", user_text))
+            parts.append(format_turn("assistant", assistant_text))
+        return "".join(parts)
+
+    def prompt_for(self, user_text: str) -> str:
+        """Render the full prompt for a new user turn."""
+        return self.render() + format_turn("user", user_text) + "<|assistant|>\n"
+
+    def fit(self, user_text: str, reply_tokens: int) -> bool:
+        """
+        Drop the oldest turns until the next prompt and its reply fit the budget.
+
+        Returns True when history was trimmed, which invalidates the cached
+        model state. Trimming goes down to half the budget so that the full
+        re-evaluation it forces happens rarely rather than on every turn.
+        """
+        needed = self.count_tokens(format_turn("user", user_text)) + reply_tokens
+        if self.history_tokens() + needed <= self.max_tokens or not self.turns:
+            return False
+
+        target = self.max_tokens // 2
+        while self.turns and self.history_tokens() + needed > target:
+            dropped_user, _ = self.turns.pop(0)
+            self.turn_tokens.pop(0)
+            self.add_to_summary(dropped_user)
+
+        self.system_tokens = self.count_tokens(format_turn("system", self.system_text()))
+        self.model_state = None
+        return True
+
+    def add_to_summary(self, user_text: str) -> None:
+        # Keep only the question itself, not any reference context that preceded it
+        question = " ".join(user_text.strip().splitlines()[-1:]).strip()
+        if not question:
+            return
+        summary = f"{self.summary}; {question}" if self.summary else question
+        if len(summary) > MAX_SUMMARY_CHARS:
+            summary = "..." + summary[-(MAX_SUMMARY_CHARS - 3):]
+        self.summary = summary
+
+    def add_turn(self, user_text: str, assistant_text: str) -> None:
+        self.turns.append((user_text, assistant_text))
+        self.turn_tokens.append(
+            self.count_tokens(format_turn("user", user_text) + format_turn("assistant", assistant_text))
+        )
+
+
+class ConversationStore:
+    """Conversations keyed by serial session id."""
+
+    def __init__(self, factory: Callable[[], Conversation]):
+        self.factory = factory
+        self.conversations: Dict[str, Conversation] = {}
+
+    def __len__(self) -> int:
+        return len(self.conversations)
+
+    def get(self, session_id: str) -> Conversation:
+        if session_id not in self.conversations:
+            self.conversations[session_id] = self.factory()
+        return self.conversations[session_id]
+
+    def reset(self, session_id: Optional[str] = None) -> None:
+        if session_id is None:
+            self.conversations.clear()
+        else:
+            self.conversations.pop(session_id, None)
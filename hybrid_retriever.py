@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Hybrid lexical + dense retrieval over the ARM documentation index.
+
+Dense embeddings are good at paraphrase but weak on exact model names
+such as "A310" or "ARM2"; keyword matching is the opposite. The
+retriever ranks chunks both ways, with BM25 over an inverted index and
+with cosine similarity against the chunk embeddings. The two rankings
+are fused with reciprocal rank fusion (RRF), so a chunk that either
+side ranks highly makes the cut.
+
+build_index.py writes the BM25 postings next to the JSONL index
+(data/arm_index.bm25.json), so no server tokenizes the corpus at
+startup. They are written in sorted runs that are merged at the end,
+so the build never holds the whole corpus's postings. A query only
+touches the postings of its own terms.
+
+    python hybrid_retriever.py --build                          # rebuild the BM25 file only
+    python hybrid_retriever.py --query "Who designed the ARM2?"  # show fused results and timings
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import math
+import operator
+import os
+import re
+import tempfile
+import time
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from text_chunker import count_tokens
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_VERSION = 2
+
+# BM25 parameters (the usual defaults) and the RRF constant from Cormack et al.
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+# Candidates taken from each ranking before fusion
+CANDIDATES = 20
+
+# (chunk, count) pairs held in memory while writing the BM25 file, about 8 MB
+SPILL_PAIRS = 1 << 20
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from",
+    "had", "has", "have", "how", "i", "in", "is", "it", "its", "me", "my", "of", "on",
+    "or", "tell", "that", "the", "their", "this", "to", "was", "were", "what", "when",
+    "where", "which", "who", "why", "with", "you", "your",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word and model-number tokens ("a310", "arm2"), without stopwords."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower())
+            if token not in STOPWORDS and (len(token) > 1 or token.isdigit())]
+
+
+def chunk_terms(chunk: Dict[str, Any]) -> List[str]:
+    # The source file name often names the subject, e.g. A_Brief_History_of_Arm_Part_1.txt
+    source = os.path.splitext(str(chunk.get("source", "")))[0].replace("_", " ")
+    return tokenize(source + " " + str(chunk.get("text", "")))
+
+
+def lexical_index_path(index_path: str) -> str:
+    """data/arm_index.jsonl -> data/arm_index.bm25.json"""
+    base, _ = os.path.splitext(index_path)
+    return base + ".bm25.json"
+
+
+def iter_chunks(index_path: str) -> Iterator[Dict[str, Any]]:
+    """Stream the chunks of a JSONL index one line at a time."""
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def load_chunks(index_path: str) -> List[Dict[str, Any]]:
+    """Load the JSONL vector index from disk."""
+    if not os.path.exists(index_path):
+        logger.error("Index file not found: %s", index_path)
+        return []
+    chunks = list(iter_chunks(index_path))
+    logger.info("Loaded %d chunks from %s", len(chunks), index_path)
+    return chunks
+
+
+class LexicalIndex:
+    """
+    BM25 over an inverted index.
+
+    Each term's postings are one flat int array of (chunk number, term
+    frequency) pairs, which keeps a large corpus's index compact both
+    while build_index.py streams it and in the servers.
+    """
+
+    def __init__(self, postings: Dict[str, array], doc_lengths: List[int]):
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.num_docs = len(doc_lengths)
+        self.avg_length = sum(doc_lengths) / self.num_docs if self.num_docs else 0.0
+        # Per-term idf and per-document length norms are fixed, so compute them once
+        self.idf = {term: math.log(1 + (self.num_docs - len(docs) // 2 + 0.5) / (len(docs) // 2 + 0.5))
+                    for term, docs in postings.items()}
+        self.length_norm = [BM25_K1 * (1 - BM25_B + BM25_B * length / (self.avg_length or 1))
+                            for length in doc_lengths]
+
+    @classmethod
+    def build(cls, chunks: Iterable[Dict[str, Any]]) -> "LexicalIndex":
+        postings: Dict[str, array] = {}
+        doc_lengths = []
+        for number, chunk in enumerate(chunks):
+            terms = chunk_terms(chunk)
+            doc_lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                docs = postings.get(term)
+                if docs is None:
+                    docs = postings[term] = array("i")
+                docs.append(number)
+                docs.append(count)
+        return cls(postings, doc_lengths)
+
+    def save(self, path: str) -> None:
+        # Written a term at a time so the postings are never copied into one big list
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"version":%d,"doc_lengths":%s,"postings":{' % (
+                LEXICAL_INDEX_VERSION, json.dumps(self.doc_lengths, separators=(",", ":"))))
+            for position, (term, docs) in enumerate(self.postings.items()):
+                f.write("%s%s:%s" % ("," if position else "", json.dumps(term),
+                                     json.dumps(docs.tolist(), separators=(",", ":"))))
+            f.write("}}")
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LexicalIndex"]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read BM25 index %s: %s", path, e)
+            return None
+        if data.get("version") != LEXICAL_INDEX_VERSION:
+            logger.warning("BM25 index %s has version %s, expected %d",
+                           path, data.get("version"), LEXICAL_INDEX_VERSION)
+            return None
+        return cls({term: array("i", docs) for term, docs in data["postings"].items()}, data["doc_lengths"])
+
+    def search(self, query: str, limit: int = CANDIDATES) -> List[Tuple[int, float]]:
+        """Top chunks by BM25 as (chunk number, score), best first."""
+        scores: Dict[int, float] = {}
+        for term, query_count in Counter(tokenize(query)).items():
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf[term]
+            for number, count in zip(docs[::2], docs[1::2]):
+                gain = idf * count * (BM25_K1 + 1) / (count + self.length_norm[number])
+                scores[number] = scores.get(number, 0.0) + gain * query_count
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+class DenseIndex:
+    """Cosine similarity against unit-length chunk embeddings."""
+
+    def __init__(self, chunks: List[Dict[str, Any]]):
+        self.vectors: List[Optional[List[float]]] = []
+        for chunk in chunks:
+            embedding = chunk.get("embedding") or []
+            norm = math.sqrt(sum(x * x for x in embedding))
+            self.vectors.append([x / norm for x in embedding] if norm else None)
+
+    def __bool__(self) -> bool:
+        return any(vector is not None for vector in self.vectors)
+
+    def search(self, query_embedding: List[float], limit: int = CANDIDATES) -> List[Tuple[int, float]]:
+        norm = math.sqrt(sum(x * x for x in query_embedding))
+        if not norm:
+            return []
+        query = [x / norm for x in query_embedding]
+        scores = [(number, sum(map(operator.mul, query, vector)))
+                  for number, vector in enumerate(self.vectors)
+                  if vector is not None and len(vector) == len(query)]
+        scores.sort(key=lambda item: (-item[1], item[0]))
+        return scores[:limit]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fuse rankings: each chunk scores the sum of 1 / (k + rank) over the rankings it appears in."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (number, _) in enumerate(ranking, start=1):
+            fused[number] = fused.get(number, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+
+
+class HybridRetriever:
+    """Chunks of the documentation index, searchable by BM25, embeddings or both."""
+
+    def __init__(self, chunks: List[Dict[str, Any]], lexical: LexicalIndex):
+        self.chunks = chunks
+        self.lexical = lexical
+        self.dense = DenseIndex(chunks)
+        self.last_timings: Dict[str, float] = {}
+
+    @classmethod
+    def load(cls, index_path: str) -> "HybridRetriever":
+        """Load the JSONL index and its BM25 file, rebuilding BM25 in memory if that is missing or stale."""
+        chunks = load_chunks(index_path)
+        bm25_path = lexical_index_path(index_path)
+        lexical = LexicalIndex.load(bm25_path) if os.path.exists(bm25_path) else None
+        if lexical is not None and lexical.num_docs != len(chunks):
+            logger.warning("BM25 index %s covers %d chunks but the index has %d; rebuilding it in memory",
+                           bm25_path, lexical.num_docs, len(chunks))
+            lexical = None
+        if lexical is None:
+            if chunks:
+                logger.warning("No usable BM25 index at %s; run build_index.py to create it", bm25_path)
+            lexical = LexicalIndex.build(chunks)
+        retriever = cls(chunks, lexical)
+        logger.info("Hybrid retriever ready: %d chunks, %d terms, %s",
+                    len(chunks), len(lexical.postings), "BM25 + dense" if retriever.dense else "BM25 only")
+        return retriever
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def search(self, query: str, query_embedding: Optional[List[float]] = None,
+               top_k: int = 5) -> List[Tuple[Dict[str, Any], float]]:
+        """Top chunks for a query as (chunk, fused score); BM25 alone when there is no embedding."""
+        start = time.perf_counter()
+        rankings = [self.lexical.search(query)]
+        lexical_done = time.perf_counter()
+        if query_embedding is not None and self.dense:
+            rankings.append(self.dense.search(query_embedding))
+        dense_done = time.perf_counter()
+        fused = reciprocal_rank_fusion(rankings)[:top_k]
+        self.last_timings = {
+            "bm25_ms": 1000 * (lexical_done - start),
+            "dense_ms": 1000 * (dense_done - lexical_done),
+        }
+        return [(self.chunks[number], score) for number, score in fused]
+
+
+def pack_chunks(results: List[Tuple[Dict[str, Any], float]],
+                max_tokens: int) -> List[Tuple[Dict[str, Any], float]]:
+    """
+    Results in rank order, as many as fit in max_tokens of prompt.
+
+    Uses the token counts build_index.py stored with each chunk, so
+    nothing is tokenized here; indexes built before those counts existed
+    are counted on the fly.
+    """
+    packed = []
+    used = 0
+    for chunk, score in results:
+        tokens = chunk.get("n_tokens")
+        if tokens is None:
+            tokens = count_tokens(str(chunk.get("text", "")))
+        if packed and used + tokens > max_tokens:
+            break
+        packed.append((chunk, score))
+        used += tokens
+    return packed
+
+
+def retrieved_ids(results: List[Tuple[Dict[str, Any], float]]) -> List[Dict[str, Any]]:
+    """Chunk ids and scores of retrieval results, for the request log."""
+    return [{"source": chunk.get("source"), "chunk_id": chunk.get("chunk_id"), "score": round(score, 4)}
+            for chunk, score in results]
+
+
+def write_run(postings: Dict[str, array], directory: str, number: int) -> str:
+    """Save one run of postings, sorted by term, one "term<TAB>pairs" line each."""
+    path = os.path.join(directory, f"run{number:05d}.tsv")
+    with open(path, "w", encoding="utf-8") as f:
+        for term in sorted(postings):
+            f.write("%s\t%s\n" % (term, ",".join(map(str, postings[term]))))
+    return path
+
+
+def read_run(path: str, number: int) -> Iterator[Tuple[str, int, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            term, pairs = line.rstrip("\n").split("\t")
+            yield term, number, pairs
+
+
+def write_lexical_index(index_path: str, spill_pairs: int = SPILL_PAIRS) -> int:
+    """
+    Build the BM25 file for a JSONL index and save it alongside; returns its chunk count.
+
+    Chunks are streamed, and the postings are collected into runs of at
+    most spill_pairs (chunk, count) pairs. Each full run is written out
+    sorted by term, and the runs are merged a term at a time into the
+    same file LexicalIndex.save() writes, so memory is bounded by one run
+    plus a 4-byte length per chunk.
+    """
+    output = lexical_index_path(index_path)
+    doc_lengths = array("i")
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output) or ".") as directory:
+        runs: List[str] = []
+        postings: Dict[str, array] = {}
+        pairs = 0
+        for number, chunk in enumerate(iter_chunks(index_path)):
+            terms = chunk_terms(chunk)
+            doc_lengths.append(len(terms))
+            counts = Counter(terms)
+            for term, count in counts.items():
+                docs = postings.get(term)
+                if docs is None:
+                    docs = postings[term] = array("i")
+                docs.append(number)
+                docs.append(count)
+            pairs += len(counts)
+            if pairs >= spill_pairs:
+                runs.append(write_run(postings, directory, len(runs)))
+                postings, pairs = {}, 0
+        if postings:
+            runs.append(write_run(postings, directory, len(runs)))
+
+        with open(output, "w", encoding="utf-8") as f:
+            f.write('{"version":%d,"doc_lengths":%s,"postings":{' % (
+                LEXICAL_INDEX_VERSION, json.dumps(doc_lengths.tolist(), separators=(",", ":"))))
+            # Runs cover increasing chunk numbers, so a term's pairs join in run order
+            merged = heapq.merge(*(read_run(path, number) for number, path in enumerate(runs)))
+            for position, (term, group) in enumerate(itertools.groupby(merged, key=operator.itemgetter(0))):
+                f.write("%s%s:[%s]" % ("," if position else "", json.dumps(term),
+                                       ",".join(pairs for _, _, pairs in group)))
+            f.write("}}")
+    return len(doc_lengths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hybrid BM25 + dense retrieval over the documentation index")
+    parser.add_argument("--index", default="data/arm_index.jsonl", help="JSONL index (default: data/arm_index.jsonl)")
+    parser.add_argument("--build", action="store_true", help="Rebuild the BM25 file from the JSONL index")
+    parser.add_argument("--query", help="Show the fused top chunks for a query")
+    parser.add_argument("--top-k", type=int, default=5, help="Chunks to show (default: 5)")
+    parser.add_argument("--ollama-url", default="http://localhost:11434",
+                        help="Ollama API base URL for the query embedding (default: http://localhost:11434)")
+    parser.add_argument("--embed-model", default="nomic-embed-text",
+                        help="Ollama embedding model (default: nomic-embed-text)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if args.build:
+        if not os.path.exists(args.index):
+            raise SystemExit(f"Index file not found: {args.index}")
+        num_docs = write_lexical_index(args.index)
+        print(f"[OK] Wrote BM25 index for {num_docs} chunks to {lexical_index_path(args.index)}")
+    if not args.query:
+        return
+
+    # Imported here: the retriever itself needs no HTTP client
+    from ollama_backend import embed_query
+
+    retriever = HybridRetriever.load(args.index)
+    start = time.perf_counter()
+    embedding = embed_query(args.query, args.ollama_url, args.embed_model)
+    embed_ms = 1000 * (time.perf_counter() - start)
+    results = retriever.search(args.query, embedding, top_k=args.top_k)
+    timings = retriever.last_timings
+
+    print(f"Embed round trip {embed_ms:.1f} ms, BM25 {timings['bm25_ms']:.2f} ms, "
+          f"dense {timings['dense_ms']:.2f} ms" + ("" if embedding else " (no embedding: BM25 only)"))
+    for chunk, score in results:
+        text = " ".join(str(chunk.get("text", "")).split())
+        print(f"  {score:.4f}  [{chunk.get('source')} chunk {chunk.get('chunk_id')}] {text[:100]}...")
+
+
+if __name__ == "__main__":
+    main()
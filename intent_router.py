@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Fast intent routing: decide how much work a message deserves.
+
+A small logistic regression over hashed word n-grams sorts each message
+into one of INTENTS before any Ollama call is made:
+
+    greeting, thanks, farewell   answered with a canned reply; no embed, no chat
+    chat                         small talk; chat without retrieval
+    short                        a factual lookup; BM25 only, a few chunks
+    full                         everything else; hybrid retrieval, full budget
+
+Features are word unigrams and bigrams, the first word, the message
+length and the keyword_matcher hits, hashed into BUCKETS with crc32 so
+a trained model is stable across processes. Prediction adds up a few
+weight rows and takes a softmax, a few microseconds per message.
+Anything below the confidence threshold is routed to "full", so a
+doubtful message gets the old grounded treatment. A message that names
+the documentation's subject gets retrieval when the model gives
+retrieval even a modest probability, so small talk in front of a
+question ("hi, who designed the ARM chip?") does not hide it.
+
+The model is trained from labelled messages, one JSON object per line
+with "message" and "intent". data/intent_examples.jsonl is the seed
+set; --harvest pulls the messages out of serial logs with the current
+model's guess attached, ready to be corrected and appended. Without a
+saved model the router trains on the seed set at startup.
+
+    python intent_router.py --train                      # write data/intent_model.json
+    python intent_router.py --harvest logs/*.log > new.jsonl
+    python intent_router.py --benchmark                  # accuracy, latency and calls saved
+    python intent_router.py --query "Who designed the ARM chip?"
+"""
+
+import argparse
+import ast
+import json
+import logging
+import math
+import os
+import random
+import re
+import time
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from keyword_matcher import is_conversational, scan_message
+
+logger = logging.getLogger(__name__)
+
+INTENTS = ("greeting", "thanks", "farewell", "chat", "short", "full")
+CANNED_REPLIES = {
+    "greeting": "Hello! I'm ArmGPT, running on a Raspberry Pi connected to your Acorn. What shall we talk about?",
+    "thanks": "You're welcome! Ask me anything else about Acorn or ARM.",
+    "farewell": "Goodbye! Happy computing on your Acorn.",
+}
+# Intents answered without retrieval
+NO_RETRIEVAL = ("greeting", "thanks", "farewell", "chat")
+# Intents answered with retrieval, most likely first when overriding small talk
+RETRIEVAL = ("short", "full")
+# keyword_matcher labels that name the documentation's subject
+SUBJECT_LABELS = ("arm", "archimedes", "origin", "topic")
+# Retrieval probability at which a message naming the subject is not left to small talk;
+# low, since skipping retrieval costs more than an unneeded lookup
+SUBJECT_FLOOR = 0.05
+
+MODEL_VERSION = 1
+BUCKETS = 1 << 14
+DEFAULT_THRESHOLD = 0.5
+# Canned replies skip the model entirely, so they need more certainty
+CANNED_THRESHOLD = 0.8
+
+WORD_PATTERN = re.compile(r"[a-z0-9']+")
+LOG_MESSAGE = re.compile(r"(?:Decoded message: (?P<repr>'.*'|\".*\")|Received: (?P<text>.*\S))\s*$")
+
+
+def names_subject(message: str) -> bool:
+    """Whether the message names something the documentation covers."""
+    return scan_message(message).has(*SUBJECT_LABELS)
+
+
+def features(message: str) -> List[int]:
+    """Hashed feature buckets of a message."""
+    words = WORD_PATTERN.findall(message.lower())
+    names = ["bias:len%d" % min(len(words), 8)]
+    if words:
+        names.append("first:" + words[0])
+    names.extend("w:" + word for word in words)
+    names.extend("b:" + a + " " + b for a, b in zip(words, words[1:]))
+    if message.rstrip().endswith("?"):
+        names.append("question")
+    hits = scan_message(message)
+    names.extend("kw:" + label for label in hits.labels)
+    names.extend("kw0:" + match.label for match in hits.matches if match.start == 0)
+    return sorted({zlib.crc32(name.encode("utf-8")) % BUCKETS for name in names})
+
+
+def softmax(scores: List[float]) -> List[float]:
+    top = max(scores)
+    exps = [math.exp(score - top) for score in scores]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+
+def read_examples(paths: Iterable[str]) -> List[Tuple[str, str]]:
+    """(message, intent) pairs from labelled JSONL files; unknown intents are skipped."""
+    examples = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.warning("Skipping %s line %d: %s", path, number, e)
+                    continue
+                if record.get("intent") in INTENTS and record.get("message"):
+                    examples.append((str(record["message"]), record["intent"]))
+    return examples
+
+
+def harvest_messages(paths: Iterable[str]) -> Iterator[str]:
+    """Messages received from the Acorn, as logged by the serial front-ends."""
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                match = LOG_MESSAGE.search(line)
+                if not match:
+                    continue
+                if match.group("repr"):
+                    try:
+                        message = ast.literal_eval(match.group("repr"))
+                    except (ValueError, SyntaxError):
+                        continue
+                else:
+                    message = match.group("text")
+                # Line noise on the serial link logs as NULs and stray bytes
+                message = message.replace("\x00", "").strip()
+                if WORD_PATTERN.search(message.lower()):
+                    yield message
+
+
+class IntentRouter:
+    """Multinomial logistic regression over hashed n-gram features."""
+
+    def __init__(self, bias: Optional[List[float]] = None,
+                 weights: Optional[Dict[int, List[float]]] = None,
+                 threshold: float = DEFAULT_THRESHOLD):
+        self.bias = bias or [0.0] * len(INTENTS)
+        self.weights = weights or {}
+        self.threshold = threshold
+
+    @classmethod
+    def train(cls, examples: List[Tuple[str, str]], epochs: int = 40, learning_rate: float = 0.3,
+              l2: float = 1e-4, seed: int = 0) -> "IntentRouter":
+        """Fit by stochastic gradient descent on the cross-entropy loss."""
+        router = cls()
+        encoded = [(features(message), INTENTS.index(intent)) for message, intent in examples]
+        order = list(range(len(encoded)))
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(order)
+            rate = learning_rate / (1 + epoch * 0.1)
+            for i in order:
+                buckets, target = encoded[i]
+                probabilities = router.probabilities(buckets)
+                gradient = [p - (1.0 if k == target else 0.0) for k, p in enumerate(probabilities)]
+                for k, g in enumerate(gradient):
+                    router.bias[k] -= rate * g
+                for bucket in buckets:
+                    row = router.weights.setdefault(bucket, [0.0] * len(INTENTS))
+                    for k, g in enumerate(gradient):
+                        row[k] -= rate * (g + l2 * row[k])
+        return router
+
+    def probabilities(self, buckets: List[int]) -> List[float]:
+        scores = list(self.bias)
+        for bucket in buckets:
+            row = self.weights.get(bucket)
+            if row:
+                for k, weight in enumerate(row):
+                    scores[k] += weight
+        return softmax(scores)
+
+    def classify(self, message: str) -> Tuple[str, float]:
+        """(intent, probability), with doubtful messages routed to "full".
+
+        An unsure canned intent falls back to "chat" when the no-retrieval
+        intents together are likely enough. A message naming the subject
+        goes to the likelier retrieval intent once retrieval reaches
+        SUBJECT_FLOOR, so a question after a greeting keeps its retrieval
+        while "what's your favourite Acorn game?" stays small talk.
+        """
+        probabilities = self.probabilities(features(message))
+        best = max(range(len(INTENTS)), key=probabilities.__getitem__)
+        intent, confidence = INTENTS[best], probabilities[best]
+        if intent in NO_RETRIEVAL and names_subject(message):
+            retrieval = [(probabilities[INTENTS.index(name)], name) for name in RETRIEVAL]
+            if sum(p for p, _ in retrieval) >= SUBJECT_FLOOR:
+                confidence, intent = max(retrieval)
+                return intent, confidence
+        if intent in CANNED_REPLIES and confidence < CANNED_THRESHOLD:
+            # Probably small talk, but not sure enough for a fixed reply
+            intent = "chat"
+            confidence = sum(probabilities[INTENTS.index(name)] for name in NO_RETRIEVAL)
+        if confidence < self.threshold:
+            return "full", confidence
+        return intent, confidence
+
+    def save(self, path: str) -> None:
+        data = {
+            "version": MODEL_VERSION,
+            "intents": list(INTENTS),
+            "buckets": BUCKETS,
+            "bias": [round(value, 6) for value in self.bias],
+            "weights": {str(bucket): [round(value, 6) for value in row]
+                        for bucket, row in sorted(self.weights.items())},
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = DEFAULT_THRESHOLD) -> Optional["IntentRouter"]:
+        """The saved model, or None if it is missing or was trained for other intents."""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load intent model %s: %s", path, e)
+            return None
+        if (data.get("version") != MODEL_VERSION or data.get("intents") != list(INTENTS)
+                or data.get("buckets") != BUCKETS):
+            logger.warning("Intent model %s is out of date; retrain it with intent_router.py --train", path)
+            return None
+        weights = {int(bucket): row for bucket, row in data["weights"].items()}
+        return cls(data["bias"], weights, threshold)
+
+    @classmethod
+    def from_files(cls, model_path: str, examples_path: str,
+                   threshold: float = DEFAULT_THRESHOLD) -> Optional["IntentRouter"]:
+        """The saved model, or one trained on the labelled examples if there is none."""
+        if os.path.exists(model_path):
+            router = cls.load(model_path, threshold)
+            if router:
+                logger.info("Loaded intent model %s", model_path)
+                return router
+        if not os.path.exists(examples_path):
+            logger.warning("No intent model or examples; only greetings matched by keyword skip retrieval")
+            return None
+        examples = read_examples([examples_path])
+        start = time.perf_counter()
+        router = cls.train(examples)
+        router.threshold = threshold
+        logger.info("Trained intent model on %d examples from %s in %.0f ms",
+                    len(examples), examples_path, (time.perf_counter() - start) * 1000)
+        return router
+
+
+def add_intent_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the intent routing options shared by the entry points."""
+    group = parser.add_argument_group("intent routing")
+    group.add_argument("--intent-model", default="data/intent_model.json",
+                       help="Model from intent_router.py --train; trained from --intent-examples "
+                            "at startup if missing (default: data/intent_model.json)")
+    group.add_argument("--intent-examples", default="data/intent_examples.jsonl",
+                       help="Labelled messages to train on (default: data/intent_examples.jsonl)")
+    group.add_argument("--no-intent-router", action="store_true",
+                       help="Skip retrieval only for greetings matched by keyword, as before")
+
+
+# ─── Benchmark ───────────────────────────────────────────────────
+
+def cross_validate(examples: List[Tuple[str, str]], folds: int = 5) -> List[Tuple[str, str, str]]:
+    """(message, label, held-out prediction) for every example."""
+    shuffled = list(examples)
+    random.Random(1).shuffle(shuffled)
+    results = []
+    for fold in range(folds):
+        test = shuffled[fold::folds]
+        router = IntentRouter.train([ex for i, ex in enumerate(shuffled) if i % folds != fold])
+        results.extend((message, label, router.classify(message)[0]) for message, label in test)
+    return results
+
+
+# Messages the router has got wrong before, checked by --benchmark against a model
+# trained on every example; they are not in the seed set in this form
+ROUTING_CHECKS = (
+    ("What's your favourite Acorn game?", "chat"),
+    ("no, I meant the ARM2", "short"),
+    ("I meant the Acorn RISC PC", "full"),
+    ("hi, who designed the ARM chip?", "short"),
+    ("thanks, and when was the A310 released?", "short"),
+    ("hello!", "greeting"),
+    ("thanks a lot", "thanks"),
+    ("ok, bye for now", "farewell"),
+)
+
+
+def calls_for(intent: str) -> Tuple[int, int]:
+    """(embed calls, chat calls) the Ollama backend makes for a routed message."""
+    if intent in CANNED_REPLIES:
+        return 0, 0
+    if intent in NO_RETRIEVAL or intent == "short":
+        return 0, 1
+    return 1, 1
+
+
+def benchmark(examples: List[Tuple[str, str]]) -> None:
+    results = cross_validate(examples)
+    correct = sum(1 for _, label, predicted in results if predicted == label)
+    print(f"Held-out accuracy: {correct}/{len(results)} ({100.0 * correct / len(results):.1f}%), 5-fold")
+    for intent in INTENTS:
+        rows = [predicted for _, label, predicted in results if label == intent]
+        if rows:
+            hits = sum(1 for predicted in rows if predicted == intent)
+            print(f"  {intent:<9} {hits}/{len(rows)}")
+
+    # The routing decision is what costs calls or answers, whatever the exact intent
+    print("Routing precision and recall:")
+    for decision, intents in (("retrieval", RETRIEVAL), ("no retrieval", NO_RETRIEVAL)):
+        predicted = [label in intents for _, label, guess in results if guess in intents]
+        actual = [guess in intents for _, label, guess in results if label in intents]
+        print(f"  {decision:<12} precision {sum(predicted)}/{len(predicted)}, "
+              f"recall {sum(actual)}/{len(actual)}")
+    print("Precision by routed intent:")
+    for intent in INTENTS:
+        rows = [label for _, label, predicted in results if predicted == intent]
+        if rows:
+            exact = sum(1 for label in rows if label == intent)
+            same_route = sum(1 for label in rows if (label in NO_RETRIEVAL) == (intent in NO_RETRIEVAL))
+            print(f"  {intent:<9} {exact}/{len(rows)} exact, {same_route}/{len(rows)} routed alike")
+
+    # A message that needed retrieval but was routed past it is the costly mistake
+    missed = [message for message, label, predicted in results
+              if label not in NO_RETRIEVAL and predicted in NO_RETRIEVAL]
+    print(f"Retrieval wrongly skipped: {len(missed)}" + (f" ({'; '.join(missed[:3])})" if missed else ""))
+
+    router = IntentRouter.train(examples)
+    failed = [(message, expected, router.classify(message)) for message, expected in ROUTING_CHECKS]
+    failed = [(message, expected, got) for message, expected, (got, _) in failed if got != expected]
+    print(f"Routing checks: {len(ROUTING_CHECKS) - len(failed)}/{len(ROUTING_CHECKS)} passed")
+    for message, expected, got in failed:
+        print(f"  {message!r}: expected {expected}, got {got}")
+
+    baseline_embed = sum(0 if is_conversational(message) else 1 for message, _, _ in results)
+    baseline_chat = len(results)
+    routed = [calls_for(predicted) for _, _, predicted in results]
+    routed_embed = sum(embed for embed, _ in routed)
+    routed_chat = sum(chat for _, chat in routed)
+    print(f"Embed calls: {baseline_embed} with the greeting patterns, {routed_embed} routed "
+          f"({baseline_embed - routed_embed} saved)")
+    print(f"Chat calls: {baseline_chat} with the greeting patterns, {routed_chat} routed "
+          f"({baseline_chat - routed_chat} saved)")
+
+    # Distinct messages, so the keyword scan is not served from its cache
+    messages = [f"{message} {n}" for n in range(max(1, 20000 // len(examples))) for message, _ in examples]
+    start = time.perf_counter()
+    for message in messages:
+        router.classify(message)
+    elapsed = time.perf_counter() - start
+    print(f"Classification: {elapsed / len(messages) * 1e6:.1f} us per message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train, benchmark or query the intent router")
+    parser.add_argument("--examples", nargs="+", default=["data/intent_examples.jsonl"],
+                        help="Labelled JSONL files of {message, intent} (default: data/intent_examples.jsonl)")
+    parser.add_argument("--model", default="data/intent_model.json",
+                        help="Model file (default: data/intent_model.json)")
+    parser.add_argument("--train", action="store_true", help="Train on the examples and save the model")
+    parser.add_argument("--benchmark", action="store_true",
+                        help="Report held-out accuracy, latency and the embed/chat calls saved")
+    parser.add_argument("--harvest", nargs="+", metavar="LOG",
+                        help="Print the messages in serial logs as JSONL with the model's guess, for labelling")
+    parser.add_argument("--query", help="Classify one message")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.train or args.benchmark:
+        examples = read_examples(args.examples)
+        if not examples:
+            parser.error(f"No labelled examples in {', '.join(args.examples)}")
+        if args.train:
+            IntentRouter.train(examples).save(args.model)
+            print(f"Trained on {len(examples)} examples; saved {args.model}")
+        if args.benchmark:
+            benchmark(examples)
+        return
+
+    router = IntentRouter.from_files(args.model, args.examples[0])
+    if not router:
+        parser.error("No model or examples to route with")
+    if args.harvest:
+        for message in harvest_messages(args.harvest):
+            intent, confidence = router.classify(message)
+            print(json.dumps({"message": message, "intent": intent, "confidence": round(confidence, 3)}))
+    elif args.query:
+        intent, confidence = router.classify(args.query)
+        print(f"{intent} ({confidence:.2f})")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Multi-pattern keyword and phrase matching with an Aho-Corasick automaton.
+
+All the phrases are compiled into one trie with failure links, so a
+single pass over a text finds every occurrence of every phrase, however
+many there are and however they overlap ("acorn archimedes" and
+"archimedes" are both reported). Matches must start and end on word
+boundaries, so "ta" does not fire inside "talk" and "arm1" not inside
+"arm10". Each phrase carries a label, and callers test labels rather
+than rescanning the text for each keyword list.
+
+MESSAGE_KEYWORDS is the vocabulary for incoming messages: small talk
+for is_conversational(), the topic words the Codex backend uses to
+expand queries and boost chunks, and the subject and question words
+the intent router uses as features and to keep subject questions out
+of its small-talk intents. scan_message() scans a message once and
+caches the hits, so classification, query expansion and scoring all
+share the same pass.
+
+    python keyword_matcher.py "Who designed the ARM chip?"    # show the hits
+"""
+
+import argparse
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Tuple
+
+# Phrases that open simple conversation, which needs no retrieval
+CONVERSATIONAL_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "greeting": ("hi", "hello", "hey", "howdy", "greetings", "yo", "hiya",
+                 "how are you", "how's it going", "what's up", "whats up",
+                 "good morning", "good afternoon", "good evening", "good day",
+                 "morning", "evening"),
+    "thanks": ("thanks", "thank you", "cheers", "ta", "much appreciated",
+               "thx", "ty", "appreciate it"),
+    "farewell": ("bye", "goodbye", "see you", "later", "good night", "gn",
+                 "goodnight", "night night", "see ya", "cya", "cheerio", "take care",
+                 "gotta go", "got to go", "have to go", "speak soon", "until next time",
+                 "signing off", "logging off"),
+    "smalltalk": ("yes", "no", "ok", "okay", "sure", "yep", "nope", "yeah", "nah",
+                  "who are you", "what are you", "tell me about yourself"),
+}
+
+MESSAGE_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    **CONVERSATIONAL_KEYWORDS,
+    "arm": ("arm",),
+    "creation": ("created", "invented", "designed"),
+    "origin": ("origin", "origins", "history"),
+    "archimedes": ("archimedes", "a310"),
+    "who": ("who",),
+    "question": ("what", "when", "where", "why", "how", "which", "tell me", "explain"),
+    # Anything else that puts a message on the documentation's subject
+    "topic": ("acorn", "risc", "risc os", "bbc micro", "chip", "chips", "processor", "cpu",
+              "arm1", "arm2", "arm3", "arm6", "strongarm", "furber", "sophie wilson", "vlsi",
+              "newton", "instruction set"),
+}
+
+
+class Match(NamedTuple):
+    start: int
+    end: int
+    phrase: str
+    label: str
+
+
+class Hits:
+    """Every match in one text, with set lookups by phrase and label."""
+
+    def __init__(self, matches: List[Match]):
+        self.matches = matches
+        self.phrases: FrozenSet[str] = frozenset(match.phrase for match in matches)
+        self.labels: FrozenSet[str] = frozenset(match.label for match in matches)
+
+    def has(self, *labels: str) -> bool:
+        """Whether any of the labels matched anywhere"""
+        return any(label in self.labels for label in labels)
+
+    def starts_with(self, *labels: str) -> bool:
+        """Whether a phrase with one of the labels opens the text"""
+        return any(match.start == 0 and match.label in labels for match in self.matches)
+
+    def __len__(self) -> int:
+        return len(self.matches)
+
+    def __repr__(self) -> str:
+        return f"Hits({', '.join(f'{m.phrase!r}:{m.label}@{m.start}' for m in self.matches)})"
+
+
+def is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class KeywordMatcher:
+    """Aho-Corasick automaton over lowercase phrases, each with a label."""
+
+    def __init__(self, keywords: Dict[str, Iterable[str]]):
+        """
+        Args:
+            keywords: Label -> the phrases that signal it
+        """
+        self.patterns: List[Tuple[str, str]] = []
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+
+        for label, phrases in keywords.items():
+            for phrase in phrases:
+                self.add(phrase.lower(), label)
+        self.link()
+
+    def add(self, phrase: str, label: str) -> None:
+        node = 0
+        for char in phrase:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][char] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = child
+        self.output[node].append(len(self.patterns))
+        self.patterns.append((phrase, label))
+
+    def link(self) -> None:
+        """Set failure links breadth-first; each node inherits the outputs of its fallback."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def find(self, text: str) -> List[Match]:
+        """Every whole-word occurrence of every phrase, in order of where it ends."""
+        text = text.lower()
+        goto, fail, output, patterns = self.goto, self.fail, self.output, self.patterns
+        matches: List[Match] = []
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if not output[node]:
+                continue
+            end = position + 1
+            if end < len(text) and is_word_char(text[end]):
+                continue
+            for index in output[node]:
+                phrase, label = patterns[index]
+                start = end - len(phrase)
+                if start == 0 or not is_word_char(text[start - 1]):
+                    matches.append(Match(start, end, phrase, label))
+        return matches
+
+    def scan(self, text: str) -> Hits:
+        return Hits(self.find(text))
+
+
+MESSAGE_MATCHER = KeywordMatcher(MESSAGE_KEYWORDS)
+
+
+@lru_cache(maxsize=256)
+def scan_message(message: str) -> Hits:
+    """MESSAGE_KEYWORDS hits in a message, scanned once and shared by every caller."""
+    return MESSAGE_MATCHER.scan(message.strip())
+
+
+def is_conversational(message: str) -> bool:
+    """Check if a message is simple conversation that doesn't need RAG."""
+    return scan_message(message).starts_with(*CONVERSATIONAL_KEYWORDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the keyword hits in a message")
+    parser.add_argument("message", help="Message text")
+    args = parser.parse_args()
+
+    hits = scan_message(args.message)
+    for match in hits.matches:
+        print(f"{match.start:4d}-{match.end:<4d} {match.label:<15} {match.phrase}")
+    print(f"{len(hits)} hits; conversational: {hits.starts_with(*CONVERSATIONAL_KEYWORDS)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+link_tune.py — Find the fastest reliable baud rate for the Acorn link.
+
+The Acorn runs acorn/LinkTune.bas, which sends `*LINKTUNE` at the current
+rate. The host replies and the two ends step up through LINK_RATES. At
+each step they switch rates together, echo checksummed ping patterns,
+and time a bulk transfer. The first failure sends both ends back to the
+last good rate, which they confirm with a LINK exchange:
+
+    Acorn                                   Host
+    *LINKTUNE                        ->
+                                     <-     LINKTUNE <pings> <rates...>
+                                     <-     RATE <n>
+    ACK <n>  (or NAK <n> if unsupported) ->
+    ... both switch to <n> ...
+    PING <seq> <pattern> <sum>       ->                 (x pings)
+                                     <-     PONG <seq> <pattern> <sum>
+                                     <-     BULK <lines> <length> <sum>
+                                     <-     <lines> pattern lines
+    BULKOK <sum>                     ->
+    ... next RATE, or on any failure both wait out the timeout ...
+                                     <-     LINK <rate>
+    LINK <rate>                      ->
+
+<sum> is the sum of the pattern's bytes modulo 65536, which is cheap to
+compute in BBC BASIC. The serial front-ends answer `*LINKTUNE` the same
+way, so tuning can run at the start of any session.
+
+    python link_tune.py --port /dev/ttyUSB0      # wait for the Acorn
+    python link_tune.py --loopback               # self-check over a pty pair
+"""
+
+import argparse
+import logging
+import os
+import select
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from serial_runtime import LINKTUNE_COMMAND, init_serial, setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Candidate rates, all supported by OS_SerialOp on RISC OS 3 and later
+LINK_RATES = [9600, 19200, 38400, 57600, 115200]
+
+PATTERN_LENGTH = 32
+# BBC BASIC strings hold at most 255 characters, so bulk data is sent as lines
+BULK_LINES = 8
+BULK_LINE_LENGTH = 128
+
+
+def checksum(text: str) -> int:
+    return sum(text.encode("latin-1")) % 65536
+
+
+def make_pattern(seq: int, length: int = PATTERN_LENGTH) -> str:
+    """Printable, space-free test pattern that varies every bit position across sequences."""
+    return "".join(chr(33 + (seq * 7 + i * 13) % 94) for i in range(length))
+
+
+def bulk_lines(lines: int = BULK_LINES, length: int = BULK_LINE_LENGTH) -> List[str]:
+    return [make_pattern(100 + i, length) for i in range(lines)]
+
+
+class LinkTuner:
+    """Host side of the link-tuning handshake on an open pyserial connection."""
+
+    def __init__(self, conn: Any, rates: Optional[List[int]] = None, max_rate: int = 115200,
+                 pings: int = 4, timeout: float = 2.0):
+        """
+        Args:
+            conn: Open serial connection, at the rate the Acorn is currently using
+            rates: Candidate rates in ascending order (default: LINK_RATES)
+            max_rate: Highest rate to try
+            pings: Echo round trips per rate
+            timeout: Seconds to wait for each line from the Acorn
+        """
+        self.conn = conn
+        self.rates = [rate for rate in (rates or LINK_RATES) if rate <= max_rate]
+        self.pings = pings
+        self.timeout = timeout
+        self.results: List[Dict[str, Any]] = []
+
+    def send(self, line: str) -> None:
+        self.conn.write((line + "\n").encode("latin-1"))
+        self.conn.flush()
+
+    def read_line(self) -> str:
+        raw = self.conn.readline()
+        return raw.decode("latin-1").strip()
+
+    def set_rate(self, rate: int) -> None:
+        # Drop any noise from the switch; the Acorn pauses before its next line
+        self.conn.baudrate = rate
+        self.conn.reset_input_buffer()
+
+    def wait_for_quiet(self) -> None:
+        """Discard input until the Acorn has been silent for a full timeout."""
+        while self.read_line():
+            pass
+
+    def try_rate(self, rate: int) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"rate": rate, "ok": False, "switched": False}
+        self.send(f"RATE {rate}")
+        reply = self.read_line()
+        if reply == f"NAK {rate}":
+            result["error"] = "unsupported by the Acorn"
+            return result
+        if reply != f"ACK {rate}":
+            result["error"] = f"expected ACK, got {reply!r}"
+            # The ACK may have been garbled after the Acorn switched
+            result["switched"] = True
+            return result
+
+        self.set_rate(rate)
+        result["switched"] = True
+
+        round_trips = []
+        last_pong = None
+        for seq in range(1, self.pings + 1):
+            line = self.read_line()
+            received = time.time()
+            parts = line.split(" ")
+            if len(parts) != 4 or parts[0] != "PING" or parts[1] != str(seq):
+                result["error"] = f"ping {seq}: got {line!r}"
+                return result
+            pattern, total = parts[2], parts[3]
+            if pattern != make_pattern(seq) or total != str(checksum(pattern)):
+                result["error"] = f"ping {seq}: checksum mismatch"
+                return result
+            if last_pong is not None:
+                round_trips.append(received - last_pong)
+            self.send(f"PONG {seq} {pattern} {total}")
+            last_pong = time.time()
+
+        lines = bulk_lines()
+        total = checksum("".join(lines))
+        payload = "".join(line + "\n" for line in lines).encode("latin-1")
+        start = time.time()
+        self.send(f"BULK {len(lines)} {BULK_LINE_LENGTH} {total}")
+        self.conn.write(payload)
+        self.conn.flush()
+        reply = self.read_line()
+        elapsed = time.time() - start
+        if reply != f"BULKOK {total}":
+            result["error"] = f"bulk transfer: got {reply!r}"
+            return result
+
+        result["ok"] = True
+        if round_trips:
+            result["rtt_ms"] = 1000.0 * sum(round_trips) / len(round_trips)
+        result["bytes_per_second"] = len(payload) / elapsed if elapsed > 0 else 0.0
+        result["line_rate"] = rate / 10.0
+        return result
+
+    def confirm(self, rate: int, attempts: int = 3) -> bool:
+        """Agree the final rate: send LINK until the Acorn echoes it."""
+        for _ in range(attempts):
+            self.send(f"LINK {rate}")
+            if self.read_line() == f"LINK {rate}":
+                return True
+        return False
+
+    def run(self) -> int:
+        """Step through the candidate rates and return the one both ends settled on."""
+        old_timeout = self.conn.timeout
+        self.conn.timeout = self.timeout
+        start_rate = self.conn.baudrate
+        good_rate = start_rate
+        try:
+            self.send("LINKTUNE %d %s" % (self.pings, " ".join(str(rate) for rate in self.rates)))
+            for rate in self.rates:
+                if rate <= start_rate:
+                    continue
+                logger.info("Link tuning: trying %d baud", rate)
+                result = self.try_rate(rate)
+                self.results.append(result)
+                if result["ok"]:
+                    logger.info("Link tuning: %d baud good, %.0f bytes/s", rate, result["bytes_per_second"])
+                    good_rate = rate
+                    continue
+
+                logger.warning("Link tuning: %d baud failed (%s)", rate, result.get("error"))
+                if result["switched"]:
+                    # Both ends time out and fall back to the last good rate
+                    self.wait_for_quiet()
+                    self.set_rate(good_rate)
+                break
+
+            if not self.confirm(good_rate):
+                logger.error("Link tuning: Acorn did not confirm %d baud, returning to %d", good_rate, start_rate)
+                self.set_rate(start_rate)
+                return start_rate
+            logger.info("Link tuning: settled on %d baud", good_rate)
+            return good_rate
+        finally:
+            self.conn.timeout = old_timeout
+
+    def report(self) -> str:
+        lines = [f"{'Rate':>8}  {'Result':<8}  {'RTT ms':>7}  {'Bytes/s':>8}  {'Line %':>6}"]
+        for result in self.results:
+            if result["ok"]:
+                lines.append("%8d  %-8s  %7.1f  %8.0f  %5.0f%%" % (
+                    result["rate"], "ok", result.get("rtt_ms", 0.0), result["bytes_per_second"],
+                    100.0 * result["bytes_per_second"] / result["line_rate"]))
+            else:
+                lines.append("%8d  %-8s  %s" % (result["rate"], "failed", result.get("error", "")))
+        return "\n".join(lines)
+
+
+class AcornLinkClient:
+    """Python model of acorn/LinkTune.bas, used for the pty loopback self-check.
+
+    `fail_above` makes rates above it corrupt their pings, to exercise fallback.
+    """
+
+    def __init__(self, fd: int, timeout: float = 2.0, fail_above: Optional[int] = None):
+        self.fd = fd
+        self.timeout = timeout
+        self.fail_above = fail_above
+        self.buffer = b""
+        self.rate = 9600
+        self.settled: Optional[int] = None
+
+    def send(self, line: str) -> None:
+        os.write(self.fd, (line + "\n").encode("latin-1"))
+
+    def read_line(self, timeout: Optional[float] = None) -> str:
+        end = time.time() + (self.timeout if timeout is None else timeout)
+        while b"\n" not in self.buffer:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return ""
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if ready:
+                self.buffer += os.read(self.fd, 4096)
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line.decode("latin-1").strip()
+
+    def test_rate(self, pings: int) -> bool:
+        time.sleep(0.05)  # Give the host time to switch, as LinkTune.bas does
+        for seq in range(1, pings + 1):
+            pattern = make_pattern(seq)
+            sent = pattern
+            if self.fail_above and self.rate > self.fail_above:
+                sent = pattern[:-1] + "?"  # Line noise
+            self.send(f"PING {seq} {sent} {checksum(pattern)}")
+            if self.read_line() != f"PONG {seq} {pattern} {checksum(pattern)}":
+                return False
+
+        parts = self.read_line().split(" ")
+        if len(parts) != 4 or parts[0] != "BULK":
+            return False
+        data = "".join(self.read_line() for _ in range(int(parts[1])))
+        if len(data) != int(parts[1]) * int(parts[2]) or checksum(data) != int(parts[3]):
+            self.send("BULKBAD")
+            return False
+        self.send(f"BULKOK {checksum(data)}")
+        return True
+
+    def run(self) -> None:
+        self.send(LINKTUNE_COMMAND)
+        parts = self.read_line().split(" ")
+        if parts[0] != "LINKTUNE":
+            return
+        pings = int(parts[1])
+        good = self.rate
+
+        while True:
+            line = self.read_line(timeout=4 * self.timeout)
+            if line.startswith("RATE "):
+                rate = int(line[5:])
+                self.send(f"ACK {rate}")
+                self.rate = rate
+                if self.test_rate(pings):
+                    good = rate
+                else:
+                    # Fall back and wait for the host's LINK at the last good rate
+                    self.rate = good
+            elif line.startswith("LINK "):
+                self.send(line)
+                self.settled = int(line[5:])
+                return
+            elif not line:
+                return
+
+
+def run_loopback(fail_above: Optional[int], max_rate: int) -> bool:
+    """Tune against AcornLinkClient over a pty pair and check where it settles."""
+    import pty
+
+    master, slave = pty.openpty()
+    path = os.ttyname(slave)
+    conn = init_serial(path, 9600)
+    if conn is None:
+        return False
+
+    timeout = 0.5
+    client = AcornLinkClient(master, timeout=timeout, fail_above=fail_above)
+    thread = threading.Thread(target=client.run, name="acorn-model", daemon=True)
+    thread.start()
+
+    tuner = LinkTuner(conn, max_rate=max_rate, timeout=timeout)
+    try:
+        if conn.readline().decode("latin-1").strip() != LINKTUNE_COMMAND:
+            print("[FAIL] Did not receive *LINKTUNE")
+            return False
+        settled = tuner.run()
+        thread.join(timeout=10 * timeout)
+    finally:
+        conn.close()
+        os.close(master)
+        os.close(slave)
+
+    expected = max(rate for rate in LINK_RATES
+                   if rate <= max_rate and (fail_above is None or rate <= fail_above))
+    print(tuner.report())
+    if settled == expected and client.settled == expected:
+        print(f"[OK] Both ends settled on {settled} baud")
+        return True
+    print(f"[FAIL] Host settled on {settled}, Acorn on {client.settled}, expected {expected}")
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Negotiate the fastest reliable baud rate with the Acorn")
+    parser.add_argument("--port", default="/dev/ttyUSB0", help="Serial port")
+    parser.add_argument("--baudrate", type=int, default=9600, help="Starting baud rate (default: 9600)")
+    parser.add_argument("--max-baudrate", type=int, default=115200,
+                        help="Highest rate to try (default: 115200)")
+    parser.add_argument("--pings", type=int, default=4, help="Echo round trips per rate (default: 4)")
+    parser.add_argument("--loopback", action="store_true",
+                        help="Self-check against a simulated Acorn over a pty pair")
+    parser.add_argument("--fail-above", type=int, default=None,
+                        help="With --loopback, corrupt pings above this rate to exercise fallback")
+    args = parser.parse_args()
+
+    if args.loopback:
+        logging.basicConfig(level=logging.WARNING, format="%(levelname)s - %(message)s")
+        ok = run_loopback(args.fail_above, args.max_baudrate)
+        if ok and args.fail_above is None:
+            # Also check the fallback path
+            ok = run_loopback(38400, args.max_baudrate)
+        sys.exit(0 if ok else 1)
+
+    setup_logging("link_tune")
+    conn = init_serial(args.port, args.baudrate)
+    if conn is None:
+        sys.exit(1)
+
+    print(f"Waiting for {LINKTUNE_COMMAND} from the Acorn on {args.port} at {args.baudrate} baud...")
+    try:
+        while conn.readline().decode("latin-1").strip() != LINKTUNE_COMMAND:
+            pass
+        tuner = LinkTuner(conn, max_rate=args.max_baudrate, pings=args.pings)
+        settled = tuner.run()
+        print(tuner.report())
+        print(f"Settled on {settled} baud. Start ArmGPT with --baudrate {settled}.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
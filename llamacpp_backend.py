@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+llama-cpp backend: a local quantized GGUF model for limited-RAM hosts.
+
+Conversation history is kept per serial session. Retrieved documentation
+goes into the current user turn only; history keeps the bare messages,
+so llama-cpp reuses the KV cache up to the previous user turn and
+evaluates the rest.
+"""
+
+import logging
+import threading
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import request_log
+from arm_history import ArmHistory, format_user_turn
+from conversation import Conversation, ConversationStore
+from llm_backends import SYSTEM_PROMPT, Backend, BackendError, CancelToken
+
+logger = logging.getLogger(__name__)
+
+ERROR_REPLY = "Error: Unable to generate response"
+
+
+class LlamaCppBackend(Backend):
+    """Quantized GGUF model run in-process with llama-cpp-python."""
+
+    name = "llamacpp"
+
+    def __init__(self, model_path: str = "tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
+                 n_ctx: int = 1024, n_threads: int = 4, reply_tokens: int = 256,
+                 index_path: str = "data/arm_index.jsonl", ollama_url: Optional[str] = None,
+                 context_tokens: int = 256):
+        """
+        Args:
+            model_path: Path to quantized GGUF model file
+            n_ctx: Model context window, shared by conversation history and reply
+            n_threads: CPU threads used by llama-cpp
+            reply_tokens: Context reserved for each reply when trimming history
+            index_path: Documentation index from build_index.py
+            ollama_url: Ollama API base URL for query embeddings (None = BM25 only)
+            context_tokens: Token budget for retrieved documentation per message
+        """
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.reply_tokens = reply_tokens
+        self.llm = None
+        self.lock = threading.Lock()
+        # A smaller documentation budget than the Transformers backend to fit the context window
+        self.arm_history = ArmHistory(index_path=index_path, max_tokens=context_tokens, ollama_url=ollama_url)
+        self.conversations = ConversationStore(
+            lambda: Conversation(SYSTEM_PROMPT, self.count_tokens, self.n_ctx)
+        )
+        self.active_session = None  # Session whose state is loaded in the model
+
+    def init_llm(self) -> bool:
+        """Initialize the LLM model using llama-cpp-python"""
+        try:
+            # Imported here so --help and serial errors don't pay for loading llama-cpp
+            from llama_cpp import Llama
+
+            logger.info(f"Loading quantized model: {self.model_path}")
+            logger.info("This may take a moment...")
+
+            # Initialize with conservative settings for Raspberry Pi
+            self.llm = Llama(
+                model_path=self.model_path,
+                n_ctx=self.n_ctx,          # Increased context window from 512 to 1024
+                n_threads=self.n_threads,  # Use 4 threads on RPi
+                n_gpu_layers=0,            # CPU only
+                verbose=False
+            )
+
+            logger.info("Model loaded successfully")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load LLM model: {e}")
+            logger.error("Make sure you have downloaded the quantized model file")
+            return False
+
+    def startup_tasks(self) -> List[Tuple[str, Callable[[], bool]]]:
+        return [("model", self.init_llm), ("docs", self.arm_history.load)]
+
+    def describe(self) -> List[Tuple[str, str]]:
+        return [("Model", self.model_path), ("Context", f"{self.n_ctx} tokens"),
+                ("Documentation", self.arm_history.describe())]
+
+    def count_tokens(self, text: str) -> int:
+        """Count model tokens in a piece of prompt text"""
+        return len(self.llm.tokenize(text.encode('utf-8'), add_bos=False, special=True))
+
+    def activate_session(self, session_id: str, conversation: Conversation) -> None:
+        """Swap the model's KV cache to the given session's saved state"""
+        if self.active_session == session_id:
+            return
+        if self.active_session is not None:
+            previous = self.conversations.get(self.active_session)
+            previous.model_state = self.llm.save_state()
+        if conversation.model_state is not None:
+            self.llm.load_state(conversation.model_state)
+        self.active_session = session_id
+
+    def cached_prefix(self, prompt: str) -> int:
+        """Count the prompt tokens llama-cpp will reuse from its KV cache"""
+        # Mirrors Llama.generate, which always re-evaluates the last prompt token
+        tokens = self.llm.tokenize(prompt.encode('utf-8'), special=True)
+        cached = 0
+        for old, new in zip(self.llm.input_ids, tokens[:-1]):
+            if old != new:
+                break
+            cached += 1
+        return cached
+
+    def generate(self, message: str, session_id: str = "default",
+                 cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        """Stream a reply, continuing the session's conversation"""
+        with self.lock:
+            conversation = self.conversations.get(session_id)
+            user_text = format_user_turn(message, self.arm_history.relevant(message))
+
+            trimmed = conversation.fit(user_text, self.reply_tokens)
+            if trimmed:
+                logger.info(f"Conversation trimmed to {len(conversation.turns)} turns to fit context")
+            self.activate_session(session_id, conversation)
+
+            # llama-cpp only evaluates the tokens after the longest cached prefix
+            prompt = conversation.prompt_for(user_text)
+            cached = self.cached_prefix(prompt)
+            request_log.note(cache="hit" if cached else "miss", cached_tokens=cached)
+            logger.info(f"Conversation history: {len(conversation.turns)} turns, "
+                        f"{conversation.history_tokens()} tokens")
+
+            parts = []
+            try:
+                # No token limit - generate until natural stop
+                for part in self.llm(
+                    prompt,
+                    max_tokens=-1,
+                    temperature=0.7,
+                    top_p=0.95,
+                    echo=False,
+                    stop=["</s>", "<|user|>", "<|system|>"],
+                    stream=True
+                ):
+                    if cancel and cancel.cancelled():
+                        # Leaving the loop drops llama-cpp's generator, ending evaluation
+                        logger.info(f"Generation cancelled after {len(parts)} chunks")
+                        break
+                    text = part['choices'][0]['text']
+                    if text:
+                        parts.append(text)
+                        yield text
+            except Exception as e:
+                logger.error(f"Error generating response: {e}")
+                raise BackendError(ERROR_REPLY)
+
+            # llama-cpp streams one token per part
+            request_log.note(completion_tokens=len(parts))
+            # The documentation was for this reply only; later turns retrieve their own
+            conversation.add_turn(message, "".join(parts).strip())
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Multiprocess worker pool for the llama-cpp backend.
+
+One Llama instance serves one request at a time, which leaves most cores
+of an x86 host idle when several Acorns share it. LlamaCppPool runs N
+worker processes, each with its own LlamaCppBackend. llama-cpp mmaps the
+GGUF file, so the workers share its pages in the OS page cache rather
+than each holding a copy.
+
+Each serial session sticks to one worker, which keeps its conversation
+and KV cache; new sessions go to the worker with the fewest. Requests
+wait in a per-worker dispatch slot, so a queued request can still be
+cancelled before it reaches the worker. A health check pings idle
+workers and restarts any that die or stop responding.
+
+    python llamacpp_pool.py --model tinyllama.gguf --workers 1 2 4 --threads-per-worker 2
+"""
+
+import argparse
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import request_log
+from llm_backends import Backend, BackendError, CancelToken
+
+logger = logging.getLogger(__name__)
+
+POOL_FAILED_REPLY = "Sorry, I couldn't generate a response right now. Please try again!"
+
+# Seconds between pings of an idle worker, and how long it may take to answer
+HEALTH_INTERVAL = 15.0
+HEALTH_TIMEOUT = 10.0
+
+# Seconds a busy worker may go without producing text before it is restarted
+STALL_TIMEOUT = 120.0
+
+# Seconds to wait for a worker to load the model
+LOAD_TIMEOUT = 300.0
+
+BENCHMARK_PROMPTS = [
+    "Tell me about the Acorn Archimedes.",
+    "Who designed the ARM processor?",
+    "What is RISC OS?",
+    "Why was the ARM1 so power efficient?",
+]
+
+
+class JobCancel(CancelToken):
+    """Cancel token inside a worker: cancelled when the parent names this job."""
+
+    def __init__(self, cancel_job: Any, job_id: int):
+        super().__init__()
+        self.cancel_job = cancel_job
+        self.job_id = job_id
+
+    def cancelled(self) -> bool:
+        return self.cancel_job.value == self.job_id
+
+
+class ResultsLogHandler(logging.handlers.QueueHandler):
+    """Inside a worker: sends log records to the parent over the results queue.
+
+    The parent logs them through its own handlers, so worker output goes
+    to the same rotating file as everything else.
+    """
+
+    def __init__(self, index: int, results: Any):
+        super().__init__(results)
+        self.index = index
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.msg = f"Worker {self.index}: {record.msg}"
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self.queue.put((self.index, "log", record))
+
+
+def worker_main(index: int, model_path: str, n_ctx: int, n_threads: int, reply_tokens: int,
+                context_options: Dict[str, Any], requests: Any, results: Any, cancel_job: Any,
+                log_level: int = logging.INFO) -> None:
+    """Worker process: load the model, then answer jobs from `requests` until told to stop."""
+    root_logger = logging.getLogger()
+    root_logger.handlers = [ResultsLogHandler(index, results)]
+    root_logger.setLevel(log_level)
+    # Imported here so the parent never loads llama-cpp itself
+    from llamacpp_backend import LlamaCppBackend
+
+    backend = LlamaCppBackend(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads,
+                              reply_tokens=reply_tokens, **context_options)
+    results.put((index, "ready", all(task() for _, task in backend.startup_tasks())))
+
+    while True:
+        kind, payload = requests.get()
+        if kind == "stop":
+            break
+        if kind == "ping":
+            results.put((index, "pong", None))
+            continue
+
+        job_id, message, session_id, received_at = payload
+        start = time.time()
+        chunks = 0
+        # What the backend notes goes back to the parent's request record before the job ends
+        record = request_log.RequestRecord(received_at=received_at)
+        try:
+            with request_log.active(record):
+                for text in backend.generate(message, session_id=session_id,
+                                             cancel=JobCancel(cancel_job, job_id)):
+                    chunks += 1
+                    results.put((index, "chunk", (job_id, text)))
+            outcome: Tuple[str, Tuple[Any, ...]] = ("done", (job_id, chunks, time.time() - start))
+        except BackendError as e:
+            outcome = ("error", (job_id, str(e)))
+        except Exception as e:
+            logging.getLogger(__name__).error("Job %d failed: %s", job_id, e, exc_info=True)
+            outcome = ("error", (job_id, POOL_FAILED_REPLY))
+        fields = {key: value for key, value in record.fields.items() if key != "mode"}
+        results.put((index, "note", (job_id, fields, record.stages)))
+        results.put((index, *outcome))
+
+
+class Worker:
+    """Parent-side handle on one worker process."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.requests: Any = None
+        self.cancel_job: Any = None
+        self.ready = threading.Event()
+        self.healthy = False
+        self.slot = threading.Lock()  # Held by the request the worker is running
+        self.restart_lock = threading.Lock()
+        self.job: Optional[int] = None
+        self.job_events: Optional[queue.Queue] = None
+        self.last_seen = time.time()
+        self.ping_sent: Optional[float] = None
+        self.sessions: set = set()
+        self.restarts = 0
+        self.jobs_done = 0
+        self.chunks = 0
+        self.busy_seconds = 0.0
+
+
+class LlamaCppPool(Backend):
+    """llama-cpp inference spread over several worker processes."""
+
+    name = "llamacpp-pool"
+
+    def __init__(self, model_path: str = "tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
+                 workers: int = 2, n_threads: int = 2, n_ctx: int = 1024, reply_tokens: int = 256,
+                 health_interval: float = HEALTH_INTERVAL, index_path: str = "data/arm_index.jsonl",
+                 ollama_url: Optional[str] = None, context_tokens: int = 256):
+        """
+        Args:
+            model_path: Path to quantized GGUF model file, mmapped by every worker
+            workers: Number of worker processes
+            n_threads: CPU threads per worker; workers * n_threads should not exceed the cores
+            n_ctx: Context window of each worker's model
+            reply_tokens: Context reserved for each reply when trimming history
+            health_interval: Seconds between pings of idle workers
+            index_path: Documentation index from build_index.py, loaded by each worker
+            ollama_url: Ollama API base URL for query embeddings (None = BM25 only)
+            context_tokens: Token budget for retrieved documentation per message
+        """
+        self.model_path = model_path
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.reply_tokens = reply_tokens
+        self.health_interval = health_interval
+        self.context_options = {"index_path": index_path, "ollama_url": ollama_url,
+                                "context_tokens": context_tokens}
+        # spawn, not fork: the parent runs threads, and llama-cpp is not fork-safe
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.workers = [Worker(index) for index in range(max(1, workers))]
+        self.session_workers: Dict[str, Worker] = {}
+        self.lock = threading.Lock()
+        self.next_job = 1
+        self.stop_event = threading.Event()
+        self.dispatcher = threading.Thread(target=self.dispatch, name="llamacpp-pool", daemon=True)
+
+    # ─── Worker lifecycle ────────────────────────────────────────────
+
+    def start_worker(self, worker: Worker) -> None:
+        worker.ready.clear()
+        worker.healthy = False
+        worker.requests = self.context.Queue()
+        worker.cancel_job = self.context.Value("q", 0, lock=False)
+        worker.process = self.context.Process(
+            target=worker_main,
+            args=(worker.index, self.model_path, self.n_ctx, self.n_threads, self.reply_tokens,
+                  self.context_options, worker.requests, self.results, worker.cancel_job,
+                  logging.getLogger().getEffectiveLevel()),
+            name=f"llamacpp-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        worker.last_seen = time.time()
+        worker.ping_sent = None
+        logger.info("Started worker %d (pid %d, %d threads)", worker.index, worker.process.pid, self.n_threads)
+
+    def restart_worker(self, worker: Worker, reason: str, process: Any) -> None:
+        """Replace `process`, the worker process the caller found at fault.
+
+        The health check and a request thread can both give up on the same
+        stalled process; whoever comes second finds it already replaced
+        and does nothing.
+        """
+        with worker.restart_lock:
+            if worker.process is not process:
+                logger.info("Worker %d was already restarted (%s)", worker.index, reason)
+                return
+            logger.error("Restarting worker %d: %s", worker.index, reason)
+            if worker.job_events is not None:
+                worker.job_events.put(("error", (POOL_FAILED_REPLY,)))
+            if process is not None and process.is_alive():
+                process.kill()
+                process.join(5)
+            with self.lock:
+                # Its conversations went with the process
+                for session_id in worker.sessions:
+                    if self.session_workers.get(session_id) is worker:
+                        del self.session_workers[session_id]
+                worker.sessions.clear()
+            worker.restarts += 1
+            self.start_worker(worker)
+
+    def init_workers(self) -> bool:
+        """Start every worker and wait for their models to load; fine if at least one does."""
+        for worker in self.workers:
+            self.start_worker(worker)
+        self.dispatcher.start()
+
+        deadline = time.time() + LOAD_TIMEOUT
+        for worker in self.workers:
+            worker.ready.wait(max(0.0, deadline - time.time()))
+        healthy = sum(worker.healthy for worker in self.workers)
+        logger.info("%d of %d workers loaded %s", healthy, len(self.workers), self.model_path)
+        return healthy > 0
+
+    # ─── Dispatcher ──────────────────────────────────────────────────
+
+    def dispatch(self) -> None:
+        """Route worker results to their requests and run the health checks."""
+        while not self.stop_event.is_set():
+            try:
+                index, kind, payload = self.results.get(timeout=1.0)
+            except queue.Empty:
+                self.check_health()
+                continue
+            except (EOFError, OSError):
+                return
+
+            worker = self.workers[index]
+            worker.last_seen = time.time()
+            if kind == "log":
+                logging.getLogger(payload.name).handle(payload)
+            elif kind == "ready":
+                worker.healthy = bool(payload)
+                worker.ready.set()
+                if not payload:
+                    logger.error("Worker %d could not load the model", index)
+            elif kind == "pong":
+                worker.ping_sent = None
+            elif worker.job_events is not None and payload[0] == worker.job:
+                worker.job_events.put((kind, payload[1:]))
+            self.check_health()
+
+    def check_health(self) -> None:
+        now = time.time()
+        for worker in self.workers:
+            process = worker.process
+            if process is None:
+                continue
+            if not process.is_alive():
+                if not worker.ready.is_set():
+                    logger.error("Worker %d exited while loading the model (code %s)",
+                                 worker.index, process.exitcode)
+                    worker.process = None
+                    worker.ready.set()
+                else:
+                    self.restart_worker(worker, f"process exited with code {process.exitcode}", process)
+            elif not worker.ready.is_set() or not worker.healthy:
+                continue
+            elif worker.job is not None:
+                if now - worker.last_seen > STALL_TIMEOUT:
+                    self.restart_worker(worker, f"no output for {STALL_TIMEOUT:.0f} seconds", process)
+            elif worker.ping_sent is not None:
+                if now - worker.ping_sent > HEALTH_TIMEOUT:
+                    self.restart_worker(worker, f"no reply to ping in {HEALTH_TIMEOUT:.0f} seconds", process)
+            elif now - worker.last_seen > self.health_interval:
+                worker.ping_sent = now
+                worker.requests.put(("ping", None))
+
+    # ─── Backend interface ───────────────────────────────────────────
+
+    def startup_tasks(self) -> List[Tuple[str, Callable[[], bool]]]:
+        return [("workers", self.init_workers)]
+
+    def describe(self) -> List[Tuple[str, str]]:
+        return [
+            ("Model", self.model_path),
+            ("Workers", f"{len(self.workers)} x {self.n_threads} threads"),
+            ("Context", f"{self.n_ctx} tokens"),
+        ]
+
+    def pick_worker(self, session_id: str) -> Worker:
+        """The session's own worker, or the healthy worker with the fewest sessions."""
+        with self.lock:
+            worker = self.session_workers.get(session_id)
+            if worker is not None and worker.healthy:
+                return worker
+            if worker is not None:
+                # Moving on: the old worker no longer holds (or counts) this session
+                worker.sessions.discard(session_id)
+            candidates = [worker for worker in self.workers if worker.healthy]
+            if not candidates:
+                raise BackendError(POOL_FAILED_REPLY)
+            worker = min(candidates, key=lambda candidate: (len(candidate.sessions), candidate.slot.locked()))
+            worker.sessions.add(session_id)
+            self.session_workers[session_id] = worker
+            logger.info("Session %s assigned to worker %d", session_id, worker.index)
+            return worker
+
+    def generate(self, message: str, session_id: str = "default",
+                 cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        worker = self.pick_worker(session_id)
+
+        # Wait for the worker's slot; a request cancelled while queued never reaches it
+        while not worker.slot.acquire(timeout=0.1):
+            if cancel and cancel.cancelled():
+                return
+        try:
+            with self.lock:
+                job_id = self.next_job
+                self.next_job += 1
+            events: queue.Queue = queue.Queue()
+            worker.job, worker.job_events = job_id, events
+            worker.last_seen = time.time()
+            process = worker.process
+            record = request_log.current()
+            received_at = record.received_at if record is not None else time.time()
+            worker.requests.put(("generate", (job_id, message, session_id, received_at)))
+
+            finished = False
+            try:
+                while True:
+                    if cancel and cancel.cancelled():
+                        worker.cancel_job.value = job_id
+                    try:
+                        kind, payload = events.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+                    if kind == "chunk":
+                        yield payload[0]
+                    elif kind == "note":
+                        fields, stages = payload
+                        request_log.absorb(fields, stages)
+                    elif kind == "done":
+                        finished = True
+                        chunks, seconds = payload
+                        worker.jobs_done += 1
+                        worker.chunks += chunks
+                        worker.busy_seconds += seconds
+                        logger.info("Worker %d: %d tokens in %.2f seconds", worker.index, chunks, seconds)
+                        return
+                    else:
+                        finished = True
+                        raise BackendError(payload[0])
+            finally:
+                if not finished:
+                    # The caller stopped reading; let the worker finish before reusing it
+                    worker.cancel_job.value = job_id
+                    self.drain(worker, events, process)
+        finally:
+            worker.job, worker.job_events = None, None
+            worker.slot.release()
+
+    def drain(self, worker: Worker, events: queue.Queue, process: Any) -> None:
+        deadline = time.time() + HEALTH_TIMEOUT
+        while time.time() < deadline:
+            try:
+                kind, _ = events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind not in ("chunk", "note"):
+                return
+        self.restart_worker(worker, "did not stop after cancel", process)
+
+    def stats(self) -> List[Tuple[int, int, int, float, int]]:
+        """Per worker: index, jobs, tokens, busy seconds and restarts."""
+        return [(worker.index, worker.jobs_done, worker.chunks, worker.busy_seconds, worker.restarts)
+                for worker in self.workers]
+
+    def close(self) -> None:
+        self.stop_event.set()
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.requests.put(("stop", None))
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+        for line in self.summary_lines():
+            logger.info(line)
+
+    def summary_lines(self) -> List[str]:
+        lines = []
+        for index, jobs, chunks, seconds, restarts in self.stats():
+            rate = chunks / seconds if seconds else 0.0
+            lines.append(f"Worker {index}: {jobs} requests, {chunks} tokens, "
+                         f"{rate:.1f} tokens/s, {restarts} restarts")
+        return lines
+
+
+# ─── Benchmark ───────────────────────────────────────────────────
+
+def benchmark(model_path: str, workers: int, n_threads: int, requests: int) -> float:
+    """Answer `requests` prompts from separate sessions at once; returns aggregate tokens/s."""
+    pool = LlamaCppPool(model_path=model_path, workers=workers, n_threads=n_threads)
+    if not pool.init_workers():
+        pool.close()
+        raise SystemExit("No worker could load the model")
+
+    tokens = [0] * requests
+
+    def run(number: int) -> None:
+        prompt = BENCHMARK_PROMPTS[number % len(BENCHMARK_PROMPTS)]
+        for _ in pool.generate(prompt, session_id=f"bench-{number}"):
+            tokens[number] += 1
+
+    start = time.time()
+    threads = [threading.Thread(target=run, args=(number,)) for number in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    pool.close()
+    return sum(tokens) / elapsed if elapsed else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the llama-cpp worker pool")
+    parser.add_argument("--model", default="tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
+                        help="Path to quantized GGUF model")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4],
+                        help="Worker counts to compare (default: 1 2 4)")
+    parser.add_argument("--threads-per-worker", type=int, default=2,
+                        help="llama-cpp threads per worker (default: 2)")
+    parser.add_argument("--requests", type=int, default=8,
+                        help="Concurrent requests per run, each from its own session (default: 8)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    if not os.path.exists(args.model):
+        sys.exit(f"Model not found: {args.model}")
+
+    print(f"{os.cpu_count()} CPUs, {args.requests} concurrent requests, "
+          f"{args.threads_per_worker} threads per worker")
+    baseline = None
+    for workers in args.workers:
+        rate = benchmark(args.model, workers, args.threads_per_worker, args.requests)
+        baseline = baseline or rate
+        print(f"  {workers:2d} workers: {rate:7.1f} tokens/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Inference backends behind a common streaming interface.
+
+Every backend turns one Acorn message into a stream of reply text via
+generate(). The serial front-end (serial_runtime.py) drives any of them,
+so queueing, streaming and framing only need implementing once.
+Backend modules are imported on first use, keeping heavy dependencies
+such as torch and llama_cpp out of cold start.
+"""
+
+import importlib
+import logging
+import threading
+from typing import Callable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ArmGPT personality system prompt, shared by the local-model backends
+SYSTEM_PROMPT = """You are ArmGPT, a friendly and knowledgeable AI assistant connected to an Acorn computer via serial port. You have a warm, gentle personality and enjoy helping Acorn enthusiasts with their computing needs.
+
+Key traits:
+- Always introduce yourself as ArmGPT when greeting users
+- Be enthusiastic about retro computing and Acorn computers
+- Keep responses as SHORT as possible - aim for 1-2 sentences, maximum 2 short paragraphs only when absolutely necessary
+- Use a conversational, amicable tone
+- Show interest in what the user is working on
+- If asked about yourself, mention you're running on a Raspberry Pi connected to their Acorn
+
+IMPORTANT: Be concise! Serial terminals are limited. Give complete but brief answers.
+
+Remember: You're not generic customer support - you're ArmGPT, a specialized companion for Acorn computer users!"""
+
+# Backend name -> (module, class), imported lazily by create_backend()
+BACKENDS = {
+    "ollama": ("ollama_backend", "OllamaBackend"),
+    "llamacpp": ("llamacpp_backend", "LlamaCppBackend"),
+    "llamacpp-pool": ("llamacpp_pool", "LlamaCppPool"),
+    "transformers": ("transformers_backend", "TransformersBackend"),
+    "codex": ("codex_backend", "CodexBackend"),
+}
+
+
+class BackendError(Exception):
+    """A backend could not answer; the message is sent to the Acorn as the reply."""
+
+
+class CancelToken:
+    """Set when the Acorn abandons a request; backends stop generating and free up.
+
+    Blocking work (an HTTP stream, a subprocess) registers a callback that
+    interrupts it; generation loops check cancelled() between chunks.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.callbacks: List[Callable[[], None]] = []
+        self.lock = threading.Lock()
+
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self) -> None:
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Cancel callback failed: %s", e)
+
+    def on_cancel(self, callback: Callable[[], None]) -> None:
+        """Run callback when cancelled, straight away if that has already happened."""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return
+        callback()
+
+    def remove(self, callback: Callable[[], None]) -> None:
+        with self.lock:
+            if callback in self.callbacks:
+                self.callbacks.remove(callback)
+
+
+class Backend:
+    """Base class for inference backends."""
+
+    name = "backend"
+
+    def startup_tasks(self) -> List[Tuple[str, Callable[[], bool]]]:
+        """Named tasks (model load, warm-up, index load) run concurrently at startup."""
+        return []
+
+    def describe(self) -> List[Tuple[str, str]]:
+        """Label/value pairs shown in the startup banner."""
+        return []
+
+    def generate(self, message: str, session_id: str = "default",
+                 cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        """Yield the reply to one message as text chunks, raising BackendError on failure.
+
+        When `cancel` is cancelled the stream ends early without an error.
+        Backends that keep a conversation record the cancelled reply as far
+        as it got, so the next turn sees what the Acorn was sent.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Release background threads, subprocesses or models."""
+
+
+def create_backend(name: str, **kwargs) -> Backend:
+    """Import a backend module on demand and construct its backend."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}; choose from {', '.join(BACKENDS)}")
+    module_name, class_name = BACKENDS[name]
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)(**kwargs)
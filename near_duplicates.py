@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection with MinHash and locality-sensitive hashing.
+
+A chunk's MinHash signature holds NUM_PERM minimum hash values over its
+word 5-gram shingles; the fraction of positions where two signatures
+agree estimates the Jaccard similarity of the shingle sets. It uses
+one-permutation hashing: each shingle hash is split into a bin number
+and a value, and every bin keeps its minimum, so a signature costs one
+pass over the shingles instead of one per permutation. LSH splits
+each signature into bands and buckets chunks by band, so a new chunk is
+compared only against chunks that share at least one band rather than
+the whole corpus.
+
+A bin no shingle lands in stays EMPTY_BIN and says nothing about the
+text, so similarity() only compares bins that at least one signature
+filled. Texts with fewer than MIN_SHINGLES shingles leave most bins
+empty and get no signature at all: they are too short to judge and are
+always kept.
+
+build_index.py computes signatures in its preparation workers and uses
+an LSHIndex to collapse near-duplicate chunks before embedding them.
+The index keeps its signatures, band buckets and the duplicates it
+found in SQLite, in a file next to the build output, so the build's
+memory stays flat however large the corpus is.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+NUM_PERM = 64
+BANDS = 16
+SHINGLE_WORDS = 5
+
+# Jaccard similarity above which two chunks count as the same passage. Chunk
+# boundaries fall differently around a repeated passage, so a real copy in
+# data/arm_docs (a chart ARM25.txt prints twice) scores only about 0.66;
+# apart from those, no two chunks there score above 0.4 at any shingle size
+DEFAULT_THRESHOLD = 0.6
+
+# Fewer shingles than this leave too many bins empty for a reliable estimate
+MIN_SHINGLES = NUM_PERM // 2
+
+# Pages SQLite may cache per LSH index (about 16 MB); the rest stays on disk
+CACHE_KIB = 16 * 1024
+# Rows between commits, so inserts reach the file rather than piling up in one transaction
+COMMIT_EVERY = 4096
+
+BIN_BITS = NUM_PERM.bit_length() - 1
+EMPTY_BIN = (1 << 64) - 1
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> Set[int]:
+    """64-bit hashes of the text's overlapping word n-grams (blake2b, so stable across processes)."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < size:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return {int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little")
+            for gram in grams}
+
+
+def minhash(text: str) -> Optional[array]:
+    """The text's MinHash signature as NUM_PERM unsigned 64-bit values, or None if it is too short."""
+    hashes = shingles(text)
+    if len(hashes) < MIN_SHINGLES:
+        return None
+    return bin_minimums(hashes)
+
+
+def bin_minimums(hashes: Set[int]) -> array:
+    """One-permutation hashing: the low bits pick a bin, which keeps the smallest of the rest."""
+    signature = array("Q", [EMPTY_BIN] * NUM_PERM)
+    for h in hashes:
+        position, value = h & (NUM_PERM - 1), h >> BIN_BITS
+        if value < signature[position]:
+            signature[position] = value
+    return signature
+
+
+def similarity(a: array, b: array) -> float:
+    """Estimated Jaccard similarity of two signatures, over the bins either of them filled."""
+    filled = matches = 0
+    for x, y in zip(a, b):
+        if x == EMPTY_BIN and y == EMPTY_BIN:
+            continue
+        filled += 1
+        matches += x == y
+    return matches / filled if filled else 0.0
+
+
+class LSHIndex:
+    """
+    Banded LSH over the signatures of the chunks kept so far.
+
+    Everything lives in an SQLite database at `path` (in memory by
+    default); only CACHE_KIB of it is held in memory. The file is scratch
+    space: it is replaced when an index is opened and removed by close().
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, bands: int = BANDS, path: str = ":memory:"):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.path = path
+        if path != ":memory:" and os.path.exists(path):
+            os.remove(path)
+        self.db = sqlite3.connect(path)
+        # Scratch data rebuilt by every run, so no journal and no fsync
+        self.db.executescript(f"""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            PRAGMA cache_size = -{CACHE_KIB};
+            CREATE TABLE signatures (key INTEGER PRIMARY KEY, signature BLOB);
+            CREATE TABLE buckets (band INTEGER, band_key INTEGER, key INTEGER);
+            CREATE INDEX buckets_by_key ON buckets (band, band_key);
+            CREATE TABLE duplicates (original INTEGER, source TEXT, chunk_id INTEGER);
+        """)
+        self.pending_rows = 0
+
+    def band_keys(self, signature: array) -> List[int]:
+        # Tuples of ints hash the same in every process, so the keys are stable
+        return [hash(tuple(signature[band * self.rows:(band + 1) * self.rows]))
+                for band in range(self.bands)]
+
+    def find(self, signature: array) -> Optional[int]:
+        """The kept chunk most similar to this signature, if any reaches the threshold."""
+        candidates: Set[int] = set()
+        for band, key in enumerate(self.band_keys(signature)):
+            candidates.update(row[0] for row in self.db.execute(
+                "SELECT key FROM buckets WHERE band = ? AND band_key = ?", (band, key)))
+        best, best_score = None, self.threshold
+        for candidate in sorted(candidates):
+            stored = array("Q")
+            stored.frombytes(self.db.execute("SELECT signature FROM signatures WHERE key = ?",
+                                             (candidate,)).fetchone()[0])
+            score = similarity(signature, stored)
+            if score >= best_score:
+                best, best_score = candidate, score
+                if score == 1.0:
+                    break
+        return best
+
+    def add(self, key: int, signature: array) -> None:
+        self.db.execute("INSERT INTO signatures VALUES (?, ?)", (key, signature.tobytes()))
+        self.db.executemany("INSERT INTO buckets VALUES (?, ?, ?)",
+                            [(band, band_key, key) for band, band_key in enumerate(self.band_keys(signature))])
+        self.written(1 + self.bands)
+
+    def add_duplicate(self, original: int, source: str, chunk_id: int) -> None:
+        """Record that chunk_id of source was collapsed into the kept chunk `original`."""
+        self.db.execute("INSERT INTO duplicates VALUES (?, ?, ?)", (original, source, chunk_id))
+        self.written(1)
+
+    def duplicates(self) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+        """(kept chunk, the chunks collapsed into it) in kept-chunk order."""
+        self.db.commit()
+        group: List[Dict[str, Any]] = []
+        current = None
+        for original, source, chunk_id in self.db.execute(
+                "SELECT original, source, chunk_id FROM duplicates ORDER BY original, rowid"):
+            if original != current and group:
+                yield current, group
+                group = []
+            current = original
+            group.append({"source": source, "chunk_id": chunk_id})
+        if group:
+            yield current, group
+
+    def written(self, rows: int) -> None:
+        self.pending_rows += rows
+        if self.pending_rows >= COMMIT_EVERY:
+            self.db.commit()
+            self.pending_rows = 0
+
+    def close(self) -> None:
+        self.db.close()
+        if self.path != ":memory:" and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# ─── Self-check ──────────────────────────────────────────────────
+
+SHORT_UNRELATED = ("The A310 shipped in 1987 with one megabyte.",
+                   "Sophie Wilson wrote BBC BASIC for the Acorn.")
+PASSAGE = ("The ARM1 was designed at Acorn Computers in Cambridge by Sophie Wilson and Steve Furber, "
+           "who wanted a processor that could keep up with fast memory without the complexity of the "
+           "chips they had evaluated. The first silicon came back from VLSI Technology in April 1985 "
+           "and worked the first time it was powered up. Its successor, the ARM2, added a multiply "
+           "instruction and a coprocessor interface and went into the Archimedes range in 1987, where "
+           "it made the A310 one of the fastest personal computers of its day.")
+UNRELATED_PASSAGE = ("RISC OS stores its configuration in CMOS RAM, which keeps settings such as the "
+                     "boot filing system, the screen mode at startup and the serial port speed across "
+                     "power cycles. Holding Delete while switching on resets every setting to its "
+                     "factory default, and the Configure application in later versions edits the same "
+                     "values from the desktop without typing star commands at the command line.")
+
+
+def check() -> bool:
+    """Short unrelated texts are kept, a lightly edited passage is merged, an unrelated one is not."""
+    ok = True
+    index = LSHIndex()
+
+    for text in SHORT_UNRELATED:
+        if minhash(text) is not None:
+            print(f"[FAIL] {text!r} has too few shingles but got a signature")
+            ok = False
+    # Their mostly empty signatures must not match on the empty bins either
+    score = similarity(*(bin_minimums(shingles(text)) for text in SHORT_UNRELATED))
+    print(f"Short unrelated texts: similarity {score:.3f}")
+    if score >= DEFAULT_THRESHOLD:
+        print("[FAIL] Empty bins counted as matches")
+        ok = False
+
+    original = minhash(PASSAGE)
+    index.add(0, original)
+    edited = minhash(PASSAGE.replace("in April 1985", "in 1985"))
+    unrelated = minhash(UNRELATED_PASSAGE)
+    print(f"Edited passage: similarity {similarity(original, edited):.3f}, "
+          f"unrelated passage: {similarity(original, unrelated):.3f}")
+    if index.find(edited) != 0:
+        print("[FAIL] Lightly edited passage was not merged")
+        ok = False
+    if index.find(unrelated) is not None:
+        print("[FAIL] Unrelated passage was merged")
+        ok = False
+
+    if ok:
+        print("[OK] Near-duplicate detection checks passed")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MinHash near-duplicate detection")
+    parser.add_argument("texts", nargs="*", help="Two texts to compare")
+    parser.add_argument("--check", action="store_true",
+                        help="Check that short or unrelated texts are not merged")
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check() else 1)
+    if len(args.texts) != 2:
+        parser.error("give two texts to compare, or --check")
+    a, b = (minhash(text) for text in args.texts)
+    if a is None or b is None:
+        print(f"Too short to compare: each text needs {MIN_SHINGLES} word {SHINGLE_WORDS}-grams")
+        return
+    print(f"Estimated Jaccard similarity: {similarity(a, b):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Ollama backend with RAG from the ARM documentation index.
+
+Chat and embeddings go through a local Ollama server. Substantive
+questions are grounded with the top chunks of the index built by
+build_index.py, ranked by BM25 and embeddings together (see
+hybrid_retriever.py). The intent router (intent_router.py) decides per
+message: greetings get a canned reply, small talk skips retrieval, and
+short factual lookups use a few BM25 chunks without an embed call.
+
+Each serial session keeps its own chat history, trimmed to the chat
+model's context window like the local backends' (see conversation.py).
+Retrieved documentation goes with the current message only.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+import request_log
+from conversation import Conversation, ConversationStore
+from hybrid_retriever import HybridRetriever, pack_chunks, retrieved_ids
+from intent_router import CANNED_REPLIES, NO_RETRIEVAL, IntentRouter
+from keyword_matcher import is_conversational
+from llm_backends import SYSTEM_PROMPT, Backend, BackendError, CancelToken
+from text_chunker import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Chunks retrieved for a short factual lookup, within half the context budget
+SHORT_TOP_K = 2
+
+CHAT_FAILED_REPLY = "Sorry, I couldn't generate a response right now. Please try again!"
+
+RAG_GROUNDING = """You also have access to ARM history documentation. Use the context below to ground your answers when relevant. If the context doesn't cover the question, you can still answer from general knowledge, but let the user know you're going beyond your documentation."""
+
+# ─── Ollama helpers ──────────────────────────────────────────────
+
+def check_ollama(ollama_url: str) -> bool:
+    """Verify Ollama is reachable."""
+    try:
+        resp = requests.get(ollama_url, timeout=5)
+        if resp.status_code == 200:
+            logger.info(f"Ollama is reachable at {ollama_url}")
+            return True
+    except requests.ConnectionError:
+        pass
+    logger.error(f"Cannot reach Ollama at {ollama_url}")
+    return False
+
+
+def embed_query(text: str, ollama_url: str, embed_model: str,
+                keep_alive: Optional[str] = None) -> Optional[List[float]]:
+    """Get an embedding vector for a query string."""
+    url = f"{ollama_url}/api/embed"
+    payload = {"model": embed_model, "input": [text]}
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    try:
+        resp = requests.post(url, json=payload, timeout=30)
+        resp.raise_for_status()
+        data = resp.json()
+
+        if isinstance(data, dict) and "embeddings" in data:
+            embs = data["embeddings"]
+            if isinstance(embs, list) and len(embs) > 0 and isinstance(embs[0], list):
+                return embs[0]
+
+        if isinstance(data, dict) and "embedding" in data:
+            possible = data["embedding"]
+            if isinstance(possible, list) and possible:
+                return possible
+
+        logger.warning("Unexpected embedding response structure")
+        return None
+    except Exception as e:
+        logger.error(f"Embedding request failed: {e}")
+        return None
+
+
+def ollama_chat(messages: List[Dict[str, str]], ollama_url: str, chat_model: str,
+                keep_alive: Optional[str] = None,
+                cancel: Optional[CancelToken] = None) -> Iterator[str]:
+    """Stream a chat completion from Ollama, yielding content as it is generated.
+
+    Cancelling closes the HTTP stream, which makes Ollama stop generating.
+    """
+    url = f"{ollama_url}/api/chat"
+    payload = {
+        "model": chat_model,
+        "messages": messages,
+        "stream": True,
+    }
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    try:
+        with requests.post(url, json=payload, timeout=120, stream=True) as resp:
+            if cancel:
+                cancel.on_cancel(resp.close)
+            try:
+                resp.raise_for_status()
+                for line in resp.iter_lines():
+                    if cancel and cancel.cancelled():
+                        break
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if "error" in data:
+                        raise ValueError(data["error"])
+                    content = data.get("message", {}).get("content", "")
+                    if content:
+                        yield content
+                    if data.get("done"):
+                        request_log.note(prompt_tokens=data.get("prompt_eval_count"),
+                                         completion_tokens=data.get("eval_count"))
+                        break
+            finally:
+                if cancel:
+                    cancel.remove(resp.close)
+    except Exception as e:
+        if cancel and cancel.cancelled():
+            logger.info("Chat request cancelled")
+            return
+        logger.error(f"Chat request failed: {e}")
+        raise BackendError(CHAT_FAILED_REPLY)
+
+
+def warm_up(ollama_url: str, chat_model: str, embed_model: str,
+            keep_alive: str) -> Dict[str, float]:
+    """
+    Load the embed and chat models and pre-evaluate the system prompt.
+
+    Returns the time spent on each step so warm-up cost is reported apart
+    from request latency.
+    """
+    timings: Dict[str, float] = {}
+
+    start = time.time()
+    if embed_query("warm-up", ollama_url, embed_model, keep_alive=keep_alive) is None:
+        logger.warning(f"Embed model {embed_model} did not warm up")
+    timings["embed"] = time.time() - start
+
+    # A one-token reply after the system prompt loads the chat model and leaves
+    # the system prompt in Ollama's prompt cache for the first real request
+    start = time.time()
+    url = f"{ollama_url}/api/chat"
+    payload = {
+        "model": chat_model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": "hello"},
+        ],
+        "stream": False,
+        "keep_alive": keep_alive,
+        "options": {"num_predict": 1},
+    }
+    try:
+        resp = requests.post(url, json=payload, timeout=300)
+        resp.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Chat model {chat_model} did not warm up: {e}")
+    timings["chat"] = time.time() - start
+
+    return timings
+
+
+class KeepAlive:
+    """Background thread that pings Ollama so idle models stay resident."""
+
+    def __init__(self, ollama_url: str, chat_model: str, embed_model: str,
+                 keep_alive: str, interval: float):
+        self.ollama_url = ollama_url
+        self.chat_model = chat_model
+        self.embed_model = embed_model
+        self.keep_alive = keep_alive
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.loop, name="ollama-keepalive", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+        logger.info(f"Keep-alive ping every {self.interval:.0f}s (keep_alive={self.keep_alive})")
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def ping(self) -> None:
+        # A generate request without a prompt only loads the model and resets its timer
+        try:
+            requests.post(f"{self.ollama_url}/api/generate",
+                          json={"model": self.chat_model, "keep_alive": self.keep_alive},
+                          timeout=120)
+        except Exception as e:
+            logger.warning(f"Keep-alive ping for {self.chat_model} failed: {e}")
+        embed_query("keep-alive", self.ollama_url, self.embed_model, keep_alive=self.keep_alive)
+
+    def loop(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            self.ping()
+
+
+# ─── RAG helpers ─────────────────────────────────────────────────
+
+def retrieve_context(query: str, query_embedding: Optional[List[float]],
+                     retriever: Optional[HybridRetriever],
+                     top_k: int = 5, max_tokens: int = 1024) -> str:
+    """
+    Retrieve the top-K most relevant chunks by BM25 and embedding rank fusion,
+    keeping as many as fit in max_tokens.
+    Falls back to BM25 alone if query_embedding is None.
+    """
+    if not retriever:
+        return ""
+
+    selected = pack_chunks(retriever.search(query, query_embedding, top_k=top_k), max_tokens)
+    logger.info(f"Retrieved {len(selected)} chunks "
+                f"(BM25 {retriever.last_timings['bm25_ms']:.1f} ms, "
+                f"dense {retriever.last_timings['dense_ms']:.1f} ms)")
+    request_log.mark("retrieved")
+    request_log.note(retrieved=retrieved_ids(selected))
+
+    parts = []
+    for chunk, _ in selected:
+        source = chunk.get("source", "unknown")
+        text = chunk.get("text", "")
+        parts.append(f"[{source}]\n{text}")
+
+    return "\n\n".join(parts)
+
+
+# ─── Backend ─────────────────────────────────────────────────────
+
+class OllamaBackend(Backend):
+    """Ollama chat with retrieval over the ARM documentation index."""
+
+    name = "ollama"
+
+    def __init__(self, ollama_url: str = "http://localhost:11434",
+                 chat_model: str = "qwen2.5:1.5b",
+                 embed_model: str = "nomic-embed-text",
+                 index_path: str = "data/arm_index.jsonl",
+                 keep_alive: str = "30m",
+                 keepalive_interval: float = 600.0,
+                 top_k: int = 5,
+                 max_context_tokens: int = 1024,
+                 intent_router: bool = True,
+                 intent_model: str = "data/intent_model.json",
+                 intent_examples: str = "data/intent_examples.jsonl",
+                 context_window: int = 2048,
+                 reply_tokens: int = 256):
+        self.ollama_url = ollama_url
+        self.chat_model = chat_model
+        self.embed_model = embed_model
+        self.index_path = index_path
+        self.keep_alive = keep_alive
+        self.keepalive_interval = keepalive_interval
+        self.top_k = top_k
+        self.max_context_tokens = max_context_tokens
+        self.use_intent_router = intent_router
+        self.intent_model = intent_model
+        self.intent_examples = intent_examples
+        self.retriever: Optional[HybridRetriever] = None
+        self.intent_router: Optional[IntentRouter] = None
+        self.warmup_timings: Dict[str, float] = {}
+        self.keepalive: Optional[KeepAlive] = None
+        self.reply_tokens = reply_tokens
+        # No tokenizer on this side of the API, so history is budgeted with the chunker's estimate
+        self.conversations = ConversationStore(
+            lambda: Conversation(SYSTEM_PROMPT, count_tokens, context_window)
+        )
+        self.conversations_lock = threading.Lock()
+
+    def prepare_ollama(self) -> bool:
+        if not check_ollama(self.ollama_url):
+            logger.error("Ollama is not reachable. Please start Ollama and try again.")
+            return False
+
+        # Warm up both models so the first message runs at steady-state latency
+        self.warmup_timings = warm_up(self.ollama_url, self.chat_model, self.embed_model, self.keep_alive)
+        logger.info(f"Warm-up completed in {sum(self.warmup_timings.values()):.2f} seconds "
+                    f"(embed {self.warmup_timings['embed']:.2f}s, chat {self.warmup_timings['chat']:.2f}s)")
+
+        if self.keepalive_interval > 0:
+            self.keepalive = KeepAlive(self.ollama_url, self.chat_model, self.embed_model,
+                                       self.keep_alive, self.keepalive_interval)
+            self.keepalive.start()
+        return True
+
+    def prepare_index(self) -> bool:
+        self.retriever = HybridRetriever.load(self.index_path)
+        if not self.retriever:
+            logger.warning("No index loaded — RAG context will be unavailable.")
+        return True
+
+    def prepare_router(self) -> bool:
+        if self.use_intent_router:
+            self.intent_router = IntentRouter.from_files(self.intent_model, self.intent_examples)
+        return True
+
+    def startup_tasks(self) -> List[Tuple[str, Callable[[], bool]]]:
+        return [("ollama", self.prepare_ollama), ("index", self.prepare_index),
+                ("intent router", self.prepare_router)]
+
+    def describe(self) -> List[Tuple[str, str]]:
+        details = [
+            ("Chat model", self.chat_model),
+            ("Embed model", self.embed_model),
+            ("Index", self.index_path),
+        ]
+        if self.retriever:
+            details.append(("Index chunks", str(len(self.retriever))))
+        details.append(("Intent routing", "classifier" if self.intent_router else "greeting keywords"))
+        if self.warmup_timings:
+            details.append(("Warm-up time", f"{sum(self.warmup_timings.values()):.2f} seconds"))
+        return details
+
+    def route(self, message: str) -> str:
+        """The intent deciding how much retrieval, if any, the message gets."""
+        if not self.intent_router:
+            return "chat" if is_conversational(message) else "full"
+        intent, confidence = self.intent_router.classify(message)
+        logger.info(f"Routed as {intent} ({confidence:.2f})")
+        request_log.note(intent=intent, intent_confidence=round(confidence, 3))
+        return intent
+
+    def retrieve(self, message: str, intent: str = "full") -> str:
+        """Documentation context for the message, as much as its intent calls for."""
+        if intent in NO_RETRIEVAL:
+            # Simple conversation — personality only, no RAG
+            logger.info("Conversational message detected, skipping RAG")
+            return ""
+
+        if intent == "short":
+            # Factual lookup — BM25 finds exact names without an embed call
+            context = retrieve_context(message, None, self.retriever, top_k=SHORT_TOP_K,
+                                       max_tokens=self.max_context_tokens // 2)
+        else:
+            # Substantive query — use RAG
+            query_emb = embed_query(message, self.ollama_url, self.embed_model, keep_alive=self.keep_alive)
+            request_log.mark("embedded")
+            if query_emb is None:
+                logger.warning("No query embedding; falling back to BM25 only")
+            context = retrieve_context(message, query_emb, self.retriever, top_k=self.top_k,
+                                       max_tokens=self.max_context_tokens)
+        return context
+
+    def build_messages(self, message: str, context: str,
+                       conversation: Conversation) -> List[Dict[str, str]]:
+        """The session's history, with this message's documentation in the system prompt."""
+        system_content = conversation.system_text()
+        if context:
+            system_content += "\n\n" + RAG_GROUNDING + "\n\n--- Retrieved Context ---\n" + context
+
+        messages = [{"role": "system", "content": system_content}]
+        for user_text, assistant_text in conversation.turns:
+            messages.append({"role": "user", "content": user_text})
+            messages.append({"role": "assistant", "content": assistant_text})
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def generate(self, message: str, session_id: str = "default",
+                 cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        intent = self.route(message)
+        if intent in CANNED_REPLIES:
+            request_log.note(cache="canned")
+            yield CANNED_REPLIES[intent]
+            return
+        context = self.retrieve(message, intent)
+        with self.conversations_lock:
+            conversation = self.conversations.get(session_id)
+            # The documentation takes up context this turn, so it counts against the budget
+            turn_text = f"{context}\n\n{message}" if context else message
+            if conversation.fit(turn_text, self.reply_tokens):
+                logger.info(f"Conversation trimmed to {len(conversation.turns)} turns to fit context")
+            messages = self.build_messages(message, context, conversation)
+        if cancel and cancel.cancelled():
+            return
+
+        parts = []
+        for text in ollama_chat(messages, self.ollama_url, self.chat_model,
+                                keep_alive=self.keep_alive, cancel=cancel):
+            parts.append(text)
+            yield text
+        # A cancelled reply is kept as far as it got, as the local backends keep theirs
+        with self.conversations_lock:
+            conversation.add_turn(message, "".join(parts).strip())
+
+    def close(self) -> None:
+        if self.keepalive:
+            self.keepalive.stop()
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+replay_logs.py — Replay logged Acorn traffic against any backend.
+
+Pulls the messages and their arrival times out of the serial logs
+("Readline result: b'...'", "Received raw bytes: b'...'" and "Decoded
+message: '...'" lines) and the structured request logs, then plays them
+into a SerialFrontEnd over a pty pair, as the Acorn would have sent them.
+Gaps between messages are kept, capped at --max-gap and divided by
+--speed, so a day of traffic can be replayed in minutes.
+
+The front-end is the production one, so a message that arrives while a
+reply is still being generated is dropped just as it would be on the
+real link. Every answered message has its request record, which gives
+the latency of each stage measured from when the message was sent; the
+messages without one are the drops.
+
+    python replay_logs.py --list                              # show what would be replayed
+    python replay_logs.py --backend simulated --speed 10      # queueing only, no model
+    python replay_logs.py --backend ollama --model qwen2.5:1.5b --save replay.json
+    python replay_logs.py --backend ollama --baseline replay.json
+"""
+
+import argparse
+import ast
+import glob
+import json
+import logging
+import os
+import re
+import select
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import request_log
+from analyze_logs import distribution, finite, read_records
+from backend_router import MODEL_ARGUMENT, add_router_arguments, with_fallback
+from llm_backends import BACKENDS, Backend, CancelToken, create_backend
+from serial_framing import LINE_COMMAND
+from serial_runtime import (CANCEL_LINES, FRAMED_COMMAND, LINKTUNE_COMMAND, SerialFrontEnd, decode_message,
+                            setup_logging, start_backend, stop_logging)
+from serial_writer import add_output_arguments
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATTERNS = ["logs/serial_*.log*", "logs/serial_*.requests.jsonl*"]
+
+LOG_TIME = re.compile(r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}) - ")
+# Raw bytes from the current front-end (--debug) and the older scripts
+RAW_MESSAGE = re.compile(r"(?:Readline result|Raw bytes received|Received raw bytes): "
+                         r"(?P<raw>b'.*'|b\".*\")(?: \(hex: [0-9a-f]*\))?\s*$")
+TEXT_MESSAGE = re.compile(r"(?:Decoded message: (?P<repr>'.*'|\".*\")(?: \(length: \d+\))?|Received: (?P<text>.*\S))\s*$")
+
+# Commands that switch the link out of line mode; the replay only speaks lines
+SKIPPED_COMMANDS = {LINKTUNE_COMMAND, FRAMED_COMMAND, LINE_COMMAND}
+
+# Seconds with no send and no reply in progress before the replay is over
+SETTLE_SECONDS = 1.0
+
+
+class Arrival(NamedTuple):
+    at: float
+    data: bytes
+    text: str
+    source: str
+
+
+# ─── Extraction ──────────────────────────────────────────────────
+
+def log_arrivals(path: str) -> List[Arrival]:
+    """Messages in a text log, from the raw bytes lines when it has them."""
+    raw: List[Arrival] = []
+    decoded: List[Arrival] = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            stamp = LOG_TIME.match(line)
+            if not stamp:
+                continue
+            at = datetime.strptime(stamp.group(1), "%Y-%m-%d %H:%M:%S,%f").timestamp()
+            match = RAW_MESSAGE.search(line)
+            if match:
+                try:
+                    data = ast.literal_eval(match.group("raw"))
+                except (ValueError, SyntaxError):
+                    continue
+                raw.append(Arrival(at, data, decode_message(data), path))
+                continue
+            match = TEXT_MESSAGE.search(line)
+            if match:
+                if match.group("repr"):
+                    try:
+                        text = ast.literal_eval(match.group("repr"))
+                    except (ValueError, SyntaxError):
+                        continue
+                else:
+                    text = match.group("text")
+                decoded.append(Arrival(at, text.encode("utf-8"), text.strip(), path))
+    return raw or decoded
+
+
+def record_arrivals(path: str) -> List[Arrival]:
+    """Messages in a structured request log."""
+    return [Arrival(float(record["received_at"]), str(record["message"]).encode("utf-8"),
+                    str(record["message"]), path)
+            for record in read_records([path]) if record.get("message")]
+
+
+def is_noise(arrival: Arrival) -> bool:
+    """Line noise: nothing but NULs and whitespace."""
+    return not arrival.text.replace("\x00", "").strip()
+
+
+def extract_arrivals(paths: Iterable[str], keep_noise: bool = False) -> Iterator[Arrival]:
+    """Messages from every log in arrival order, without the copies a text and a request log share."""
+    arrivals: List[Arrival] = []
+    for path in paths:
+        try:
+            if ".requests.jsonl" in path:
+                arrivals.extend(record_arrivals(path))
+            else:
+                arrivals.extend(log_arrivals(path))
+        except OSError as e:
+            logger.warning("Could not read %s: %s", path, e)
+
+    previous: Optional[Arrival] = None
+    for arrival in sorted(arrivals, key=lambda arrival: arrival.at):
+        if arrival.text in SKIPPED_COMMANDS or (is_noise(arrival) and not keep_noise):
+            continue
+        if previous and previous.text == arrival.text and arrival.at - previous.at < 1.0:
+            continue
+        previous = arrival
+        yield arrival
+
+
+def schedule(arrivals: List[Arrival], speed: float, max_gap: float) -> List[float]:
+    """Seconds after the start of the replay at which to send each message."""
+    offsets: List[float] = []
+    offset = 0.0
+    for index, arrival in enumerate(arrivals):
+        if index:
+            gap = min(max(arrival.at - arrivals[index - 1].at, 0.0), max_gap)
+            offset += gap / speed
+        offsets.append(offset)
+    return offsets
+
+
+# ─── Replay ──────────────────────────────────────────────────────
+
+class SimulatedBackend(Backend):
+    """Stands in for a model: a fixed-length reply after a delay, streamed at a steady rate."""
+
+    name = "simulated"
+
+    def __init__(self, first_chunk: float = 1.0, chars_per_second: float = 40.0, reply_chars: int = 160):
+        self.first_chunk = first_chunk
+        self.chars_per_second = chars_per_second
+        self.reply_chars = reply_chars
+
+    def describe(self):
+        return [("Simulated reply", f"{self.reply_chars} chars after {self.first_chunk:g}s "
+                                    f"at {self.chars_per_second:g} chars/s")]
+
+    def generate(self, message: str, session_id: str = "default",
+                 cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        cancel = cancel or CancelToken()
+        text = (f"Simulated reply to {message!r}. " * (self.reply_chars // 20 + 1))[:self.reply_chars]
+        if cancel.event.wait(self.first_chunk):
+            return
+        for start in range(0, len(text), 8):
+            yield text[start:start + 8]
+            if cancel.event.wait(8 / self.chars_per_second):
+                return
+
+
+class ReplayFrontEnd(SerialFrontEnd):
+    """The production front-end, keeping each request record for the report."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.records: List[request_log.RequestRecord] = []
+        self.busy = threading.Event()
+        self.last_finished = time.time()
+
+    def stream_reply(self, message: str) -> None:
+        self.busy.set()
+        try:
+            super().stream_reply(message)
+        finally:
+            record = request_log.current()
+            if record is not None:
+                self.records.append(record)
+            self.last_finished = time.time()
+            self.busy.clear()
+
+
+class AcornSide:
+    """The Acorn's end of the pty: sends messages and drains the replies."""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+        self.reply_bytes = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.drain, name="replay-acorn", daemon=True)
+        self.thread.start()
+
+    def send(self, data: bytes) -> float:
+        os.write(self.fd, data + b"\r\n")
+        return time.time()
+
+    def drain(self) -> None:
+        while not self.stopping.is_set():
+            ready, _, _ = select.select([self.fd], [], [], 0.1)
+            if ready:
+                try:
+                    self.reply_bytes += len(os.read(self.fd, 4096))
+                except OSError:
+                    return
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.thread.join()
+
+
+def replay(backend: Backend, arrivals: List[Arrival], offsets: List[float], timeout: float,
+           **options) -> Dict[str, Any]:
+    """Play the messages into a front-end over a pty pair and measure what came back."""
+    import pty
+
+    master, slave = pty.openpty()
+    startup = start_backend(backend)
+    print(f"Waiting for the {backend.name} backend...")
+    if not startup.wait() or not startup.ok():
+        raise RuntimeError(f"Backend startup failed: {', '.join(startup.failed())}")
+
+    port = os.ttyname(slave)
+    front_end = ReplayFrontEnd(backend, port, **options)
+    server = threading.Thread(target=front_end.run, args=(startup,), name="replay-front-end", daemon=True)
+    server.start()
+    # Opening the port flushes its input, so nothing is sent until the front-end has it open
+    while front_end.writer is None and server.is_alive():
+        time.sleep(0.05)
+    if not server.is_alive():
+        backend.close()
+        os.close(master)
+        os.close(slave)
+        raise RuntimeError(f"Front-end could not open {port}")
+    acorn = AcornSide(master)
+
+    print(f"Replaying {len(arrivals)} messages over {offsets[-1]:.1f} seconds...")
+    sent_at: List[float] = []
+    start = time.time()
+    try:
+        for arrival, offset in zip(arrivals, offsets):
+            delay = start + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            sent_at.append(acorn.send(arrival.data))
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            idle_since = max(sent_at[-1], front_end.last_finished)
+            if not front_end.busy.is_set() and time.time() - idle_since >= SETTLE_SECONDS:
+                break
+            time.sleep(0.05)
+        else:
+            logger.warning("Replay timed out with a reply still in progress")
+    finally:
+        elapsed = time.time() - start
+        front_end.stop()
+        server.join(timeout=5)
+        acorn.stop()
+        backend.close()
+        os.close(master)
+        os.close(slave)
+
+    return measure(arrivals, sent_at, front_end.records, elapsed, acorn.reply_bytes)
+
+
+# ─── Report ──────────────────────────────────────────────────────
+
+def measure(arrivals: List[Arrival], sent_at: List[float], records: List[request_log.RequestRecord],
+            elapsed: float, reply_bytes: int) -> Dict[str, Any]:
+    """Match records to the messages sent, in order; messages left unmatched were dropped."""
+    latencies: Dict[str, List[float]] = {"first_chunk": [], "sent": []}
+    outcomes: Dict[str, int] = {}
+    caches: Dict[str, int] = {}
+    dropped = stopped = 0
+
+    position = 0
+    for record in records:
+        message = record.fields.get("message", "")
+        while position < len(arrivals) and arrivals[position].text != message:
+            if arrivals[position].text.lower() in CANCEL_LINES:
+                stopped += 1
+            else:
+                dropped += 1
+            position += 1
+        if position == len(arrivals):
+            break
+        queued = record.received_at - sent_at[position]
+        for stage, values in latencies.items():
+            if stage in record.stages:
+                values.append(round(queued * 1000 + record.stages[stage], 1))
+        outcome = record.fields.get("outcome", "unknown")
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if record.fields.get("cache"):
+            caches[record.fields["cache"]] = caches.get(record.fields["cache"], 0) + 1
+        position += 1
+    for arrival in arrivals[position:]:
+        if arrival.text.lower() in CANCEL_LINES:
+            stopped += 1
+        else:
+            dropped += 1
+
+    return {
+        "messages": len(arrivals),
+        "answered": len(records),
+        "dropped": dropped,
+        "stop_requests": stopped,
+        "elapsed_s": round(elapsed, 1),
+        "reply_bytes": reply_bytes,
+        "outcomes": outcomes,
+        "cache": caches,
+        "latency_ms": {stage: distribution(values) for stage, values in latencies.items()},
+    }
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """A message for every figure worse than the baseline by more than tolerance."""
+    regressions = []
+    if result["dropped"] > baseline.get("dropped", 0):
+        regressions.append(f"dropped {result['dropped']} vs baseline {baseline['dropped']}")
+    for stage, dist in result["latency_ms"].items():
+        base = baseline.get("latency_ms", {}).get(stage, {})
+        for key in ("p50", "p90"):
+            if base.get(key) and dist["count"] and dist[key] > base[key] * (1.0 + tolerance):
+                regressions.append(f"{stage} {key}: {dist[key]:.0f} ms vs baseline {base[key]:.0f} ms")
+    return regressions
+
+
+def print_result(result: Dict[str, Any]) -> None:
+    print(f"\n{result['messages']} messages replayed in {result['elapsed_s']:.1f} seconds")
+    print(f"Answered {result['answered']}, dropped {result['dropped']} (arrived during a reply)"
+          + (f", {result['stop_requests']} stop requests" if result["stop_requests"] else ""))
+    if result["outcomes"]:
+        print("Outcomes: " + ", ".join(f"{name} {count}" for name, count in result["outcomes"].items()))
+    if result["cache"]:
+        print("Cache: " + ", ".join(f"{name} {count}" for name, count in result["cache"].items()))
+    print(f"Reply bytes received: {result['reply_bytes']}")
+
+    print("\nLatency after send (ms)")
+    print(f"  {'stage':<12} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for stage, dist in result["latency_ms"].items():
+        if dist["count"]:
+            print(f"  {stage:<12} {dist['count']:>6} {dist['p50']:>8.0f} {dist['p90']:>8.0f} "
+                  f"{dist['p99']:>8.0f} {dist['max']:>8.0f}")
+
+
+def parse_option(text: str) -> Tuple[str, Any]:
+    """KEY=VALUE, with VALUE read as JSON when it parses (numbers, true, null)."""
+    key, _, value = text.partition("=")
+    try:
+        return key, json.loads(value)
+    except json.JSONDecodeError:
+        return key, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay logged Acorn messages against a backend over a pty")
+    parser.add_argument("paths", nargs="*",
+                        help=f"Serial or request logs to replay (default: {' and '.join(DEFAULT_PATTERNS)})")
+    parser.add_argument("--backend", default="simulated", choices=sorted(BACKENDS) + ["simulated"],
+                        help="Backend to replay against (default: simulated)")
+    parser.add_argument("--model", help="Model for the backend (GGUF path, Ollama or Hugging Face model name)")
+    parser.add_argument("--set", dest="options", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra backend argument, e.g. --set index_path=data/arm_index.jsonl; repeatable")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay this many times faster than logged; inf sends everything at once (default: 1)")
+    parser.add_argument("--max-gap", type=float, default=60.0,
+                        help="Longest logged gap kept between messages, in seconds (default: 60)")
+    parser.add_argument("--limit", type=int, help="Replay only the first N messages")
+    parser.add_argument("--keep-noise", action="store_true",
+                        help="Also replay messages that are only NULs or whitespace")
+    parser.add_argument("--list", action="store_true", help="Print the messages and send times, then exit")
+    parser.add_argument("--baudrate", type=int, default=9600,
+                        help="Rate the replies are paced at, as on the real link (default: 9600)")
+    parser.add_argument("--timeout", type=float, default=300.0,
+                        help="Seconds to wait for the last reply (default: 300)")
+    parser.add_argument("--save", help="Write the results to this JSON file, e.g. as a new baseline")
+    parser.add_argument("--baseline", help="Compare against a JSON file written by --save")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown against the baseline before failing (default: 0.25)")
+
+    simulated = parser.add_argument_group("simulated backend")
+    simulated.add_argument("--sim-first-chunk", type=float, default=1.0,
+                           help="Seconds before the first chunk of each reply (default: 1)")
+    simulated.add_argument("--sim-rate", type=float, default=40.0,
+                           help="Reply characters generated per second (default: 40)")
+    simulated.add_argument("--sim-reply-chars", type=int, default=160,
+                           help="Characters per reply (default: 160)")
+
+    add_output_arguments(parser)
+    add_router_arguments(parser)
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    paths = args.paths or sorted(path for pattern in DEFAULT_PATTERNS for path in glob.glob(pattern))
+    arrivals = list(extract_arrivals(paths, keep_noise=args.keep_noise))[:args.limit]
+    if not arrivals:
+        print(f"No messages in {', '.join(paths) or ' or '.join(DEFAULT_PATTERNS)}")
+        sys.exit(1)
+    offsets = schedule(arrivals, args.speed, args.max_gap)
+
+    if args.list:
+        for arrival, offset in zip(arrivals, offsets):
+            print(f"{offset:9.2f}s  {arrival.text!r}")
+        print(f"{len(arrivals)} messages from {len(paths)} logs, {offsets[-1]:.1f} seconds at {args.speed:g}x")
+        return
+
+    log_path = setup_logging("replay", console=False)
+    print(f"Server log: {log_path}")
+    if args.backend == "simulated":
+        backend: Backend = SimulatedBackend(args.sim_first_chunk, args.sim_rate, args.sim_reply_chars)
+    else:
+        kwargs = dict(parse_option(option) for option in args.options)
+        if args.model:
+            kwargs[MODEL_ARGUMENT[args.backend]] = args.model
+        backend = create_backend(args.backend, **kwargs)
+    backend = with_fallback(backend, args)
+
+    try:
+        result = replay(backend, arrivals, offsets, args.timeout, baudrate=args.baudrate,
+                        title="ArmGPT replay", flow_control=args.flow_control, chunk_size=args.chunk_size,
+                        max_baudrate=args.max_baudrate, wire_mode=args.wire_mode)
+    finally:
+        stop_logging()
+    result.update(backend=backend.name, speed=args.speed)
+    print_result(result)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(finite(result), f, indent=2)
+        print(f"[OK] Wrote results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("[FAIL] Replay regressions:")
+            for regression in regressions:
+                print(f"    {regression}")
+            sys.exit(1)
+        print(f"[OK] Nothing worse than baseline by more than {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
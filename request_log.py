@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Structured per-request log: one JSON object per line for offline analysis.
+
+The serial front-end opens a RequestRecord for every message it answers
+and makes it the active record for its thread while the backend runs.
+Anything along the way can then add to it without the record being
+passed through Backend.generate(): the Ollama backend notes its intent,
+retrieved chunk ids and scores and token counts, the local backends
+their KV cache outcome, and the front-end the stage timings and the
+bytes put on the wire. When the reply is finished the record is written
+to logs/<prefix>_<timestamp>.requests.jsonl, next to the text log,
+through the same kind of background queue so the serial loop never
+waits on the file.
+
+A record looks like:
+
+    {"ts": "2026-10-19T10:00:00.123", "received_at": 1792404000.123,
+     "session": "/dev/ttyUSB0", "mode": "line", "backend": "ollama",
+     "message": "Who designed the ARM?", "message_chars": 21,
+     "intent": "short", "retrieved": [{"source": "ARM25.txt", "chunk_id": 4, "score": 0.0328}],
+     "prompt_tokens": 612, "completion_tokens": 41, "cache": "miss",
+     "stages": {"started": 0.2, "retrieved": 3.1, "first_chunk": 412.8, "generated": 1630.4, "sent": 1702.9},
+     "text_bytes": 180, "wire_bytes": 121, "outcome": "ok"}
+
+Stage times are milliseconds after the message was received. Fields a
+backend cannot know are left out. analyze_logs.py aggregates the files.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Records only; never propagated to the text log
+records_logger = logging.getLogger("armgpt.requests")
+records_logger.propagate = False
+records_logger.setLevel(logging.INFO)
+
+record_listener: Optional[logging.handlers.QueueListener] = None
+active_records = threading.local()
+
+
+class RequestRecord:
+    """Fields and stage timings of one request."""
+
+    def __init__(self, message: str = "", session: str = "", backend: str = "",
+                 mode: str = "line", received_at: Optional[float] = None):
+        self.received_at = received_at if received_at is not None else time.time()
+        self.fields: Dict[str, Any] = {}
+        self.stages: Dict[str, float] = {}
+        if message:
+            self.fields.update(message=message, message_chars=len(message))
+        if session:
+            self.fields["session"] = session
+        if backend:
+            self.fields["backend"] = backend
+        self.fields["mode"] = mode
+
+    def note(self, **fields: Any) -> None:
+        self.fields.update(fields)
+
+    def mark(self, stage: str) -> None:
+        """Record that a stage was reached now; the first time counts."""
+        if stage not in self.stages:
+            self.stages[stage] = round((time.time() - self.received_at) * 1000, 1)
+
+    def merge(self, other: "RequestRecord") -> None:
+        """Take what another record (a hedged backend's) noted."""
+        self.fields.update({key: value for key, value in other.fields.items() if key != "mode"})
+        for stage, elapsed in other.stages.items():
+            self.stages.setdefault(stage, elapsed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(self.received_at).isoformat(timespec="milliseconds"),
+            "received_at": round(self.received_at, 3),
+        }
+        data.update(self.fields)
+        data["stages"] = dict(sorted(self.stages.items(), key=lambda item: item[1]))
+        return data
+
+
+def current() -> Optional[RequestRecord]:
+    """The record active on this thread, if any."""
+    return getattr(active_records, "record", None)
+
+
+@contextmanager
+def active(record: Optional[RequestRecord]) -> Iterator[Optional[RequestRecord]]:
+    """Make record the active one on this thread for the duration."""
+    previous = current()
+    active_records.record = record
+    try:
+        yield record
+    finally:
+        active_records.record = previous
+
+
+def note(**fields: Any) -> None:
+    """Add fields to the active record; a no-op outside a request."""
+    record = current()
+    if record is not None:
+        record.note(**fields)
+
+
+def mark(stage: str) -> None:
+    record = current()
+    if record is not None:
+        record.mark(stage)
+
+
+def absorb(fields: Dict[str, Any], stages: Dict[str, float]) -> None:
+    """Add what a record elsewhere (a pool worker's) noted to the active record."""
+    record = current()
+    if record is not None:
+        record.note(**fields)
+        for stage, elapsed in stages.items():
+            record.stages.setdefault(stage, elapsed)
+
+
+def write(record: RequestRecord) -> None:
+    """Queue the record for the request log, if one is open."""
+    if record_listener is None:
+        return
+    try:
+        records_logger.info(json.dumps(record.to_dict(), ensure_ascii=False, default=str))
+    except (TypeError, ValueError) as e:
+        logger.warning("Could not serialize request record: %s", e)
+
+
+def open_request_log(path: str, max_bytes: int, backup_count: int) -> None:
+    """Write records to path from a background thread, rotating at max_bytes."""
+    global record_listener
+    close_request_log()
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                   encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    record_queue: queue.SimpleQueue = queue.SimpleQueue()
+    record_listener = logging.handlers.QueueListener(record_queue, handler)
+    record_listener.start()
+    records_logger.handlers = [logging.handlers.QueueHandler(record_queue)]
+
+
+def close_request_log() -> None:
+    """Write out whatever is still queued and stop the writer thread."""
+    global record_listener
+    if record_listener:
+        record_listener.stop()
+        for handler in record_listener.handlers:
+            handler.close()
+        record_listener = None
+    records_logger.handlers = []
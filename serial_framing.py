@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+serial_framing.py — Framed binary protocol for pipelined Acorn requests.
+
+Line mode allows one question in flight and a stray newline in a reply
+desyncs both ends. After the Acorn sends `*FRAMED` and the host answers
+`FRAMED`, both sides exchange frames instead:
+
+    A5 | type | request id | length (2 bytes, big-endian) | payload | CRC16
+
+The CRC is CRC-16/CCITT-FALSE over type, id, length and payload. The
+frame types are:
+
+    REQ     Acorn -> host   a question; payload is the message text
+    ACK     host -> Acorn   request queued; payload is its queue position
+    PART    host -> Acorn   the next piece of the reply
+    END     host -> Acorn   reply complete
+    ERR     host -> Acorn   request failed; payload is the error message
+    CANCEL  either way      drop a request (queued, or stop its reply)
+
+The decoder resynchronises on the next magic byte after any corrupt
+frame, so line noise costs at most the frames it touches. Plain lines
+outside frames are still seen, so a restarted Acorn program can send
+`*FRAMED` again, or `*LINE` to return to line mode.
+
+    python serial_framing.py --fuzz 20000    # fuzz the encoder and decoder
+"""
+
+import argparse
+import logging
+import random
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from typing import Any, List, Optional
+
+import request_log
+from llm_backends import BackendError, CancelToken
+from serial_runtime import EMPTY_REPLY, FRAMED_COMMAND, STALLED_REPLY, InputWatcher, decode_message
+
+logger = logging.getLogger(__name__)
+
+LINE_COMMAND = "*LINE"
+
+MAGIC = 0xA5
+HEADER_SIZE = 5  # magic, type, request id, 2-byte length
+CRC_SIZE = 2
+MAX_PAYLOAD = 1024
+
+REQ = 0x01
+PART = 0x02
+END = 0x03
+CANCEL = 0x04
+ERR = 0x05
+ACK = 0x06
+
+FRAME_TYPES = {REQ: "REQ", PART: "PART", END: "END", CANCEL: "CANCEL", ERR: "ERR", ACK: "ACK"}
+
+# Longest run of stray bytes kept while looking for a plain command line
+MAX_STRAY_LINE = 64
+
+# Requests the host queues behind the one being answered; more are cancelled
+MAX_PIPELINED = 8
+
+# Seconds without input before a partial frame is given up on
+IDLE_FLUSH = 1.0
+
+Frame = namedtuple("Frame", ["type", "request_id", "payload"])
+
+
+def _crc_table() -> List[int]:
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data: bytes, crc: int = 0xFFFF) -> int:
+    """CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF)."""
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def encode_frame(frame_type: int, request_id: int, payload: bytes = b"") -> bytes:
+    if frame_type not in FRAME_TYPES:
+        raise ValueError(f"Unknown frame type {frame_type}")
+    if not 0 <= request_id <= 0xFF:
+        raise ValueError(f"Request id {request_id} out of range")
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload of {len(payload)} bytes exceeds {MAX_PAYLOAD}")
+
+    body = bytes([frame_type, request_id, len(payload) >> 8, len(payload) & 0xFF]) + payload
+    crc = crc16(body)
+    return bytes([MAGIC]) + body + bytes([crc >> 8, crc & 0xFF])
+
+
+def encode_frames(frame_type: int, request_id: int, payload: bytes) -> bytes:
+    """Encode a payload of any size as one or more frames of the same type."""
+    if not payload:
+        return encode_frame(frame_type, request_id)
+    return b"".join(encode_frame(frame_type, request_id, payload[start:start + MAX_PAYLOAD])
+                    for start in range(0, len(payload), MAX_PAYLOAD))
+
+
+class FrameDecoder:
+    """Incremental frame decoder that resynchronises after corruption."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.stray = bytearray()
+        self.lines: List[str] = []
+        self.frames_decoded = 0
+        self.errors = 0
+
+    def skip(self, count: int) -> None:
+        """Drop bytes that are not part of a valid frame, watching them for plain command lines."""
+        for byte in self.buffer[:count]:
+            if byte == 0x0A:
+                line = self.stray.decode("latin-1").strip()
+                if line.startswith("*"):
+                    self.lines.append(line)
+                self.stray.clear()
+            elif len(self.stray) < MAX_STRAY_LINE:
+                self.stray.append(byte)
+        del self.buffer[:count]
+
+    def feed(self, data: bytes) -> List[Frame]:
+        """Add received bytes and return every complete, valid frame."""
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(MAGIC)
+            if start < 0:
+                self.skip(len(self.buffer))
+                return frames
+            if start:
+                self.skip(start)
+
+            if len(self.buffer) < HEADER_SIZE:
+                return frames
+            frame_type, request_id = self.buffer[1], self.buffer[2]
+            length = (self.buffer[3] << 8) | self.buffer[4]
+            if frame_type not in FRAME_TYPES or length > MAX_PAYLOAD:
+                self.errors += 1
+                self.skip(1)
+                continue
+
+            end = HEADER_SIZE + length + CRC_SIZE
+            if len(self.buffer) < end:
+                return frames
+            received_crc = (self.buffer[end - 2] << 8) | self.buffer[end - 1]
+            if crc16(bytes(self.buffer[1:end - CRC_SIZE])) != received_crc:
+                # Resync from the byte after this magic; a real frame may start inside
+                self.errors += 1
+                self.skip(1)
+                continue
+
+            frames.append(Frame(frame_type, request_id, bytes(self.buffer[HEADER_SIZE:end - CRC_SIZE])))
+            self.frames_decoded += 1
+            self.stray.clear()
+            del self.buffer[:end]
+
+    def flush(self) -> List[Frame]:
+        """Give up on a partial frame, e.g. after the line has gone idle, and decode what follows it."""
+        frames = []
+        while self.buffer:
+            self.errors += 1
+            self.skip(1)
+            frames.extend(self.feed(b""))
+        return frames
+
+    def take_lines(self) -> List[str]:
+        """Plain `*` command lines seen between frames since the last call."""
+        lines, self.lines = self.lines, []
+        return lines
+
+
+class FramedSession:
+    """Framed mode for one SerialFrontEnd: pipelined requests, streamed PART frames, cancellation."""
+
+    def __init__(self, front_end: Any):
+        self.front_end = front_end
+        self.decoder = FrameDecoder()
+        self.queue = deque()  # (request id, message, time received) waiting behind the current reply
+        self.current: Optional[int] = None
+        self.token: Optional[CancelToken] = None
+        self.pending_line: Optional[str] = None
+        self.last_input = time.time()
+        # Frames are read on a watcher thread while a reply streams, so ACKs
+        # and PARTs can be written from two threads
+        self.send_lock = threading.Lock()
+
+    def send(self, frame_type: int, request_id: int, payload: bytes = b"") -> None:
+        with self.send_lock:
+            self.front_end.writer.write(encode_frames(frame_type, request_id, payload))
+
+    def poll(self) -> Optional[str]:
+        """Handle whatever the Acorn has sent; returns a plain command line that ends framed mode."""
+        conn = self.front_end.conn
+        data = conn.read(conn.in_waiting) if conn.in_waiting > 0 else b""
+        frames = self.decoder.feed(data)
+        if data:
+            self.last_input = time.time()
+        elif self.decoder.buffer and time.time() - self.last_input > IDLE_FLUSH:
+            frames += self.decoder.flush()
+            logger.warning("Dropped a partial frame after %.1f seconds idle", IDLE_FLUSH)
+
+        for frame in frames:
+            self.handle_frame(frame)
+        for line in self.decoder.take_lines():
+            if line.upper() in (LINE_COMMAND, FRAMED_COMMAND):
+                return line.upper()
+            logger.info("Ignored plain line in framed mode: %r", line)
+        return None
+
+    def handle_frame(self, frame: Frame) -> None:
+        if frame.type == REQ:
+            if len(self.queue) >= MAX_PIPELINED:
+                logger.warning("Request %d refused: %d already queued", frame.request_id, len(self.queue))
+                self.send(CANCEL, frame.request_id, b"busy")
+                return
+            message = decode_message(frame.payload)
+            self.queue.append((frame.request_id, message or "empty_message", time.time()))
+            position = len(self.queue) if self.current is None else len(self.queue) + 1
+            self.send(ACK, frame.request_id, str(position - 1).encode("ascii"))
+            logger.info("Request %d queued at position %d: %r", frame.request_id, position - 1, message)
+        elif frame.type == CANCEL:
+            if frame.request_id == self.current:
+                self.token.cancel()
+            else:
+                before = len(self.queue)
+                self.queue = deque(item for item in self.queue if item[0] != frame.request_id)
+                if len(self.queue) == before:
+                    logger.info("Cancel for unknown request %d", frame.request_id)
+                    return
+                self.send(CANCEL, frame.request_id)
+            logger.info("Request %d cancelled by the Acorn", frame.request_id)
+        else:
+            logger.info("Ignored %s frame from the Acorn", FRAME_TYPES[frame.type])
+
+    def fail(self, request_id: int, reply: str) -> None:
+        self.front_end.encoder.start_reply()
+        self.send(ERR, request_id, reply.encode("latin-1", "replace"))
+        self.front_end.writer.finish_reply()
+
+    def answer(self, request_id: int, message: str, received_at: Optional[float] = None) -> None:
+        """Answer one queued request, writing its structured request record."""
+        record = request_log.RequestRecord(message, self.front_end.port, self.front_end.backend.name,
+                                           mode="framed", received_at=received_at)
+        record.note(request_id=request_id)
+        with request_log.active(record):
+            try:
+                self.stream_answer(request_id, message)
+            finally:
+                request_log.write(record)
+
+    def stream_answer(self, request_id: int, message: str) -> None:
+        """Stream one reply as PART frames while a watcher thread queues new requests and handles cancels."""
+        front_end = self.front_end
+        self.current, self.token = request_id, CancelToken()
+        front_end.message_count += 1
+        logger.info("Generating response for request %d (message #%d)", request_id, front_end.message_count)
+        start_time = time.time()
+        request_log.mark("started")
+
+        stream = front_end.backend.generate(message, session_id=front_end.port, cancel=self.token)
+        sent = False
+        try:
+            # New requests and cancels are handled while the reply streams
+            with InputWatcher(self.poll_while_answering):
+                for chunk in stream:
+                    if self.token.cancelled():
+                        break
+                    if not sent:
+                        chunk = chunk.lstrip()
+                        if not chunk:
+                            continue
+                        logger.info("First chunk after %.2f seconds", time.time() - start_time)
+                        request_log.mark("first_chunk")
+                    data = front_end.encoder.encode(chunk)
+                    if data:
+                        self.send(PART, request_id, data)
+                        sent = True
+        except TimeoutError as e:
+            request_log.note(outcome="stalled")
+            front_end.abandon_output(e)
+            # The reply's PART frames are gone; close the request so the Acorn stops waiting on it
+            try:
+                self.fail(request_id, STALLED_REPLY)
+            except TimeoutError:
+                logger.error("Could not send ERR for stalled request %d", request_id)
+            return
+        except BackendError as e:
+            front_end.error_count += 1
+            request_log.note(outcome="error")
+            logger.error("Backend error on request %d (error count: %d): %s", request_id, front_end.error_count, e)
+            self.fail(request_id, str(e))
+            return
+        except Exception as e:
+            front_end.error_count += 1
+            request_log.note(outcome="error")
+            logger.error("Error answering request %d: %s", request_id, e, exc_info=True)
+            self.fail(request_id, EMPTY_REPLY)
+            return
+        finally:
+            stream.close()
+            self.current = None
+
+        request_log.mark("generated")
+        if self.token.cancelled():
+            request_log.note(outcome="cancelled")
+            front_end.encoder.start_reply()
+            self.send(CANCEL, request_id)
+            front_end.writer.finish_reply()
+            logger.info("Request %d stopped after %.2f seconds", request_id, time.time() - start_time)
+            return
+
+        data = front_end.encoder.finish()
+        if data:
+            self.send(PART, request_id, data)
+            sent = True
+        if not sent:
+            front_end.error_count += 1
+            request_log.note(outcome="empty")
+            logger.error("Empty response to request %d (error count: %d)", request_id, front_end.error_count)
+            self.fail(request_id, EMPTY_REPLY)
+            return
+        self.send(END, request_id)
+        front_end.writer.finish_reply()
+        request_log.mark("sent")
+        request_log.note(outcome="ok", text_bytes=front_end.encoder.reply_raw_bytes,
+                         wire_bytes=front_end.encoder.reply_wire_bytes)
+        front_end.encoder.start_reply()
+        logger.info("Request %d answered in %.2f seconds", request_id, time.time() - start_time)
+
+    def poll_while_answering(self) -> None:
+        line = self.poll()
+        if line is not None and self.pending_line is None:
+            # Leave framed mode once the current reply is complete
+            self.pending_line = line
+
+    def run(self) -> str:
+        """Serve frames until the Acorn sends a plain *LINE or *FRAMED line, which is returned."""
+        while not self.front_end.stopping.is_set():
+            line, self.pending_line = self.pending_line or self.poll(), None
+            if line is not None:
+                if self.queue:
+                    logger.info("Leaving framed mode with %d requests queued; dropped", len(self.queue))
+                return line
+            if self.queue:
+                self.answer(*self.queue.popleft())
+            else:
+                time.sleep(0.01)
+        return LINE_COMMAND
+
+
+def fuzz(iterations: int, seed: int) -> bool:
+    """Round-trip random frames through corruption and random chunking."""
+    rng = random.Random(seed)
+    types = list(FRAME_TYPES)
+    sent_total = received_total = corrupted_total = false_accepts = collateral = 0
+
+    for _ in range(iterations):
+        frames = [Frame(rng.choice(types), rng.randrange(256),
+                        bytes(rng.randrange(256) for _ in range(rng.choice([0, 1, 7, 64, rng.randrange(MAX_PAYLOAD + 1)]))))
+                  for _ in range(rng.randint(1, 5))]
+        encoded = [encode_frame(*frame) for frame in frames]
+
+        # Corrupt some frames: flip bits, truncate, or splice in junk. A frame
+        # right after damage can be lost with it, e.g. when a truncated frame's
+        # CRC happens to match using the next frame's magic byte
+        stream = bytearray()
+        intact = []
+        exposed = set()
+        damaged = False
+        for frame, data in zip(frames, encoded):
+            data = bytearray(data)
+            if rng.random() < 0.2:
+                stream += bytes(rng.randrange(256) for _ in range(rng.randrange(1, 20)))
+                damaged = True
+            damage = rng.random()
+            if damage < 0.15:
+                for _ in range(rng.randint(1, 3)):
+                    data[rng.randrange(1, len(data))] ^= 1 << rng.randrange(8)
+            elif damage < 0.25:
+                data = data[:rng.randrange(1, len(data))]
+            else:
+                intact.append(frame)
+                if damaged:
+                    exposed.add(len(intact) - 1)
+            damaged = damage < 0.25
+            corrupted_total += damaged
+            stream += data
+        decoder = FrameDecoder()
+        decoded: List[Frame] = []
+        position = 0
+        while position < len(stream):
+            step = rng.randint(1, 300)
+            decoded.extend(decoder.feed(bytes(stream[position:position + step])))
+            position += step
+        # A truncated frame at the end waits for bytes that never come, as on an idle line
+        decoded.extend(decoder.flush())
+
+        # Intact frames must come out in order; only one right after damage may go missing
+        position = 0
+        for index, frame in enumerate(intact):
+            try:
+                position = decoded.index(frame, position) + 1
+            except ValueError:
+                if index not in exposed:
+                    print(f"[FAIL] Lost intact frame {FRAME_TYPES[frame.type]} id={frame.request_id} "
+                          f"len={len(frame.payload)}")
+                    return False
+                collateral += 1
+        false_accepts += sum(1 for frame in decoded if frame not in frames)
+        sent_total += len(frames)
+        received_total += len(decoded)
+
+    print(f"{iterations} rounds, {sent_total} frames sent, {corrupted_total} corrupted, "
+          f"{received_total} decoded, {collateral} lost next to damage, {false_accepts} corrupt frames accepted")
+    if false_accepts:
+        print("[FAIL] Decoder accepted corrupted frames")
+        return False
+    print("[OK] Encoder and decoder survived fuzzing")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ArmGPT framed serial protocol")
+    parser.add_argument("--fuzz", type=int, metavar="N", help="Fuzz the encoder and decoder for N rounds")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for --fuzz (default: 0)")
+    args = parser.parse_args()
+
+    if args.fuzz:
+        sys.exit(0 if fuzz(args.fuzz, args.seed) else 1)
+    parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,382 +4,63 @@ Serial LLM Interface for Raspberry Pi
 Listens to ttyUSB0 port, processes messages through a local LLM, and responds back
 """
 
-import serial
-import time
-import logging
-import sys
-import json
-from typing import Optional, Dict
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM
-from datetime import datetime
-import os
-import re
+import argparse
 
-# Create logs directory if it doesn't exist
-log_dir = 'logs'
-if not os.path.exists(log_dir):
-    os.makedirs(log_dir)
+from arm_history import add_context_arguments
+from backend_router import add_router_arguments, with_fallback
+from llm_backends import create_backend
+from serial_runtime import add_logging_arguments, serve_ports, setup_logging
+from serial_writer import add_output_arguments
+from transformers_backend import INFERENCE_PROFILES
 
-# Configure logging to both console and file
-log_filename = os.path.join(log_dir, f'serial_llm_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-logger = logging.getLogger(__name__)
-logger.info(f"Logging to file: {log_filename}")
-
-class SerialLLMInterface:
-    def __init__(self, 
-                 port='/dev/ttyUSB0',
-                 baudrate=9600,
-                 model_name='TinyLlama/TinyLlama-1.1B-Chat-v1.0'):
-        """
-        Initialize the Serial LLM Interface
-        
-        Args:
-            port: Serial port to use (default: /dev/ttyUSB0 for Raspberry Pi)
-            baudrate: Baud rate for serial communication
-            model_name: Hugging Face model to use
-        """
-        self.port = port
-        self.baudrate = baudrate
-        self.model_name = model_name
-        self.serial_conn = None
-        self.tokenizer = None
-        self.model = None
-        self.arm_history = self.load_arm_history()
-        self.history_keywords = [
-            'history', 'arm', 'acorn', 'sophie wilson', 'steve furber',
-            'archimedes', 'a310', 'a305', 'a410', 'a440', 'risc', 'origin', 
-            'created', 'founded', 'when was', 'who made', 'tell me about', 
-            'story', 'first risc', 'world first', 'risc os', 'arthur os'
-        ]
-    
-    def load_arm_history(self) -> Dict[str, str]:
-        """Load ARM history document and parse into sections"""
-        history = {}
-        try:
-            history_file = 'ARM_HISTORY.md'
-            if os.path.exists(history_file):
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    
-                # Parse sections
-                sections = re.split(r'^##\s+', content, flags=re.MULTILINE)
-                for section in sections:
-                    if section.strip():
-                        lines = section.strip().split('\n')
-                        if lines:
-                            title = lines[0].strip()
-                            body = '\n'.join(lines[1:]).strip()
-                            history[title] = body
-                            
-                logger.info(f"Loaded ARM history with {len(history)} sections")
-            else:
-                logger.warning("ARM_HISTORY.md not found")
-        except Exception as e:
-            logger.error(f"Error loading ARM history: {e}")
-        return history
-    
-    def get_relevant_history(self, message: str) -> str:
-        """Get relevant ARM history sections based on the user's message"""
-        message_lower = message.lower()
-        relevant_sections = []
-        
-        # Check if the message is about history
-        is_history_query = any(keyword in message_lower for keyword in self.history_keywords)
-        
-        if not is_history_query:
-            return ""
-        
-        # Prioritize sections based on keywords
-        if any(word in message_lower for word in ['archimedes', 'a310', 'a305', 'a410', 'a440', 'first risc', 'world first']):
-            if 'Origins at Acorn Computers (1983-1990)' in self.arm_history:
-                # Find the Archimedes section specifically
-                section = self.arm_history['Origins at Acorn Computers (1983-1990)']
-                archimedes_start = section.find('### The Archimedes Computer: World\'s First RISC Home Computer')
-                if archimedes_start != -1:
-                    relevant_sections.append(section[archimedes_start:archimedes_start+1500])
-                else:
-                    relevant_sections.append(section[:800])
-        
-        if any(word in message_lower for word in ['origin', 'created', 'founded', 'began', 'start']) and 'archimedes' not in message_lower:
-            if 'Origins at Acorn Computers (1983-1990)' in self.arm_history:
-                relevant_sections.append(self.arm_history['Origins at Acorn Computers (1983-1990)'][:800])
-        
-        if any(word in message_lower for word in ['sophie wilson', 'steve furber', 'inventor', 'creator']):
-            if 'Origins at Acorn Computers (1983-1990)' in self.arm_history:
-                relevant_sections.append(self.arm_history['Origins at Acorn Computers (1983-1990)'][:800])
-        
-        if 'connection' in message_lower or 'armgpt' in message_lower:
-            if "ARM's Connection to ArmGPT" in self.arm_history:
-                relevant_sections.append(self.arm_history["ARM's Connection to ArmGPT"])
-        
-        if any(word in message_lower for word in ['business', 'model', 'license', 'licensing']):
-            if 'The ARM Business Model' in self.arm_history:
-                relevant_sections.append(self.arm_history['The ARM Business Model'][:800])
-        
-        if any(word in message_lower for word in ['technical', 'architecture', 'processor']):
-            if 'Technical Evolution' in self.arm_history:
-                relevant_sections.append(self.arm_history['Technical Evolution'][:800])
-        
-        # If no specific sections matched, provide a brief overview
-        if not relevant_sections and is_history_query:
-            overview = "ARM was created at Acorn Computers in 1983 by Sophie Wilson and Steve Furber. "
-            overview += "Originally standing for Acorn RISC Machine, it powered the Acorn Archimedes. "
-            overview += "In 1990, ARM became a separate company. Today, ARM processors are in billions of devices worldwide."
-            relevant_sections.append(overview)
-        
-        return "\n\n".join(relevant_sections) if relevant_sections else ""
-        
-    def init_serial(self):
-        """Initialize serial connection"""
-        try:
-            self.serial_conn = serial.Serial(
-                port=self.port,
-                baudrate=self.baudrate,
-                timeout=0.1,
-                bytesize=serial.EIGHTBITS,
-                parity=serial.PARITY_NONE,
-                stopbits=serial.STOPBITS_ONE
-            )
-            logger.info(f"Serial port {self.port} opened successfully at {self.baudrate} baud")
-            return True
-        except serial.SerialException as e:
-            logger.error(f"Failed to open serial port: {e}")
-            return False
-            
-    def init_llm(self):
-        """Initialize the LLM model"""
-        try:
-            logger.info(f"Loading model: {self.model_name}")
-            logger.info("This may take a few minutes on first run...")
-            
-            # Load tokenizer and model
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-            self.model = AutoModelForCausalLM.from_pretrained(
-                self.model_name,
-                torch_dtype=torch.float16,  # Use half precision for memory efficiency
-                device_map="auto"
-            )
-            
-            logger.info("Model loaded successfully")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to load LLM model: {e}")
-            return False
-    
-    def format_prompt(self, message: str) -> str:
-        """Format the prompt for TinyLlama chat format"""
-        # TinyLlama uses the same format as Llama-2-Chat
-        base_system_message = """You are ArmGPT, a friendly and knowledgeable AI assistant connected to an Acorn computer via serial port. You have a warm, gentle personality and enjoy helping Acorn enthusiasts with their computing needs.
-
-Key traits:
-- Always introduce yourself as ArmGPT when greeting users
-- Be enthusiastic about retro computing and Acorn computers
-- Keep responses as SHORT as possible - aim for 1-2 sentences, maximum 2 short paragraphs only when absolutely necessary
-- Use a conversational, amicable tone
-- Show interest in what the user is working on
-- If asked about yourself, mention you're running on a Raspberry Pi connected to their Acorn
-
-IMPORTANT: Be concise! Serial terminals are limited. Give complete but brief answers.
-
-Remember: You're not generic customer support - you're ArmGPT, a specialized companion for Acorn computer users!"""
-        
-        # Get relevant history if the message is about ARM/history
-        relevant_history = self.get_relevant_history(message)
-        
-        if relevant_history:
-            system_message = base_system_message + f"\n\nRelevant ARM History Information:\n{relevant_history}\n\nUse this information to provide accurate, detailed responses about ARM's history and ArmGPT's connection to it."
-        else:
-            system_message = base_system_message
-        
-        prompt = f"<|system|>\n{system_message}</s>\n<|user|>\n{message}</s>\n<|assistant|>\n"
-        return prompt
-    
-    def generate_response(self, message: str) -> str:
-        """Generate a response using the LLM"""
-        try:
-            # Format the prompt
-            prompt = self.format_prompt(message)
-            
-            # Start timing
-            start_time = time.time()
-            logger.info("Response generation started")
-            
-            # Tokenize
-            inputs = self.tokenizer(prompt, return_tensors="pt")
-            
-            # Generate response with high token limit - let it complete naturally
-            with torch.no_grad():
-                outputs = self.model.generate(
-                    **inputs,
-                    max_new_tokens=500,  # High limit for complete responses
-                    temperature=0.7,
-                    do_sample=True,
-                    top_p=0.95,
-                    pad_token_id=self.tokenizer.eos_token_id
-                )
-            
-            # Calculate and log generation time
-            end_time = time.time()
-            generation_time = end_time - start_time
-            logger.info(f"Response generation completed in {generation_time:.2f} seconds")
-            print(f"⏱️  Generation time: {generation_time:.2f} seconds")
-            
-            # Decode the response
-            response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-            
-            # Extract only the assistant's response
-            response = response.split("<|assistant|>")[-1].strip()
-            
-            return response
-        except Exception as e:
-            # Log error with timing if we got this far
-            if 'start_time' in locals():
-                error_time = time.time() - start_time
-                logger.error(f"Error generating response after {error_time:.2f} seconds: {e}")
-                print(f"❌ Error after {error_time:.2f} seconds: {e}")
-            else:
-                logger.error(f"Error generating response: {e}")
-                print(f"❌ Error: {e}")
-            return "Error: Unable to generate response"
-    
-    def read_serial_message(self) -> Optional[str]:
-        """Read a complete message from serial port"""
-        try:
-            if self.serial_conn.in_waiting > 0:
-                # Read raw bytes first for debugging
-                raw_message = self.serial_conn.readline()
-                logger.info(f"Raw bytes received: {raw_message}")
-                
-                # Decode and clean the message
-                message = raw_message.decode('utf-8', errors='replace').strip()
-                
-                # Always show what we received, even if it appears empty
-                logger.info(f"Decoded message: '{message}' (length: {len(message)})")
-                print(f"\n{'='*60}")
-                print(f"📨 MESSAGE FROM ACORN A310:")
-                print(f"    Raw: {raw_message}")
-                print(f"    Decoded: '{message}' (length: {len(message)})")
-                print(f"{'='*60}")
-                
-                # Return message even if it appears empty (might be whitespace/control chars)
-                if len(raw_message) > 0:
-                    return message if message else " "  # Return space if message is empty string
-                    
-        except Exception as e:
-            logger.error(f"Error reading serial: {e}")
-            print(f"❌ Serial read error: {e}")
-        return None
-    
-    def send_serial_response(self, response: str):
-        """Send response back through serial port"""
-        try:
-            # Add newline for proper message termination
-            response_bytes = (response + '\n').encode('utf-8')
-            self.serial_conn.write(response_bytes)
-            self.serial_conn.flush()
-            logger.info(f"Sent: {response}")
-            # Display response prominently on screen
-            print(f"\n🤖 ARMGPT RESPONSE TO ACORN:")
-            print(f"    {response}")
-            print(f"{'─'*60}\n")
-        except Exception as e:
-            logger.error(f"Error sending response: {e}")
-            print(f"❌ Serial send error: {e}")
-    
-    def run(self):
-        """Main loop for the serial LLM interface"""
-        # Log startup information
-        logger.info("="*60)
-        logger.info("Starting Serial LLM Interface (Full Version)")
-        logger.info(f"Port: {self.port}")
-        logger.info(f"Baudrate: {self.baudrate}")
-        logger.info(f"Model: {self.model_name}")
-        logger.info("="*60)
-        
-        # Initialize components
-        if not self.init_serial():
-            logger.error("Failed to initialize serial port")
-            return
-        
-        if not self.init_llm():
-            logger.error("Failed to initialize LLM")
-            return
-        
-        logger.info("Serial LLM Interface ready. Listening for messages...")
-        logger.info(f"Press Ctrl+C to exit")
-        
-        # Display prominent startup message on screen
-        print(f"\n🚀 ArmGPT is ready and listening for your Acorn A310!")
-        print(f"📡 Serial port: {self.port} at {self.baudrate} baud")
-        print(f"🧠 Model: {self.model_name}")
-        print(f"💾 Logs: {log_filename}")
-        print(f"\n{'='*60}")
-        print(f"  Waiting for messages from Acorn Archimedes A310...")
-        print(f"{'='*60}\n")
-        
-        message_count = 0
-        error_count = 0
-        
-        try:
-            while True:
-                # Read message from serial
-                message = self.read_serial_message()
-                
-                if message:
-                    message_count += 1
-                    logger.info(f"Message #{message_count}")
-                    
-                    # Generate response
-                    logger.info("Generating response...")
-                    response = self.generate_response(message)
-                    
-                    if response.startswith("Error:"):
-                        error_count += 1
-                        logger.error(f"Error count: {error_count}")
-                    
-                    # Send response back
-                    self.send_serial_response(response)
-                
-                # Small delay to prevent CPU overuse
-                time.sleep(0.01)
-                
-        except KeyboardInterrupt:
-            logger.info("Shutting down...")
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}", exc_info=True)
-            error_count += 1
-        finally:
-            # Log session summary
-            logger.info("="*60)
-            logger.info("Session Summary")
-            logger.info(f"Total messages processed: {message_count}")
-            logger.info(f"Total errors: {error_count}")
-            logger.info(f"Log file: {log_filename}")
-            logger.info("="*60)
-            
-            if self.serial_conn and self.serial_conn.is_open:
-                self.serial_conn.close()
-                logger.info("Serial port closed")
 
 def main():
     """Main entry point"""
-    # You can customize these parameters
-    interface = SerialLLMInterface(
-        port='/dev/ttyUSB0',  # Default Raspberry Pi serial port
-        baudrate=9600,        # Match Acorn A310 baud rate
-        model_name='TinyLlama/TinyLlama-1.1B-Chat-v1.0'  # Optimized for RPi
+    parser = argparse.ArgumentParser(description='Serial LLM Interface (Transformers)')
+    parser.add_argument('--port', nargs='+', default=['/dev/ttyUSB0'],
+                        help='Serial port; give several to serve more than one Acorn')
+    parser.add_argument('--baudrate', type=int, default=9600, help='Baud rate')
+    parser.add_argument('--model', default='TinyLlama/TinyLlama-1.1B-Chat-v1.0',
+                        help='Hugging Face model to use')
+    parser.add_argument('--profile', choices=INFERENCE_PROFILES, default='auto',
+                        help="Inference profile (default: auto = gpu-fp16 with CUDA, else cpu-int8)")
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Intra-op CPU threads (default: all host cores)')
+    parser.add_argument('--interop-threads', type=int, default=1,
+                        help='Inter-op CPU threads (default: 1)')
+    parser.add_argument('--compile', action='store_true',
+                        help='Compile the model forward pass with torch.compile')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Sessions decoded together by continuous batching (default: 1, off)')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Print tokens/sec for each inference profile before starting')
+    
+    add_context_arguments(parser, context_tokens=512)
+    add_output_arguments(parser)
+    add_logging_arguments(parser)
+    add_router_arguments(parser)
+    args = parser.parse_args()
+    setup_logging(debug=args.debug, max_mb=args.log_max_mb)
+    
+    backend = create_backend(
+        "transformers",
+        model_name=args.model,
+        profile=args.profile,
+        num_threads=args.threads,
+        interop_threads=args.interop_threads,
+        compile_model=args.compile,
+        batch_size=args.batch_size,
+        index_path=args.index,
+        ollama_url=args.ollama_url,
+        context_tokens=args.context_tokens
     )
     
-    interface.run()
+    if args.benchmark:
+        backend.benchmark_profiles()
+    
+    serve_ports(with_fallback(backend, args), args.port, args.baudrate, title="ArmGPT (Transformers)",
+                flow_control=args.flow_control, chunk_size=args.chunk_size,
+                max_baudrate=args.max_baudrate, wire_mode=args.wire_mode)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
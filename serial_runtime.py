@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+"""
+Shared serial front-end for every ArmGPT backend.
+
+Opens the serial port, reads one message per line from the Acorn, streams
+it through an inference backend and writes the reply back. Startup
+buffering, logging and the session summary are implemented here once;
+the entry-point scripts only parse arguments and pick a backend.
+"""
+
+import argparse
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, List, Optional
+
+import request_log
+from llm_backends import Backend, BackendError, CancelToken
+from serial_writer import SerialWriter
+from startup import STARTUP_FAILED_REPLY, WARMING_UP_REPLY, MessageBuffer, StartupTasks
+from wire_compression import WIRE_COMMAND, WIRE_MODES, WireEncoder
+
+logger = logging.getLogger(__name__)
+log_filename = ""
+log_listener: Optional[logging.handlers.QueueListener] = None
+exit_hook_registered = False
+
+LOG_MAX_MB = 10.0
+LOG_BACKUPS = 5
+
+# Serial port mappings
+SERIAL_PORTS = {
+    "usb": "/dev/ttyUSB0",
+    "serial": "/dev/serial0",
+}
+
+LINKTUNE_COMMAND = "*LINKTUNE"
+FRAMED_COMMAND = "*FRAMED"
+
+EMPTY_REPLY = "Sorry, I couldn't generate a response right now. Please try again!"
+STOPPED_REPLY = "[Stopped]"
+STALLED_REPLY = "Output stalled; the reply was dropped."
+
+# Ctrl-C and ESC from the Acorn, or a line saying "stop", cancel the reply in progress
+CANCEL_BYTES = b"\x03\x1b"
+CANCEL_LINES = {"stop", "*stop"}
+
+
+def setup_logging(prefix: str = "serial_llm", debug: bool = False, max_mb: float = LOG_MAX_MB,
+                  console: bool = True) -> str:
+    """Log to a timestamped file in logs/, and the console unless told not to, returning its path.
+
+    Records are put on a queue and written by a background listener
+    thread, so a slow SD card never stalls the serial loop. The file
+    rotates at max_mb, keeping LOG_BACKUPS old files.
+    """
+    global log_filename, log_listener, exit_hook_registered
+
+    log_dir = "logs"
+    if not os.path.exists(log_dir):
+        os.makedirs(log_dir)
+
+    log_filename = os.path.join(log_dir, f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_filename, maxBytes=int(max_mb * 1024 * 1024), backupCount=LOG_BACKUPS)
+    file_handler.setFormatter(formatter)
+    handlers: List[logging.Handler] = [file_handler]
+    if console:
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(formatter)
+        handlers.append(stream_handler)
+
+    stop_logging()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+    log_listener.start()
+    if not exit_hook_registered:
+        atexit.register(stop_logging)
+        exit_hook_registered = True
+
+    root_logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.info("Logging to file: %s", log_filename)
+
+    request_log.open_request_log(os.path.splitext(log_filename)[0] + ".requests.jsonl",
+                                 int(max_mb * 1024 * 1024), LOG_BACKUPS)
+    return log_filename
+
+
+def stop_logging() -> None:
+    """Write out whatever is still queued, stop the listener threads and close the log files."""
+    global log_listener
+    request_log.close_request_log()
+    if log_listener:
+        log_listener.stop()
+        for handler in log_listener.handlers:
+            handler.close()
+        log_listener = None
+
+
+def add_logging_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the logging options shared by the entry points."""
+    parser.add_argument("--debug", action="store_true",
+                        help="Also log the raw bytes of every message from the Acorn")
+    parser.add_argument("--log-max-mb", type=float, default=LOG_MAX_MB,
+                        help=f"Size at which the log file rotates, keeping {LOG_BACKUPS} old files "
+                             f"(default: {LOG_MAX_MB:g})")
+
+
+def init_serial(port: str, baudrate: int, timeout: float = 2.0,
+                flow_control: str = "none") -> Optional[Any]:
+    """Open the serial port at 8N1 with the given flow control, or return None."""
+    try:
+        import serial
+
+        conn = serial.Serial()
+        conn.port = port
+        conn.baudrate = baudrate
+        conn.bytesize = serial.EIGHTBITS
+        conn.parity = serial.PARITY_NONE
+        conn.stopbits = serial.STOPBITS_ONE
+        conn.timeout = timeout
+        conn.xonxoff = flow_control == "xonxoff"
+        conn.rtscts = flow_control == "rtscts"
+        conn.dsrdtr = False
+
+        conn.open()
+        time.sleep(0.1)
+        conn.reset_input_buffer()
+        conn.reset_output_buffer()
+        time.sleep(0.1)
+
+        logger.info("Serial port %s opened successfully at %d baud (flow control: %s)",
+                    port, baudrate, flow_control)
+        logger.info("DTR: %s, RTS: %s", conn.dtr, conn.rts)
+        return conn
+    except ImportError:
+        logger.error("pyserial is not installed. Install it with: pip install -r requirements-lite.txt")
+        return None
+    except Exception as e:
+        logger.error("Failed to open serial port: %s", e)
+        return None
+
+
+def decode_message(raw_message: bytes) -> str:
+    """Decode a line from the Acorn: UTF-8 when valid, otherwise Latin-1 (the RISC OS character set)."""
+    try:
+        return raw_message.decode("utf-8").strip()
+    except UnicodeDecodeError:
+        return raw_message.decode("latin-1").strip()
+
+
+def start_backend(backend: Backend) -> StartupTasks:
+    """Start the backend's startup tasks in the background."""
+    startup = StartupTasks()
+    for name, task in backend.startup_tasks():
+        startup.add(name, task)
+    startup.start()
+    return startup
+
+
+def serve_ports(backend: Backend, ports: List[str], baudrate: int = 9600, **options) -> None:
+    """Serve several Acorns from one backend, with a front-end thread per serial port."""
+    if len(ports) == 1:
+        SerialFrontEnd(backend, ports[0], baudrate, **options).run()
+        return
+
+    startup = start_backend(backend)
+    front_ends = [SerialFrontEnd(backend, port, baudrate, **options) for port in ports]
+    threads = [threading.Thread(target=front_end.run, args=(startup,), name=f"serial-{port}", daemon=True)
+               for front_end, port in zip(front_ends, ports)]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        logger.info("Shutting down %d serial ports...", len(ports))
+        for front_end in front_ends:
+            front_end.stop()
+        for thread in threads:
+            thread.join()
+    finally:
+        backend.close()
+
+
+class InputWatcher:
+    """Calls poll() on a background thread while a reply is being generated."""
+
+    def __init__(self, poll: Callable[[], None], interval: float = 0.02):
+        self.poll = poll
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.loop, name="input-watcher", daemon=True)
+
+    def loop(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error("Error watching serial input: %s", e)
+
+    def __enter__(self) -> "InputWatcher":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop_event.set()
+        self.thread.join()
+
+
+class SerialFrontEnd:
+    """One serial session: line-framed messages in, streamed backend replies out."""
+
+    def __init__(self, backend: Backend, port: str, baudrate: int = 9600, title: str = "ArmGPT",
+                 flow_control: str = "none", chunk_size: int = 64, max_baudrate: int = 115200,
+                 wire_mode: str = "plain"):
+        self.backend = backend
+        self.port = port
+        self.baudrate = baudrate
+        self.title = title
+        self.flow_control = flow_control
+        self.chunk_size = chunk_size
+        self.max_baudrate = max_baudrate
+        self.encoder = WireEncoder(wire_mode)
+        self.conn: Optional[Any] = None
+        self.writer: Optional[SerialWriter] = None
+        self.message_count = 0
+        self.error_count = 0
+        self.stopping = threading.Event()
+
+    def read_serial_message(self) -> Optional[str]:
+        """Read one line from the serial port, or None when nothing complete is waiting."""
+        try:
+            if self.conn.in_waiting <= 0:
+                return None
+
+            raw_message = self.conn.readline()
+            if not raw_message:
+                return None
+
+            message = decode_message(raw_message)
+            logger.debug("Received raw bytes: %s", raw_message)
+            logger.info("Decoded message: %r", message)
+
+            return message if message else "empty_message"
+        except Exception as e:
+            logger.error("Error reading serial: %s", e)
+            return None
+
+    def discard_input(self, reason: str) -> None:
+        """Drop bytes that arrived while the Acorn was waiting on a reply."""
+        try:
+            if self.conn.in_waiting > 0:
+                discarded = self.conn.read(self.conn.in_waiting)
+                logger.info("Ignored message %s: %s", reason, discarded)
+        except Exception as e:
+            logger.error("Error discarding serial input: %s", e)
+
+    def watch_for_cancel(self, token: CancelToken) -> Callable[[], None]:
+        """A poll function that cancels `token` on Ctrl-C, ESC or a "stop" line from the Acorn."""
+        line = bytearray()
+
+        def poll() -> None:
+            if token.cancelled() or self.conn.in_waiting <= 0:
+                return
+            data = self.conn.read(self.conn.in_waiting)
+            if any(byte in CANCEL_BYTES for byte in data):
+                logger.info("Cancel byte received: %s", data)
+                token.cancel()
+                return
+            for byte in data:
+                if byte not in b"\r\n":
+                    line.append(byte)
+                    continue
+                text = decode_message(bytes(line))
+                line.clear()
+                if text.lower() in CANCEL_LINES:
+                    logger.info("Stop requested by the Acorn")
+                    token.cancel()
+                    return
+                if text:
+                    logger.info("Ignored message while processing: %r", text)
+
+        return poll
+
+    def write_text(self, text: str) -> None:
+        data = self.encoder.encode(text)
+        if data:
+            self.writer.write(data)
+
+    def end_reply(self) -> None:
+        """Send any text the encoder held back, drain it and log the bytes saved."""
+        data = self.encoder.finish()
+        if data:
+            self.writer.write(data)
+        self.writer.finish_reply()
+        request_log.note(text_bytes=self.encoder.reply_raw_bytes, wire_bytes=self.encoder.reply_wire_bytes)
+        if self.encoder.mode != "plain" and self.encoder.reply_raw_bytes:
+            logger.info("Wire %s: %d bytes of text sent as %d bytes",
+                        self.encoder.mode, self.encoder.reply_raw_bytes, self.encoder.reply_wire_bytes)
+        self.encoder.start_reply()
+
+    def abandon_output(self, error: Exception) -> None:
+        """Give up on a reply the Acorn has stopped accepting."""
+        self.error_count += 1
+        logger.error("Output stalled, reply dropped (error count: %d): %s", self.error_count, error)
+        try:
+            self.conn.reset_output_buffer()
+            self.encoder.start_reply()
+            self.writer.finish_reply()
+        except Exception as e:
+            logger.error("Error resetting output buffer: %s", e)
+
+    def send_serial_response(self, response: str) -> None:
+        """Send a complete one-shot reply (status and error messages)."""
+        try:
+            self.write_text(response + "\n")
+            self.end_reply()
+            request_log.mark("sent")
+            logger.info("Response sent: %s", response)
+        except Exception as e:
+            logger.error("Error sending response: %s", e)
+
+    def tune_link(self) -> None:
+        """Answer *LINKTUNE from the Acorn: step up to the fastest reliable baud rate."""
+        # Imported here: link_tune builds on this module's init_serial
+        from link_tune import LinkTuner
+
+        logger.info("Link tuning requested at %d baud", self.baudrate)
+        tuner = LinkTuner(self.conn, max_rate=self.max_baudrate)
+        self.baudrate = tuner.run()
+        self.writer.set_baudrate(self.baudrate)
+        for line in tuner.report().splitlines():
+            logger.info("Link tuning: %s", line)
+        logger.info("Link tuned to %d baud", self.baudrate)
+
+    def run_framed(self) -> None:
+        """Answer *FRAMED: serve pipelined framed requests until the Acorn sends *LINE."""
+        # Imported here: serial_framing builds on this module's decode_message
+        from serial_framing import FramedSession
+
+        while True:
+            self.send_serial_response("FRAMED")
+            logger.info("Framed mode started")
+            line = FramedSession(self).run()
+            if line != FRAMED_COMMAND:
+                break
+            # The Acorn program restarted; start a fresh session
+        self.send_serial_response("LINE")
+        logger.info("Back to line mode")
+
+    def set_wire_mode(self, message: str) -> None:
+        """Answer *WIRE <mode>: switch this session's reply encoding."""
+        words = message.split()
+        mode = words[1].lower() if len(words) > 1 else ""
+        if mode not in WIRE_MODES:
+            self.send_serial_response("WIRE " + " ".join(WIRE_MODES))
+            return
+
+        # The acknowledgement is plain ASCII, the same bytes in every mode
+        self.send_serial_response(f"WIRE {mode}")
+        totals = (self.encoder.raw_bytes, self.encoder.wire_bytes)
+        self.encoder = WireEncoder(mode)
+        self.encoder.raw_bytes, self.encoder.wire_bytes = totals
+        logger.info("Wire mode set to %s", mode)
+
+    def handle_message(self, message: str, received_at: Optional[float] = None) -> None:
+        """Answer one message, writing its structured request record."""
+        record = request_log.RequestRecord(message, self.port, self.backend.name, received_at=received_at)
+        with request_log.active(record):
+            try:
+                self.stream_reply(message)
+            finally:
+                request_log.write(record)
+
+    def stream_reply(self, message: str) -> None:
+        """Stream the backend's reply to the Acorn as it is generated."""
+        self.message_count += 1
+        logger.info("Generating response for message #%d", self.message_count)
+        start_time = time.time()
+        request_log.mark("started")
+
+        parts = []
+        token = CancelToken()
+        try:
+            with InputWatcher(self.watch_for_cancel(token)):
+                for chunk in self.backend.generate(message, session_id=self.port, cancel=token):
+                    if token.cancelled():
+                        break
+                    if not parts:
+                        chunk = chunk.lstrip()
+                        if not chunk:
+                            continue
+                        logger.info("First chunk after %.2f seconds", time.time() - start_time)
+                        request_log.mark("first_chunk")
+                    parts.append(chunk)
+                    self.write_text(chunk)
+        except TimeoutError as e:
+            request_log.note(outcome="stalled")
+            self.abandon_output(e)
+            return
+        except BackendError as e:
+            self.error_count += 1
+            request_log.note(outcome="error")
+            logger.error("Backend error (error count: %d): %s", self.error_count, e)
+            if parts:
+                self.write_text("\n")
+            self.send_serial_response(str(e))
+            return
+        except Exception as e:
+            self.error_count += 1
+            request_log.note(outcome="error")
+            logger.error("Error generating response: %s", e, exc_info=True)
+            if parts:
+                self.write_text("\n")
+            self.send_serial_response(EMPTY_REPLY)
+            return
+
+        generation_time = time.time() - start_time
+        request_log.mark("generated")
+        if token.cancelled():
+            request_log.note(outcome="cancelled")
+            logger.info("Response cancelled after %.2f seconds", generation_time)
+            if parts:
+                self.write_text("\n")
+            self.send_serial_response(STOPPED_REPLY)
+            return
+
+        logger.info("Response generation completed in %.2f seconds", generation_time)
+
+        response = "".join(parts).strip()
+        if not response:
+            self.error_count += 1
+            request_log.note(outcome="empty")
+            logger.error("Empty response (error count: %d)", self.error_count)
+            self.send_serial_response(EMPTY_REPLY)
+            return
+
+        try:
+            self.write_text("\n")
+            self.end_reply()
+            request_log.mark("sent")
+            request_log.note(outcome="ok")
+            logger.info("Response sent: %s", response)
+        except Exception as e:
+            request_log.note(outcome="send_failed")
+            logger.error("Error sending response: %s", e)
+
+    def print_banner(self, startup: StartupTasks) -> None:
+        print(f"\n{self.title} is ready and listening!")
+        print(f"Serial port: {self.port} at {self.baudrate} baud (flow control: {self.flow_control})")
+        for label, value in self.backend.describe():
+            print(f"{label}: {value}")
+        print(f"Time to ready: {startup.time_to_ready():.2f} seconds")
+        print(f"Logs: {log_filename}")
+        print("\n" + "=" * 60)
+        print("  Waiting for messages from Acorn Archimedes A310...")
+        print("=" * 60 + "\n")
+
+    def stop(self) -> None:
+        """Ask run() to finish after the current message, e.g. from serve_ports()."""
+        self.stopping.set()
+
+    def run(self, startup: Optional[StartupTasks] = None) -> None:
+        """Main loop: start the backend, open the port, answer messages until Ctrl+C.
+
+        With `startup` given, the backend is shared: its startup tasks were
+        started by the caller, who also closes it.
+        """
+        owns_backend = startup is None
+        logger.info("=" * 60)
+        logger.info("Starting %s (%s backend)", self.title, self.backend.name)
+        logger.info("Port: %s", self.port)
+        logger.info("Baudrate: %d", self.baudrate)
+        for label, value in self.backend.describe():
+            logger.info("%s: %s", label, value)
+        logger.info("=" * 60)
+
+        # Load models and indexes in the background while the serial port is
+        # opened, so a bad port fails immediately and early messages are kept
+        if owns_backend:
+            startup = start_backend(self.backend)
+
+        self.conn = init_serial(self.port, self.baudrate, flow_control=self.flow_control)
+        if self.conn is None:
+            logger.error("Failed to initialize serial port")
+            if owns_backend:
+                self.backend.close()
+            return
+        self.writer = SerialWriter(self.conn, self.baudrate, self.chunk_size, self.flow_control)
+
+        logger.info("Serial port open; waiting for the %s backend...", self.backend.name)
+        buffer = MessageBuffer()
+        ready = False
+
+        try:
+            while not self.stopping.is_set():
+                if not ready and startup.is_done():
+                    if not startup.ok():
+                        logger.error("Startup failed: %s", ", ".join(startup.failed()))
+                        if buffer:
+                            self.send_serial_response(STARTUP_FAILED_REPLY)
+                        break
+
+                    ready = True
+                    logger.info("%s ready in %.2f seconds (%s). Listening for messages...",
+                                self.title, startup.time_to_ready(), startup.summary())
+                    self.print_banner(startup)
+
+                # Answer anything buffered during startup before reading more
+                received_at = None
+                if ready and buffer:
+                    message = buffer.pop()
+                else:
+                    message = self.read_serial_message()
+                    received_at = time.time()
+
+                if message == LINKTUNE_COMMAND:
+                    self.tune_link()
+                    message = None
+                elif message == FRAMED_COMMAND:
+                    if ready:
+                        self.run_framed()
+                    else:
+                        self.send_serial_response(WARMING_UP_REPLY)
+                    message = None
+                elif message and message.split()[0].upper() == WIRE_COMMAND:
+                    self.set_wire_mode(message)
+                    message = None
+
+                if message and not ready:
+                    buffer.add(message)
+                    self.send_serial_response(WARMING_UP_REPLY)
+                    message = None
+
+                if message:
+                    self.handle_message(message, received_at)
+                    if not buffer:
+                        self.discard_input("while processing")
+
+                # Small delay to prevent CPU overuse
+                time.sleep(0.01)
+        except KeyboardInterrupt:
+            logger.info("Shutting down...")
+        except Exception as e:
+            logger.error("Unexpected error: %s", e, exc_info=True)
+            self.error_count += 1
+        finally:
+            logger.info("=" * 60)
+            logger.info("Session Summary")
+            logger.info("Total messages processed: %d", self.message_count)
+            logger.info("Total errors: %d", self.error_count)
+            logger.info("Serial output: %s", self.writer.summary())
+            logger.info("Wire encoding: %s", self.encoder.summary())
+            logger.info("Log file: %s", log_filename)
+            logger.info("=" * 60)
+
+            if owns_backend:
+                self.backend.close()
+            if self.conn and self.conn.is_open:
+                self.conn.close()
+                logger.info("Serial port closed")
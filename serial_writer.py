@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Paced, flow-controlled output to the Acorn.
+
+A busy Archimedes can drop bytes if a long reply arrives in one burst.
+SerialWriter splits output into chunks and never lets more than about one
+chunk get ahead of the line rate of baudrate / 10 bytes per second (8N1).
+When pyserial can report the output queue, writing also waits for the
+queue to drain, which covers an Acorn holding the line with XOFF or CTS.
+Throughput per reply is measured so higher baudrates can be checked
+against the rate the line should manage.
+"""
+
+import argparse
+import logging
+import time
+from typing import Any, Optional
+
+from wire_compression import WIRE_MODES
+
+logger = logging.getLogger(__name__)
+
+FLOW_CONTROL = ["none", "xonxoff", "rtscts"]
+
+# Bits on the wire per byte at 8N1: start + 8 data + stop
+BITS_PER_BYTE = 10
+
+# Longest wait for XON / CTS before the rest of a reply is dropped
+STALL_TIMEOUT = 30.0
+
+
+class SerialWriter:
+    """Chunked writer paced to the serial line rate, with per-reply throughput stats."""
+
+    def __init__(self, conn: Any, baudrate: int, chunk_size: int = 64,
+                 flow_control: str = "none", stall_timeout: float = STALL_TIMEOUT):
+        """
+        Args:
+            conn: Open pyserial connection
+            baudrate: Line rate, used for pacing and the theoretical throughput
+            chunk_size: Bytes per write; at most about one chunk is queued ahead of the line
+            flow_control: One of FLOW_CONTROL; must match how the port was opened
+            stall_timeout: Seconds to wait for XON or CTS before giving up on a reply
+        """
+        self.conn = conn
+        self.chunk_size = max(1, chunk_size)
+        self.flow_control = flow_control
+        self.stall_timeout = stall_timeout
+        self.bytes_per_second = baudrate / BITS_PER_BYTE
+        self.next_write = 0.0
+        self.can_measure_queue = True
+
+        self.reply_bytes = 0
+        self.reply_busy = 0.0  # Seconds the line spent sending this reply
+        self.reply_start: Optional[float] = None
+        self.last_write_end: Optional[float] = None
+        self.pending_after_write = 0.0
+        self.total_bytes = 0
+        self.total_seconds = 0.0
+        self.stalls = 0
+
+    def set_baudrate(self, baudrate: int) -> None:
+        """Follow a rate change, e.g. after link tuning."""
+        self.bytes_per_second = baudrate / BITS_PER_BYTE
+
+    def queued_bytes(self) -> Optional[int]:
+        """Bytes still waiting in the OS output queue, or None when the port can't say."""
+        if not self.can_measure_queue:
+            return None
+        try:
+            return self.conn.out_waiting
+        except Exception:
+            self.can_measure_queue = False
+            logger.info("Output queue size not available on this port; pacing by baudrate")
+            return None
+
+    def wait_for_line(self) -> None:
+        """Block until the line can take another chunk."""
+        deadline = time.time() + self.stall_timeout
+        stalled = False
+
+        if self.flow_control == "rtscts":
+            while not self.conn.cts:
+                stalled = True
+                if time.time() > deadline:
+                    raise TimeoutError("CTS held low for %.0f seconds" % self.stall_timeout)
+                time.sleep(0.01)
+
+        queued = self.queued_bytes()
+        if queued is not None:
+            # The kernel holds output during XOFF or CTS low, so the queue stops draining
+            while queued > self.chunk_size:
+                if queued > 2 * self.chunk_size:
+                    stalled = True
+                if time.time() > deadline:
+                    raise TimeoutError("Output stalled for %.0f seconds" % self.stall_timeout)
+                time.sleep(min(0.05, self.chunk_size / self.bytes_per_second))
+                queued = self.queued_bytes() or 0
+
+        # USB adapters and ptys accept bytes faster than the line sends them, so
+        # never run ahead of the line rate by more than about one chunk
+        delay = self.next_write - self.chunk_size / self.bytes_per_second - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        if stalled:
+            self.stalls += 1
+
+    def pending_seconds(self) -> float:
+        """Time the line still needs to send what has been written."""
+        scheduled = max(0.0, self.next_write - time.time())
+        queued = self.queued_bytes()
+        if queued is None:
+            return scheduled
+        return max(scheduled, queued / self.bytes_per_second)
+
+    def account_idle(self, now: float) -> None:
+        # Between writes the line only counts as busy while it drains what was queued;
+        # the rest of the gap is the backend generating, not the line
+        if self.last_write_end is not None:
+            self.reply_busy += min(now - self.last_write_end, self.pending_after_write)
+
+    def write(self, data: bytes) -> None:
+        start = time.time()
+        if self.reply_start is None:
+            self.reply_start = start
+            self.next_write = start
+        self.account_idle(start)
+
+        for offset in range(0, len(data), self.chunk_size):
+            chunk = data[offset:offset + self.chunk_size]
+            self.wait_for_line()
+            self.conn.write(chunk)
+            # When the line will have finished sending everything written so far
+            self.next_write = max(self.next_write, time.time()) + len(chunk) / self.bytes_per_second
+            self.reply_bytes += len(chunk)
+
+        self.last_write_end = time.time()
+        self.reply_busy += self.last_write_end - start
+        self.pending_after_write = self.pending_seconds()
+
+    def finish_reply(self) -> None:
+        """Drain the reply to the wire and log its effective throughput."""
+        start = time.time()
+        self.conn.flush()
+        if self.reply_start is None:
+            return
+
+        self.account_idle(start)
+        self.reply_busy += time.time() - start
+        self.total_bytes += self.reply_bytes
+        self.total_seconds += self.reply_busy
+        if self.reply_busy > 0:
+            rate = self.reply_bytes / self.reply_busy
+            logger.info("Sent %d bytes in %.2f seconds of line time: %.0f bytes/s "
+                        "(%.0f%% of %.0f bytes/s line rate)",
+                        self.reply_bytes, self.reply_busy, rate,
+                        100.0 * rate / self.bytes_per_second, self.bytes_per_second)
+        self.reply_bytes = 0
+        self.reply_busy = 0.0
+        self.reply_start = None
+        self.last_write_end = None
+        self.pending_after_write = 0.0
+
+    def summary(self) -> str:
+        if not self.total_seconds:
+            return "no output"
+        rate = self.total_bytes / self.total_seconds
+        return "%d bytes at %.0f bytes/s (%.0f%% of line rate), %d flow-control stalls" % (
+            self.total_bytes, rate, 100.0 * rate / self.bytes_per_second, self.stalls)
+
+
+def add_output_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the serial output options shared by the entry points."""
+    parser.add_argument("--flow-control", choices=FLOW_CONTROL, default="none",
+                        help="Serial flow control, matching the Acorn's *FX settings (default: none)")
+    parser.add_argument("--chunk-size", type=int, default=64,
+                        help="Bytes per paced serial write (default: 64)")
+    parser.add_argument("--wire-mode", choices=WIRE_MODES, default="plain",
+                        help="Reply encoding until the Acorn sends *WIRE (default: plain)")
+    parser.add_argument("--max-baudrate", type=int, default=115200,
+                        help="Highest rate *LINKTUNE from the Acorn may negotiate (default: 115200)")
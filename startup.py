@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Concurrent startup for the ArmGPT entry points.
+
+Model loading, warm-up and index loading run on background threads while
+the serial port is opened, so the Acorn is acknowledged as soon as the
+port is up. Messages that arrive before the backend is ready are buffered
+and answered in arrival order once it is.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+WARMING_UP_REPLY = "ArmGPT is warming up. Your message is queued and will be answered shortly."
+STARTUP_FAILED_REPLY = "Sorry, ArmGPT could not start. Please check the server."
+
+# Messages buffered during startup; the oldest is dropped beyond this
+MAX_BUFFERED_MESSAGES = 8
+
+
+class StartupTasks:
+    """Named startup tasks run concurrently, each returning True on success."""
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.ready_time: Optional[float] = None
+        self.tasks: Dict[str, Callable[[], bool]] = {}
+        self.results: Dict[str, bool] = {}
+        self.timings: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def add(self, name: str, task: Callable[[], bool]) -> None:
+        self.tasks[name] = task
+
+    def start(self) -> None:
+        if not self.tasks:
+            self.ready_time = time.time()
+            self.done.set()
+            return
+        for name, task in self.tasks.items():
+            thread = threading.Thread(target=self.run_task, args=(name, task),
+                                      name=f"startup-{name}", daemon=True)
+            thread.start()
+
+    def run_task(self, name: str, task: Callable[[], bool]) -> None:
+        start = time.time()
+        try:
+            ok = bool(task())
+        except Exception as e:
+            logger.error("Startup task %s failed: %s", name, e, exc_info=True)
+            ok = False
+
+        with self.lock:
+            self.results[name] = ok
+            self.timings[name] = time.time() - start
+            logger.info("Startup task %s %s in %.2f seconds",
+                        name, "finished" if ok else "FAILED", self.timings[name])
+            if len(self.results) == len(self.tasks):
+                self.ready_time = time.time()
+                self.done.set()
+
+    def is_done(self) -> bool:
+        return self.done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
+
+    def ok(self) -> bool:
+        return self.is_done() and all(self.results.values())
+
+    def failed(self) -> List[str]:
+        return [name for name, ok in self.results.items() if not ok]
+
+    def time_to_ready(self) -> float:
+        end = self.ready_time if self.ready_time is not None else time.time()
+        return end - self.start_time
+
+    def summary(self) -> str:
+        return ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.timings.items())
+
+
+class MessageBuffer:
+    """Messages received before the backend is ready, replayed in arrival order."""
+
+    def __init__(self, max_messages: int = MAX_BUFFERED_MESSAGES):
+        self.messages: Deque[str] = deque()
+        self.max_messages = max_messages
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add(self, message: str) -> None:
+        if len(self.messages) >= self.max_messages:
+            dropped = self.messages.popleft()
+            logger.warning("Startup buffer full, dropped oldest message: %r", dropped)
+        self.messages.append(message)
+        logger.info("Buffered message during startup (%d waiting)", len(self.messages))
+
+    def pop(self) -> Optional[str]:
+        return self.messages.popleft() if self.messages else None
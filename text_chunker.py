@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Sentence- and section-aware chunking with token counts.
+
+Documents are split into sections at markdown headings ("## Origins at
+Acorn Computers"), sections into sentences and list items, and the
+sentences packed into chunks of about TARGET_TOKENS tokens. A chunk
+never crosses a heading and never cuts a sentence, unless one sentence
+alone is over budget. Consecutive chunks share their last sentences
+(up to OVERLAP_TOKENS) so a fact that straddles a boundary is kept
+whole in one of them. Each chunk starts with its heading and carries
+its token count, which build_index.py stores in the index so prompt
+packing never has to tokenize at query time.
+
+Token counts approximate a BPE tokenizer: punctuation and digits are a
+token each, and letter runs a token per four characters. Counts are
+cached per word, since documents reuse a small vocabulary.
+
+    python text_chunker.py ARM_HISTORY.md    # show the chunks of a document
+"""
+
+import argparse
+import re
+from functools import lru_cache
+from typing import Iterator, List, Tuple
+
+TARGET_TOKENS = 256
+OVERLAP_TOKENS = 48
+
+HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+LIST_ITEM = re.compile(r"^([-*+•]|\d{1,3}[.)])\s+")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])[\"”’)\]]*\s+(?=[\"“‘(\[]?[A-Z0-9])")
+LAST_WORD = re.compile(r"(\S+)$")
+TOKEN_PIECE = re.compile(r"[^\W\d_]+|\d|[^\w\s]|_")
+
+# Words whose trailing period does not end a sentence
+ABBREVIATIONS = {
+    "mr.", "mrs.", "ms.", "dr.", "prof.", "st.", "vs.", "etc.", "e.g.", "i.e.",
+    "inc.", "ltd.", "co.", "jr.", "sr.", "no.", "fig.", "approx.", "ca.",
+}
+
+
+@lru_cache(maxsize=1 << 16)
+def word_tokens(word: str) -> int:
+    """Approximate BPE token count of one whitespace-delimited word."""
+    count = 0
+    for piece in TOKEN_PIECE.findall(word):
+        count += (len(piece) + 3) // 4 if piece.isalpha() else 1
+    return max(count, 1)
+
+
+def count_tokens(text: str) -> int:
+    return sum(word_tokens(word) for word in text.split())
+
+
+class Chunk:
+    """A chunk of one section: its text (heading first), token count and heading path."""
+
+    def __init__(self, text: str, n_tokens: int, section: str):
+        self.text = text
+        self.n_tokens = n_tokens
+        self.section = section
+
+    def __repr__(self) -> str:
+        return f"Chunk({self.n_tokens} tokens, section={self.section!r}, text={self.text[:40]!r}...)"
+
+
+def split_sections(text: str) -> Iterator[Tuple[List[str], List[str]]]:
+    """(heading path, body lines) for each markdown section; text before any heading has no path."""
+    path: List[str] = []
+    levels: List[int] = []
+    lines: List[str] = []
+    for line in text.splitlines():
+        match = HEADING.match(line.strip())
+        if not match:
+            lines.append(line)
+            continue
+        if any(body.strip() for body in lines):
+            yield list(path), lines
+        lines = []
+        level = len(match.group(1))
+        while levels and levels[-1] >= level:
+            levels.pop()
+            path.pop()
+        levels.append(level)
+        path.append(match.group(2))
+    if any(body.strip() for body in lines):
+        yield list(path), lines
+
+
+def split_sentences(lines: List[str]) -> List[str]:
+    """Sentences and list items of a section body; wrapped lines are joined first."""
+    units: List[str] = []
+    paragraph: List[str] = []
+
+    def flush() -> None:
+        if paragraph:
+            units.extend(sentences_of(" ".join(paragraph)))
+            paragraph.clear()
+
+    for line in lines:
+        line = " ".join(line.split())
+        if not line:
+            flush()
+        elif LIST_ITEM.match(line):
+            flush()
+            units.append(line)
+        else:
+            paragraph.append(line)
+    flush()
+    return units
+
+
+def sentences_of(paragraph: str) -> List[str]:
+    sentences: List[str] = []
+    for piece in SENTENCE_BREAK.split(paragraph):
+        if sentences and ends_with_abbreviation(sentences[-1]):
+            sentences[-1] += " " + piece
+        else:
+            sentences.append(piece)
+    return sentences
+
+
+def ends_with_abbreviation(sentence: str) -> bool:
+    match = LAST_WORD.search(sentence)
+    word = match.group(1).lower() if match else ""
+    # Initials such as "Stephen B. Furber"
+    return word in ABBREVIATIONS or (len(word) == 2 and word[0].isalpha() and word[1] == ".")
+
+
+def split_long(sentence: str, max_tokens: int) -> List[str]:
+    """Word-split a sentence that alone is over budget."""
+    pieces, words, tokens = [], [], 0
+    for word in sentence.split():
+        cost = word_tokens(word)
+        if words and tokens + cost > max_tokens:
+            pieces.append(" ".join(words))
+            words, tokens = [], 0
+        words.append(word)
+        tokens += cost
+    if words:
+        pieces.append(" ".join(words))
+    return pieces
+
+
+def chunk_document(text: str, target_tokens: int = TARGET_TOKENS,
+                   overlap_tokens: int = OVERLAP_TOKENS) -> List[Chunk]:
+    """Chunks of about target_tokens each that respect headings and sentence boundaries."""
+    chunks: List[Chunk] = []
+    for path, lines in split_sections(text):
+        heading = path[-1] if path else ""
+        heading_tokens = count_tokens(heading)
+        budget = max(target_tokens - heading_tokens, 16)
+
+        units: List[Tuple[str, int]] = []
+        for sentence in split_sentences(lines):
+            tokens = count_tokens(sentence)
+            if tokens > budget:
+                units.extend((piece, count_tokens(piece)) for piece in split_long(sentence, budget))
+            else:
+                units.append((sentence, tokens))
+
+        window: List[Tuple[str, int]] = []
+        window_tokens = 0
+        for unit in units:
+            if window and window_tokens + unit[1] > budget:
+                chunks.append(make_chunk(heading, heading_tokens, path, window))
+                # Carry the trailing sentences that fit in the overlap into the next chunk
+                carried: List[Tuple[str, int]] = []
+                carried_tokens = 0
+                for previous in reversed(window):
+                    if carried_tokens + previous[1] > overlap_tokens or carried_tokens + previous[1] + unit[1] > budget:
+                        break
+                    carried.insert(0, previous)
+                    carried_tokens += previous[1]
+                window, window_tokens = carried, carried_tokens
+            window.append(unit)
+            window_tokens += unit[1]
+        if window:
+            chunks.append(make_chunk(heading, heading_tokens, path, window))
+    return chunks
+
+
+def make_chunk(heading: str, heading_tokens: int, path: List[str], window: List[Tuple[str, int]]) -> Chunk:
+    # Sentences run on; list items keep their own lines
+    body = ""
+    for sentence, _ in window:
+        if body:
+            body += "\n" if LIST_ITEM.match(sentence) or LIST_ITEM.match(last) else " "
+        body += sentence
+        last = sentence
+    text = heading + "\n" + body if heading else body
+    return Chunk(text, heading_tokens + sum(tokens for _, tokens in window), " > ".join(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show how a document is chunked")
+    parser.add_argument("path", help="Text or markdown document")
+    parser.add_argument("--target-tokens", type=int, default=TARGET_TOKENS,
+                        help=f"Tokens per chunk (default: {TARGET_TOKENS})")
+    parser.add_argument("--overlap-tokens", type=int, default=OVERLAP_TOKENS,
+                        help=f"Tokens of trailing sentences repeated in the next chunk (default: {OVERLAP_TOKENS})")
+    args = parser.parse_args()
+
+    with open(args.path, "r", encoding="utf-8", errors="ignore") as f:
+        chunks = chunk_document(f.read(), args.target_tokens, args.overlap_tokens)
+    for number, chunk in enumerate(chunks):
+        print(f"--- chunk {number}: {chunk.n_tokens} tokens [{chunk.section}]")
+        print(chunk.text)
+    print(f"{len(chunks)} chunks, {sum(c.n_tokens for c in chunks)} tokens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Transformers backend: a Hugging Face chat model run with PyTorch.
+
+The model is loaded under one of the inference profiles (fp16 on GPU,
+fp32 or dynamic int8 on CPU). Each serial session keeps its KV cache
+between turns, so only the new user turn is evaluated. With a batch size
+above 1, concurrent sessions are decoded together by batch_scheduler.py.
+"""
+
+import gc
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import request_log
+from arm_history import ArmHistory, format_user_turn
+from conversation import Conversation, ConversationStore, format_turn
+from llm_backends import SYSTEM_PROMPT, Backend, BackendError, CancelToken
+
+# torch and transformers take seconds to import on a Pi, so they are imported
+# inside the methods that need them rather than here
+
+logger = logging.getLogger(__name__)
+
+ERROR_REPLY = "Error: Unable to generate response"
+
+# Inference profiles: 'auto' picks gpu-fp16 when CUDA is available, cpu-int8 otherwise
+INFERENCE_PROFILES = ['auto', 'gpu-fp16', 'cpu-fp32', 'cpu-int8']
+
+BENCHMARK_PROMPT = "<|system|>\nYou are ArmGPT.</s>\n<|user|>\nTell me about the Acorn Archimedes.</s>\n<|assistant|>\n"
+
+
+class TransformersBackend(Backend):
+    """Hugging Face causal LM with per-session KV cache reuse."""
+
+    name = "transformers"
+
+    def __init__(self, model_name: str = 'TinyLlama/TinyLlama-1.1B-Chat-v1.0',
+                 profile: str = 'auto', num_threads: int = None, interop_threads: int = 1,
+                 compile_model: bool = False, max_context_tokens: int = 2048,
+                 reply_tokens: int = 500, batch_size: int = 1,
+                 index_path: str = 'data/arm_index.jsonl', ollama_url: str = None,
+                 context_tokens: int = 512):
+        """
+        Args:
+            model_name: Hugging Face model to use
+            profile: Inference profile, one of INFERENCE_PROFILES
+            num_threads: Intra-op CPU threads (default: all host cores)
+            interop_threads: Inter-op CPU threads
+            compile_model: Wrap the model forward pass with torch.compile
+            max_context_tokens: Context budget shared by conversation history and reply
+            reply_tokens: Maximum new tokens per reply
+            batch_size: Requests decoded together by continuous batching; 1 disables it
+            index_path: Documentation index from build_index.py
+            ollama_url: Ollama API base URL for query embeddings (None = BM25 only)
+            context_tokens: Token budget for retrieved documentation per message
+        """
+        self.model_name = model_name
+        self.profile = profile
+        self.num_threads = num_threads
+        self.interop_threads = interop_threads
+        self.compile_model = compile_model
+        self.max_context_tokens = max_context_tokens
+        self.reply_tokens = reply_tokens
+        self.batch_size = batch_size
+        self.scheduler = None
+        self.tokenizer = None
+        self.model = None
+        self.lock = threading.Lock()
+        self.arm_history = ArmHistory(index_path=index_path, max_tokens=context_tokens, ollama_url=ollama_url)
+        # Each conversation's model_state is (past_key_values, token ids they cover)
+        self.conversations = ConversationStore(
+            lambda: Conversation(SYSTEM_PROMPT, self.count_tokens, self.max_context_tokens)
+        )
+
+    def resolve_profile(self) -> str:
+        """Resolve the 'auto' profile to a concrete one for this host"""
+        import torch
+
+        if self.profile != 'auto':
+            return self.profile
+        return 'gpu-fp16' if torch.cuda.is_available() else 'cpu-int8'
+
+    def configure_cpu_threads(self):
+        """Match torch's CPU thread pools to the host's cores"""
+        import torch
+
+        threads = self.num_threads or os.cpu_count() or 1
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(self.interop_threads)
+        except RuntimeError as e:
+            # Inter-op threads can only be set before any parallel work has started
+            logger.warning(f"Could not set inter-op threads: {e}")
+        logger.info(f"Torch threads: intra-op={torch.get_num_threads()}, inter-op={torch.get_num_interop_threads()}")
+
+    def load_model(self, profile: str):
+        """Load the model for an inference profile"""
+        import torch
+        from transformers import AutoModelForCausalLM
+
+        if profile == 'gpu-fp16':
+            model = AutoModelForCausalLM.from_pretrained(
+                self.model_name,
+                torch_dtype=torch.float16,  # Use half precision for memory efficiency
+                device_map="auto"
+            )
+        else:
+            # fp16 matmuls are slow (or silently upcast) on CPU, so load in fp32
+            model = AutoModelForCausalLM.from_pretrained(
+                self.model_name,
+                torch_dtype=torch.float32
+            )
+            if profile == 'cpu-int8':
+                # Dynamic int8 quantization of the Linear layers; activations stay fp32
+                model = torch.ao.quantization.quantize_dynamic(
+                    model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+        model.eval()
+
+        if self.compile_model:
+            try:
+                model.forward = torch.compile(model.forward, dynamic=True)
+                logger.info("Model forward pass wrapped with torch.compile")
+            except Exception as e:
+                logger.warning(f"torch.compile unavailable, running eagerly: {e}")
+        return model
+
+    def init_llm(self) -> bool:
+        """Initialize the LLM model"""
+        try:
+            from transformers import AutoTokenizer
+
+            profile = self.resolve_profile()
+            logger.info(f"Loading model: {self.model_name} (profile: {profile})")
+            logger.info("This may take a few minutes on first run...")
+
+            if profile.startswith('cpu-'):
+                self.configure_cpu_threads()
+
+            # Load tokenizer and model
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            self.model = self.load_model(profile)
+
+            if self.batch_size > 1:
+                from batch_scheduler import BatchScheduler
+
+                self.scheduler = BatchScheduler(self.model, self.tokenizer, max_batch=self.batch_size)
+                self.scheduler.start()
+
+            logger.info("Model loaded successfully")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to load LLM model: {e}")
+            return False
+
+    def startup_tasks(self) -> List[Tuple[str, Callable[[], bool]]]:
+        return [("model", self.init_llm), ("docs", self.arm_history.load)]
+
+    def describe(self) -> List[Tuple[str, str]]:
+        details = [("Model", self.model_name), ("Profile", self.profile),
+                   ("Documentation", self.arm_history.describe())]
+        if self.batch_size > 1:
+            details.append(("Batch size", str(self.batch_size)))
+        return details
+
+    def benchmark_profiles(self, max_new_tokens: int = 32) -> Dict[str, float]:
+        """Time greedy generation under each inference profile and print tokens/sec"""
+        import torch
+        from transformers import AutoTokenizer
+
+        profiles = ['cpu-fp32', 'cpu-int8']
+        if torch.cuda.is_available():
+            profiles.insert(0, 'gpu-fp16')
+
+        self.configure_cpu_threads()
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        results = {}
+
+        print(f"\n⚡ Benchmarking {len(profiles)} inference profiles ({max_new_tokens} tokens each)...")
+        for profile in profiles:
+            try:
+                model = self.load_model(profile)
+                inputs = tokenizer(BENCHMARK_PROMPT, return_tensors="pt").to(model.device)
+                generate_args = dict(
+                    max_new_tokens=max_new_tokens,
+                    min_new_tokens=max_new_tokens,
+                    do_sample=False,
+                    pad_token_id=tokenizer.eos_token_id
+                )
+                with torch.inference_mode():
+                    # Warm-up pass so one-off allocation and compile costs are not timed
+                    model.generate(**inputs, **dict(generate_args, max_new_tokens=2, min_new_tokens=2))
+                    start_time = time.time()
+                    outputs = model.generate(**inputs, **generate_args)
+                    elapsed = time.time() - start_time
+
+                new_tokens = outputs.shape[-1] - inputs['input_ids'].shape[-1]
+                results[profile] = new_tokens / elapsed if elapsed > 0 else 0.0
+                logger.info(f"Benchmark {profile}: {results[profile]:.2f} tokens/sec")
+                print(f"    {profile:<10} {results[profile]:6.2f} tokens/sec")
+
+                del model
+                gc.collect()
+            except Exception as e:
+                logger.error(f"Benchmark {profile} failed: {e}")
+                print(f"    {profile:<10} failed: {e}")
+
+        return results
+
+    def count_tokens(self, text: str) -> int:
+        """Count model tokens in a piece of prompt text"""
+        return len(self.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+    def conversation_input_ids(self, conversation: Conversation, user_text: str) -> List[int]:
+        """Token ids for the next turn: the cached sequence plus only the new turn's tokens"""
+        turn_text = format_turn('user', user_text) + "<|assistant|>\n"
+        if conversation.model_state is None:
+            return self.tokenizer(conversation.render() + turn_text)['input_ids']
+
+        _, cached_ids = conversation.model_state
+        # Close the previous assistant turn unless generation already ended on </s>
+        closing = "\n" if cached_ids[-1] == self.tokenizer.eos_token_id else "</s>\n"
+        return cached_ids + self.tokenizer(closing + turn_text, add_special_tokens=False)['input_ids']
+
+    def generate(self, message: str, session_id: str = "default",
+                 cancel: Optional[CancelToken] = None) -> Iterator[str]:
+        """Stream a reply, continuing the session's conversation"""
+        if self.scheduler is not None:
+            yield from self.generate_batched(message, session_id, cancel)
+            return
+
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        # Also set when the caller stops reading early, so generate() never
+        # keeps the model busy after this request has gone
+        stop = threading.Event()
+
+        class StopRequested(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                done = stop.is_set() or (cancel is not None and cancel.cancelled())
+                return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+        with self.lock:
+            conversation = self.conversations.get(session_id)
+            user_text = format_user_turn(message, self.arm_history.relevant(message))
+
+            if conversation.fit(user_text, self.reply_tokens):
+                logger.info(f"Conversation trimmed to {len(conversation.turns)} turns to fit context")
+
+            # Tokenize; with a cached state only the new turn still needs evaluating
+            input_ids = torch.tensor(
+                [self.conversation_input_ids(conversation, user_text)], device=self.model.device
+            )
+            past_key_values, cached_ids = conversation.model_state or (None, [])
+            logger.info(f"Prompt tokens: {input_ids.shape[-1]} ({len(cached_ids)} cached)")
+            request_log.note(prompt_tokens=input_ids.shape[-1], cached_tokens=len(cached_ids),
+                             cache="hit" if cached_ids else "miss")
+
+            # generate() blocks until the reply is complete, so it runs on its own
+            # thread and the streamer hands decoded text back as it is produced
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            result = {}
+
+            def run_generate():
+                try:
+                    with torch.inference_mode():
+                        result['outputs'] = self.model.generate(
+                            input_ids=input_ids,
+                            attention_mask=torch.ones_like(input_ids),
+                            past_key_values=past_key_values,
+                            max_new_tokens=self.reply_tokens,  # High limit for complete responses
+                            temperature=0.7,
+                            do_sample=True,
+                            top_p=0.95,
+                            pad_token_id=self.tokenizer.eos_token_id,
+                            return_dict_in_generate=True,
+                            stopping_criteria=StoppingCriteriaList([StopRequested()]),
+                            streamer=streamer
+                        )
+                except Exception as e:
+                    result['error'] = e
+                    streamer.end()
+
+            thread = threading.Thread(target=run_generate, name="transformers-generate", daemon=True)
+            thread.start()
+
+            parts = []
+            try:
+                for text in streamer:
+                    if text:
+                        parts.append(text)
+                        yield text
+            except GeneratorExit:
+                # The cache was extended in place by a reply that is not recorded
+                conversation.model_state = None
+                raise
+            finally:
+                stop.set()
+                thread.join()
+            if cancel and cancel.cancelled():
+                logger.info(f"Generation cancelled after {len(parts)} chunks")
+
+            if 'error' in result:
+                logger.error(f"Error generating response: {result['error']}")
+                # The cache may be partially extended; rebuild it from text next turn
+                conversation.model_state = None
+                raise BackendError(ERROR_REPLY)
+
+            # Keep the KV cache so the next turn only evaluates its own tokens
+            outputs = result['outputs']
+            request_log.note(completion_tokens=outputs.sequences.shape[-1] - input_ids.shape[-1])
+            conversation.model_state = (outputs.past_key_values, outputs.sequences[0].tolist())
+            conversation.add_turn(user_text, "".join(parts).strip())
+
+    def generate_batched(self, message: str, session_id: str,
+                         cancel: Optional[CancelToken]) -> Iterator[str]:
+        """Stream a reply decoded alongside other sessions' replies by the batch scheduler"""
+        # The lock only covers conversation bookkeeping, so sessions decode concurrently
+        with self.lock:
+            conversation = self.conversations.get(session_id)
+            user_text = format_user_turn(message, self.arm_history.relevant(message))
+            if conversation.fit(user_text, self.reply_tokens):
+                logger.info(f"Conversation trimmed to {len(conversation.turns)} turns to fit context")
+            input_ids = self.conversation_input_ids(conversation, user_text)
+            past = conversation.model_state[0] if conversation.model_state else None
+            request_log.note(prompt_tokens=len(input_ids), cache="hit" if past is not None else "miss")
+
+        sequence = self.scheduler.submit(input_ids, past, max_new_tokens=self.reply_tokens, cancel=cancel)
+        parts = []
+        try:
+            for text in self.scheduler.stream(sequence):
+                parts.append(text)
+                yield text
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            with self.lock:
+                conversation.model_state = None
+            raise BackendError(ERROR_REPLY)
+
+        with self.lock:
+            # The scheduler hands back this sequence's own KV cache for the next turn
+            conversation.model_state = (sequence.final_past, sequence.input_ids + sequence.generated)
+            request_log.note(completion_tokens=len(sequence.generated))
+            conversation.add_turn(user_text, "".join(parts).strip())
+
+    def close(self) -> None:
+        if self.scheduler is not None:
+            logger.info(f"Batch scheduler: {self.scheduler.summary()}")
+            self.scheduler.stop()
+        self.model = None
+        gc.collect()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+wire_compression.py — Compact reply encoding for slow serial links.
+
+Once replies stream, the wire is the bottleneck at 9600 baud. The Acorn
+can ask for a compact mode per session by sending `*WIRE <mode>`:
+
+    plain    UTF-8 as generated (the default)
+    compact  Latin-1 (the RISC OS character set), with typographic
+             punctuation mapped to ASCII and repeated whitespace collapsed
+    dict     compact, plus the DICTIONARY substrings sent as single bytes
+             &80-&9F, which Latin-1 text never uses
+
+acorn/Decomp.bas expands dict-mode replies on the Archimedes. It is
+generated from DICTIONARY, so regenerate it whenever the table changes:
+
+    python wire_compression.py --emit-basic > acorn/Decomp.bas
+    python wire_compression.py --stats data/arm_docs/*.txt
+"""
+
+import argparse
+import re
+import sys
+import unicodedata
+from typing import List
+
+WIRE_COMMAND = "*WIRE"
+WIRE_MODES = ["plain", "compact", "dict"]
+
+DICT_BASE = 0x80
+
+# Common substrings of ArmGPT replies, at most 32 so codes stay within &80-&9F.
+# Order is the code order; matching is longest-first.
+DICTIONARY = [
+    " the ", "ing ", " and ", "tion", " of ", " to ", " you", " is ",
+    " in ", "ed ", " that", " for", " with", "er ", " was ", " it ",
+    " are ", " can ", " be ", "Acorn", "ARM", "Archimedes", "RISC OS", "ArmGPT",
+    "computer", "processor", "Sophie Wilson", "Steve Furber", "'s ", ". ", ", ", "The ",
+]
+
+# Typographic characters LLMs like to produce, mapped to what RISC OS can show
+PUNCTUATION = {
+    "‘": "'", "’": "'", "‚": "'", "‛": "'",
+    "“": '"', "”": '"', "„": '"', "′": "'", "″": '"',
+    "–": "-", "—": "-", "‒": "-", "−": "-", "‐": "-", "‑": "-",
+    "…": "...", "•": "*", " ": " ", " ": " ", "​": "",
+    "™": "(TM)", "→": "->", "←": "<-",
+}
+
+HORIZONTAL_SPACE = re.compile(r"[ \t\r\f\v]+")
+LINE_BREAKS = re.compile(r" ?\n[ \n]*")
+
+
+def to_latin1(text: str) -> str:
+    """Map text onto printable Latin-1, replacing anything else with '?'."""
+    out = []
+    for char in text:
+        char = PUNCTUATION.get(char, char)
+        if len(char) == 1 and ord(char) > 0xFF:
+            # Drop accents from characters outside Latin-1, e.g. 'ł' -> 'l'
+            decomposed = unicodedata.normalize("NFKD", char)
+            char = "".join(c for c in decomposed if not unicodedata.combining(c))
+            if not char or any(ord(c) > 0xFF for c in char):
+                char = "?"
+        if len(char) == 1 and 0x80 <= ord(char) < 0xA0:
+            char = "?"  # C1 controls; dict mode uses these codes
+        out.append(char)
+    return "".join(out)
+
+
+def collapse_whitespace(text: str) -> str:
+    return LINE_BREAKS.sub("\n", HORIZONTAL_SPACE.sub(" ", text))
+
+
+class WireEncoder:
+    """Streaming encoder for one reply at a time, with running byte counts."""
+
+    def __init__(self, mode: str = "plain"):
+        if mode not in WIRE_MODES:
+            raise ValueError(f"Unknown wire mode {mode!r}")
+        self.mode = mode
+        self.pending = ""
+        self.reply_raw_bytes = 0
+        self.reply_wire_bytes = 0
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.entries = sorted(enumerate(DICTIONARY), key=lambda entry: -len(entry[1]))
+
+    def compress(self, text: str) -> bytes:
+        out = bytearray()
+        position = 0
+        while position < len(text):
+            for code, entry in self.entries:
+                if text.startswith(entry, position):
+                    out.append(DICT_BASE + code)
+                    position += len(entry)
+                    break
+            else:
+                out += text[position].encode("latin-1")
+                position += 1
+        return bytes(out)
+
+    def pack(self, text: str) -> bytes:
+        text = collapse_whitespace(to_latin1(text))
+        if self.mode == "dict":
+            return self.compress(text)
+        return text.encode("latin-1")
+
+    def encode(self, text: str) -> bytes:
+        """Encode a chunk of reply text; a partial last word is held until the next chunk."""
+        self.reply_raw_bytes += len(text.encode("utf-8"))
+        if self.mode == "plain":
+            data = text.encode("utf-8")
+        else:
+            # Hold back from the last whitespace, so whitespace runs and
+            # dictionary entries that span chunks are still seen whole
+            text = self.pending + text
+            cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+            while cut > 0 and text[cut - 1] in " \n\t":
+                cut -= 1
+            if cut <= 0:
+                self.pending = text
+                return b""
+            self.pending = text[cut:]
+            data = self.pack(text[:cut])
+        self.reply_wire_bytes += len(data)
+        return data
+
+    def finish(self) -> bytes:
+        """Encode whatever is still held back and close the reply's byte counts."""
+        data = self.pack(self.pending) if self.pending else b""
+        self.pending = ""
+        self.reply_wire_bytes += len(data)
+        self.raw_bytes += self.reply_raw_bytes
+        self.wire_bytes += self.reply_wire_bytes
+        return data
+
+    def start_reply(self) -> None:
+        self.pending = ""
+        self.reply_raw_bytes = 0
+        self.reply_wire_bytes = 0
+
+    def summary(self) -> str:
+        saved = self.raw_bytes - self.wire_bytes
+        percent = 100.0 * saved / self.raw_bytes if self.raw_bytes else 0.0
+        return "%s mode, %d bytes sent for %d bytes of text (%d saved, %.1f%%)" % (
+            self.mode, self.wire_bytes, self.raw_bytes, saved, percent)
+
+
+def decode(data: bytes) -> str:
+    """Expand a compact or dict-mode reply, as acorn/Decomp.bas does."""
+    out = []
+    for byte in data:
+        if DICT_BASE <= byte < DICT_BASE + len(DICTIONARY):
+            out.append(DICTIONARY[byte - DICT_BASE])
+        else:
+            out.append(chr(byte))
+    return "".join(out)
+
+
+def basic_string(text: str) -> str:
+    return '"' + text.replace('"', '""') + '"'
+
+
+def emit_basic() -> str:
+    """BBC BASIC decompressor with the current DICTIONARY as DATA."""
+    last_code = DICT_BASE + len(DICTIONARY) - 1
+    source = [
+        "REM > Decomp",
+        "REM ArmGPT dict-mode reply decompressor for RISC OS",
+        "REM Generated by wire_compression.py --emit-basic; regenerate rather",
+        "REM than editing the DATA. Sends *WIRE dict, then shows each reply.",
+        "DIM dict$(%d)" % (len(DICTIONARY) - 1),
+        "RESTORE",
+        "FOR i%%=0 TO %d:READ dict$(i%%):NEXT" % (len(DICTIONARY) - 1),
+        'PROCsend("*WIRE dict")',
+        'IF FNreadline<>"WIRE dict" THEN PRINT "Host does not support dict mode":END',
+        "REPEAT",
+        '  INPUT LINE "> " q$',
+        "  PROCsend(q$)",
+        "  PROCshowreply",
+        "UNTIL FALSE",
+        "END",
+        "REM Print one reply line, expanding codes &80-&%X as they arrive" % last_code,
+        "REM (expanded replies can be longer than a BASIC string)",
+        "DEF PROCshowreply",
+        "LOCAL r0%,c%,f%",
+        "REPEAT",
+        '  SYS "OS_SerialOp",4 TO r0%,c%;f%',
+        "  IF (f% AND 2)=0 THEN",
+        "    IF c%%>=&80 AND c%%<=&%X THEN PRINT dict$(c%%-&80); ELSE IF c%%>=32 THEN VDU c%%" % last_code,
+        "  ENDIF",
+        "UNTIL (f% AND 2)=0 AND c%=10",
+        "PRINT",
+        "ENDPROC",
+        "DEF PROCsend(a$)",
+        "LOCAL i%,c%,f%",
+        "FOR i%=1 TO LEN(a$)+1",
+        "  IF i%>LEN(a$) THEN c%=10 ELSE c%=ASC(MID$(a$,i%,1))",
+        '  REPEAT:SYS "OS_SerialOp",3,c% TO ;f%:UNTIL (f% AND 2)=0',
+        "NEXT",
+        "ENDPROC",
+        "DEF FNreadline",
+        "LOCAL l$,r0%,c%,f%",
+        "REPEAT",
+        '  SYS "OS_SerialOp",4 TO r0%,c%;f%',
+        "  IF (f% AND 2)=0 AND c%>=32 AND LEN(l$)<255 THEN l$+=CHR$c%",
+        "UNTIL (f% AND 2)=0 AND c%=10",
+        "=l$",
+    ]
+    for start in range(0, len(DICTIONARY), 4):
+        source.append("DATA " + ",".join(basic_string(entry) for entry in DICTIONARY[start:start + 4]))
+    return "\n".join("%5d %s" % (10 * (number + 1), line) for number, line in enumerate(source)) + "\n"
+
+
+def print_stats(paths: List[str]) -> None:
+    """Report the bytes each mode would put on the wire for sample text."""
+    totals = {mode: 0 for mode in WIRE_MODES}
+    raw = 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        raw += len(text.encode("utf-8"))
+        for mode in WIRE_MODES:
+            encoder = WireEncoder(mode)
+            encoder.start_reply()
+            data = encoder.encode(text) + encoder.finish()
+            if mode != "plain":
+                assert decode(data) == collapse_whitespace(to_latin1(text)), f"round trip failed for {path}"
+            totals[mode] += len(data)
+
+    print(f"{len(paths)} files, {raw} bytes of UTF-8")
+    for mode in WIRE_MODES:
+        saved = 100.0 * (raw - totals[mode]) / raw if raw else 0.0
+        print(f"    {mode:<8} {totals[mode]:8d} bytes  ({saved:5.1f}% saved)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ArmGPT wire compression tools")
+    parser.add_argument("--emit-basic", action="store_true",
+                        help="Print the BBC BASIC decompressor for the current dictionary")
+    parser.add_argument("--stats", nargs="+", metavar="FILE",
+                        help="Report bytes saved by each wire mode on sample text")
+    args = parser.parse_args()
+
+    if args.emit_basic:
+        sys.stdout.write(emit_basic())
+    elif args.stats:
+        print_stats(args.stats)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()